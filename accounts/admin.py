@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import FriendShip, User
+from .models import AccountDeletion, FriendShip, User
 
 
 class UserAdmin(admin.ModelAdmin):
@@ -9,3 +9,4 @@ class UserAdmin(admin.ModelAdmin):
 
 admin.site.register(User, UserAdmin)
 admin.site.register(FriendShip)
+admin.site.register(AccountDeletion)
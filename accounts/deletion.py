@@ -0,0 +1,108 @@
+"""
+退会したユーザーの削除。
+
+User.delete() は、ユーザーのツイートをすべて読み込んでから依存する行をまとめて消し、
+ほかのユーザーのフォロー数やツイートのいいね数はずれたまま残す。
+request_deletion はユーザーを無効にして AccountDeletion を作るだけで、実際の削除は delete_accounts コマンド
+(DEFER_JOBS のときは accounts.tasks.delete_account ジョブ) が段階 (STAGES) ごとに DELETION_CHUNK_SIZE 件ずつ進める。
+1塊消すたびに進み具合を保存するので、途中で止まってももう一度動かせば続きから消せる。
+FriendShip(following=A, follower=B) は「A が B をフォローしている」ことを表す。
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.models import AccountDeletion, FollowSuggestion, FriendShip, User
+from tweets.deletion import delete_chunk, delete_likes, delete_tweets
+from tweets.models import Like, Mention, TimelineEntry, Tweet
+
+
+def _likes(user_id, chunk_size):
+    return delete_likes(Like.objects.filter(user_id=user_id), chunk_size)
+
+
+def _friendships(field, other, counter):
+    """field が消すユーザーの FriendShip を消し、other 側のユーザーの counter を1ずつ減らす段階を作る。"""
+
+    def stage(user_id, chunk_size):
+        with transaction.atomic():
+            rows = list(
+                FriendShip.objects.select_for_update()
+                .filter(**{field: user_id})
+                .order_by("pk")
+                .values_list("pk", other)[:chunk_size]
+            )
+            FriendShip.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+            User.objects.filter(pk__in=[pk for _, pk in rows], **{f"{counter}__gt": 0}).update(
+                **{counter: F(counter) - 1, "updated_at": timezone.now()}
+            )
+        return len(rows)
+
+    return stage
+
+
+def _tweets(user_id, chunk_size):
+    tweets = list(Tweet.objects.filter(user_id=user_id).order_by("pk").only("user", "created_at")[:chunk_size])
+    return delete_tweets(tweets, chunk_size)
+
+
+def _rows(model, field):
+    def stage(user_id, chunk_size):
+        return delete_chunk(model.objects.filter(**{field: user_id}), chunk_size)
+
+    return stage
+
+
+def _user(user_id, chunk_size):
+    # 依存する行は前の段階で消してあるので、ここでは本人の行 (と管理画面の履歴など) だけが消える
+    deleted, _ = User.objects.filter(pk=user_id).delete()
+    return deleted
+
+
+# (段階の名前, 1塊を消して消した行数を返す関数)。関数が 0 を返したら次の段階へ進む
+STAGES = [
+    ("likes", _likes),
+    ("followings", _friendships("following", "follower", "follower_count")),
+    ("followers", _friendships("follower", "following", "following_count")),
+    ("tweets", _tweets),
+    ("timeline", _rows(TimelineEntry, "owner_id")),
+    ("mentions", _rows(Mention, "user_id")),
+    ("suggestions", _rows(FollowSuggestion, "user_id")),
+    ("suggested", _rows(FollowSuggestion, "candidate_id")),
+    ("user", _user),
+]
+
+
+def request_deletion(user):
+    """user を無効にして削除を予約し、その AccountDeletion を返す。無効にしたユーザーはログインできない。"""
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        deletion, _ = AccountDeletion.objects.get_or_create(
+            user_id=user.pk, defaults={"username": user.username, "stage": STAGES[0][0]}
+        )
+    return deletion
+
+
+def run(deletion, chunk_size=None, max_chunks=None):
+    """
+    deletion を保存されている段階から進め、消し終えたら True を返す。
+    max_chunks を指定したときは、その数の塊を消したところで False を返して止まる。
+    """
+    chunk_size = chunk_size or settings.DELETION_CHUNK_SIZE
+    names = [name for name, _ in STAGES]
+    chunks = 0
+    while deletion.finished_at is None:
+        if max_chunks is not None and chunks >= max_chunks:
+            return False
+        deleted = dict(STAGES)[deletion.stage](deletion.user_id, chunk_size)
+        if deleted:
+            deletion.deleted_rows += deleted
+            chunks += 1
+        elif deletion.stage == names[-1]:
+            deletion.finished_at = timezone.now()
+        else:
+            deletion.stage = names[names.index(deletion.stage) + 1]
+        deletion.save(update_fields=["stage", "deleted_rows", "updated_at", "finished_at"])
+    return True
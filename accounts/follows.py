@@ -0,0 +1,52 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts import suggestions, tasks
+from accounts.models import FriendShip, User
+from jobs.queue import enqueue
+
+
+def follow(user, target):
+    """user が target をフォローする。新たにフォローした場合だけ True を返す。"""
+    with transaction.atomic():
+        _, created = FriendShip.objects.get_or_create(following=user, follower=target)
+        if created:
+            now = timezone.now()
+            User.objects.filter(pk=user.pk).update(following_count=F("following_count") + 1, updated_at=now)
+            User.objects.filter(pk=target.pk).update(follower_count=F("follower_count") + 1, updated_at=now)
+    if created:
+        target.refresh_from_db(fields=["follower_count"])
+        enqueue(tasks.sync_timeline, user.pk, target.pk)
+        suggestions.record_follow(user, target)
+    return created
+
+
+def unfollow(user, target):
+    """user が target のフォローを解除する。フォローしていた場合だけ True を返す。"""
+    with transaction.atomic():
+        deleted, _ = FriendShip.objects.filter(following=user, follower=target).delete()
+        if deleted:
+            now = timezone.now()
+            User.objects.filter(pk=user.pk, following_count__gt=0).update(
+                following_count=F("following_count") - 1, updated_at=now
+            )
+            User.objects.filter(pk=target.pk, follower_count__gt=0).update(
+                follower_count=F("follower_count") - 1, updated_at=now
+            )
+    if deleted:
+        enqueue(tasks.sync_timeline, user.pk, target.pk)
+        suggestions.record_unfollow(user, target)
+    return bool(deleted)
+
+
+# 非同期版。FriendShip とカウンタを1つのトランザクションで書くよう、同期版をスレッドで実行する。
+
+
+async def afollow(user, target):
+    return await sync_to_async(follow)(user, target)
+
+
+async def aunfollow(user, target):
+    return await sync_to_async(unfollow)(user, target)
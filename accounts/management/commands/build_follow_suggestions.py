@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.suggestions import FollowGraph, rebuild
+
+
+class Command(BaseCommand):
+    help = "FriendShip 全体からフォローのおすすめを計算し直し、FollowSuggestion を入れ替えます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        graph = FollowGraph.load()
+        loaded = time.perf_counter()
+        users = rebuild(options["batch_size"], graph=graph)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{users}人のおすすめを書き込みました "
+                f"(ユーザー {len(graph)}人、フォロー {len(graph.indices)}件、"
+                f"読み込み {loaded - start:.1f}秒、計算と書き込み {time.perf_counter() - loaded:.1f}秒)。"
+            )
+        )
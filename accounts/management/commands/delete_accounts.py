@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import deletion
+from accounts.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    help = "退会したユーザーのデータを、依存する行から少しずつ削除します。中断しても続きから再開できます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--interval", type=float, default=0, help="指定した秒数ごとに新しい退会を処理し続けます。")
+
+    def handle(self, *args, **options):
+        while True:
+            for job in AccountDeletion.objects.filter(finished_at__isnull=True).order_by("pk"):
+                # 1塊ごとに進み具合を表示する
+                while not deletion.run(job, options["batch_size"], max_chunks=1):
+                    if options["verbosity"] >= 2:
+                        self.stdout.write(f"{job.username}: {job.stage} ({job.deleted_rows}行を削除済み)")
+                self.stdout.write(self.style.SUCCESS(f"{job.username} の {job.deleted_rows}行を削除しました。"))
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
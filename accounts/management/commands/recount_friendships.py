@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import FriendShip, User
+
+
+def _counts(field):
+    return (
+        FriendShip.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(c=Count("pk"))
+        .values("c")
+    )
+
+
+class Command(BaseCommand):
+    help = "FriendShip から User.following_count / follower_count を再計算し、ずれているユーザーを一括で修正します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="修正せずにずれている件数だけを表示します。")
+
+    def handle(self, *args, **options):
+        drifted = User.objects.annotate(
+            actual_following=Coalesce(Subquery(_counts("following")), 0),
+            actual_follower=Coalesce(Subquery(_counts("follower")), 0),
+        ).filter(~Q(following_count=F("actual_following")) | ~Q(follower_count=F("actual_follower")))
+
+        last_pk, repaired = 0, 0
+        while True:
+            pks = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            now = timezone.now()
+            batch = [
+                User(pk=pk, following_count=following, follower_count=follower, updated_at=now)
+                for pk, following, follower in drifted.filter(pk__in=pks).values_list(
+                    "pk", "actual_following", "actual_follower"
+                )
+            ]
+            if batch and not options["dry_run"]:
+                with transaction.atomic():
+                    User.objects.bulk_update(batch, ["following_count", "follower_count", "updated_at"])
+            repaired += len(batch)
+
+        verb = "件のずれを検出しました" if options["dry_run"] else "人のユーザーを修正しました"
+        self.stdout.write(self.style.SUCCESS(f"{repaired}{verb}。"))
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_friendship_counts(apps, schema_editor):
+    FriendShip = apps.get_model("accounts", "FriendShip")
+    User = apps.get_model("accounts", "User")
+
+    def counts(field):
+        return (
+            FriendShip.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(c=Count("pk"))
+            .values("c")
+        )
+
+    User.objects.update(
+        following_count=Coalesce(Subquery(counts("following")), 0),
+        follower_count=Coalesce(Subquery(counts("follower")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_friendship_following"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="follower_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_friendship_counts, migrations.RunPython.noop),
+    ]
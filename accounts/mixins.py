@@ -0,0 +1,75 @@
+import hashlib
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.messages import get_messages
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+class AsyncLoginRequiredMixin:
+    """
+    非同期ビュー用の LoginRequiredMixin。
+    request.user の遅延評価は非同期コンテキストでDBに触れられないため、先に同期スレッドで解決しておく。
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await sync_to_async(get_user)(request)
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    get_version が返す安価な版数から ETag を、get_last_modified が返す日時から Last-Modified を作り、
+    If-None-Match や If-Modified-Since と一致すれば描画せずに 304 を返す。
+    ページは閲覧者ごとに違うので、版数には閲覧者とフォームに埋め込む CSRF トークンも含め、共有キャッシュには載せない。
+    """
+
+    def get_version(self):
+        """
+        ETag の元にする値のリスト。サブクラスで必ず実装する。
+        ページに描く内容が変わると必ず変わり、描画に要るクエリを流さずに求められる値にする。
+        """
+        raise NotImplementedError(f"{type(self).__name__} は get_version を実装してください。")
+
+    def get_last_modified(self):
+        """ページに描く内容が最後に変わった日時。単調に進む日時を持たないビューは None のままにする。"""
+        return None
+
+    def get_last_modified_timestamp(self):
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            return None
+        # ログインし直すと CSRF トークンが変わるので、閲覧者がログインした日時より前にはしない
+        last_modified = max(filter(None, [last_modified, self.request.user.last_login]))
+        # Last-Modified は秒単位なので、同じ秒のうちにもう一度変わると区別できない。1秒経つまでは付けない
+        if timezone.now() - last_modified < timedelta(seconds=1):
+            return None
+        return int(last_modified.timestamp())
+
+    def get_etag(self):
+        version = [self.request.user.pk, self.request.COOKIES.get(settings.CSRF_COOKIE_NAME), *self.get_version()]
+        return '"%s"' % hashlib.md5(repr(version).encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        # 表示待ちのメッセージはページに描き込まれるので、その応答には ETag を付けない
+        if len(get_messages(request)):
+            response = super().get(request, *args, **kwargs)
+        else:
+            etag = self.get_etag()
+            last_modified = self.get_last_modified_timestamp()
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = super().get(request, *args, **kwargs)
+            response.headers["ETag"] = etag
+            if last_modified is not None:
+                response.headers["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Cookie"])
+        return response
@@ -5,6 +5,11 @@ from django.db import models
 
 class User(AbstractUser):
     email = models.EmailField("email address", unique=True)
+    following_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    # フォロー数やツイートの削除などプロフィールに描く内容が変わるたびに進める。
+    # queryset.update() では自動で進まないので、カウンタと一緒に書き込む
+    updated_at = models.DateTimeField(auto_now=True)
 
     followings = models.ManyToManyField(
         "self",
@@ -26,3 +31,34 @@ class FriendShip(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["follower", "following"], name="unique_friendship")]
+        indexes = [
+            models.Index(fields=["following", "-created_at", "-id"], name="friendship_following_idx"),
+            models.Index(fields=["follower", "-created_at", "-id"], name="friendship_follower_idx"),
+        ]
+
+
+class FollowSuggestion(models.Model):
+    """「フォロー中のユーザーがフォローしている」おすすめ。score はそのようなフォロー中のユーザーの数。"""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="follow_suggestions", on_delete=models.CASCADE)
+    candidate = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "candidate"], name="unique_follow_suggestion")]
+        indexes = [models.Index(fields=["user", "-score", "candidate"], name="follow_suggestion_score_idx")]
+
+
+class AccountDeletion(models.Model):
+    """
+    退会したユーザーの削除の進み具合。ユーザーの行を消した後も残すので、ユーザーへの外部キーにはしない。
+    stage はこれから消す段階の名前 (accounts.deletion.STAGES) で、すべて消し終えたら finished_at が入る。
+    """
+
+    user_id = models.BigIntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    stage = models.CharField(max_length=32)
+    deleted_rows = models.PositiveBigIntegerField(default=0)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
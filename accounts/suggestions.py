@@ -0,0 +1,170 @@
+"""
+「フォロー中のユーザーがフォローしている」ユーザーのおすすめ。
+
+リクエストのたびに FriendShip を2段に結合すると、フォローの多いグラフでは遅くなる。そこで build_follow_suggestions コマンドが
+FriendShip 全体を CSR 形式の隣接配列 (FollowGraph) に読み込み、ユーザーごとに友達の友達を数え、上位
+FOLLOW_SUGGESTION_SIZE 件を FollowSuggestion に書き込む。ホーム画面はそれを読むだけ。
+フォローとフォロー解除のたびに、影響するおすすめの点数だけをその場で増減させる (record_follow / record_unfollow)。
+FriendShip(following=A, follower=B) は「A が B をフォローしている」ことを表す。
+"""
+
+import heapq
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from accounts.models import FollowSuggestion, FriendShip
+
+
+class FollowGraph:
+    """
+    フォローの向きの隣接リストを CSR 形式で持つ。ユーザーは nodes 内の位置 (0, 1, ...) で表し、
+    位置 i のユーザーがフォローしているユーザーの位置は indices[indptr[i]:indptr[i + 1]] に並ぶ。
+    """
+
+    def __init__(self, nodes, indptr, indices):
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def load(cls, chunk_size=10000):
+        sources, targets = array("q"), array("q")
+        edges = FriendShip.objects.order_by("following", "follower").values_list("following", "follower")
+        for source, target in edges.iterator(chunk_size=chunk_size):
+            sources.append(source)
+            targets.append(target)
+        return cls.from_edges(sources, targets)
+
+    @classmethod
+    def from_edges(cls, sources, targets):
+        """フォローする側の ID 順に並んだ辺 (sources[k] が targets[k] をフォロー) から作る。"""
+        nodes = array("q", sorted(set(sources) | set(targets)))
+        position = {pk: i for i, pk in enumerate(nodes)}
+        degrees = Counter(position[source] for source in sources)
+        indptr = array("q", [0]) * (len(nodes) + 1)
+        for i in range(len(nodes)):
+            indptr[i + 1] = indptr[i] + degrees[i]
+        indices = array("i", (position[target] for target in targets))
+        return cls(nodes, indptr, indices)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def followees(self, i):
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def suggest(self, i, limit):
+        """位置 i のユーザーへのおすすめを [(ユーザーID, 点数)] で点数の高い順に返す。"""
+        followees = self.followees(i)
+        counts = Counter()
+        for followee in followees:
+            # 配列の切り出しを Counter にそのまま渡し、数える処理を C のループに任せる
+            counts.update(self.followees(followee))
+        for excluded in followees:
+            counts.pop(excluded, None)
+        counts.pop(i, None)
+        # 位置は ID 順なので、位置順に並べてから安定な nlargest にかけると同点は ID の小さい順になる
+        top = heapq.nlargest(limit, sorted(counts), key=counts.__getitem__)
+        return [(self.nodes[candidate], counts[candidate]) for candidate in top]
+
+
+def _insert_sql(connection):
+    quote = connection.ops.quote_name
+    columns = [FollowSuggestion._meta.get_field(name).column for name in ("user", "candidate", "score")]
+    return "INSERT INTO %s (%s) VALUES (%s)" % (
+        quote(FollowSuggestion._meta.db_table),
+        ", ".join(quote(column) for column in columns),
+        ", ".join(["%s"] * len(columns)),
+    )
+
+
+def rebuild(batch_size=1000, graph=None):
+    """全ユーザーのおすすめを作り直し、おすすめを書き込んだユーザー数を返す。"""
+    if graph is None:
+        graph = FollowGraph.load()
+    using = router.db_for_write(FollowSuggestion)
+    sql = _insert_sql(connections[using])
+    limit = settings.FOLLOW_SUGGESTION_SIZE
+    written, last = 0, 0
+    for start in range(0, len(graph), batch_size):
+        positions = range(start, min(start + batch_size, len(graph)))
+        # 件数が多いので、モデルインスタンスを作らずに executemany で挿入する
+        rows = [(graph.nodes[i], candidate, score) for i in positions for candidate, score in graph.suggest(i, limit)]
+        # ID の範囲ごとに入れ替えるので、グラフに現れないユーザーの古いおすすめも消える
+        upper = graph.nodes[positions[-1]]
+        with transaction.atomic(using=using):
+            FollowSuggestion.objects.using(using).filter(user_id__gt=last, user_id__lte=upper).delete()
+            with connections[using].cursor() as cursor:
+                cursor.executemany(sql, rows)
+        written += len({user_id for user_id, _, _ in rows})
+        last = upper
+    FollowSuggestion.objects.using(using).filter(user_id__gt=last).delete()
+    return written
+
+
+def _followee_ids(user):
+    return FriendShip.objects.filter(following=user).values("follower")
+
+
+def _follower_ids(user):
+    return FriendShip.objects.filter(follower=user).values("following")
+
+
+def record_follow(user, target):
+    """user が target をフォローしたときに、影響するおすすめの点数を1ずつ増やす。"""
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user=user, candidate=target).delete()
+        # user にとって、target がフォローしているユーザーが1人分おすすめになる
+        new_candidates = (
+            FriendShip.objects.filter(following=target)
+            .exclude(follower=user)
+            .exclude(follower__in=_followee_ids(user))
+            .values("follower")
+        )
+        FollowSuggestion.objects.filter(user=user, candidate__in=new_candidates).update(score=F("score") + 1)
+        missing = new_candidates.exclude(follower__in=FollowSuggestion.objects.filter(user=user).values("candidate"))
+        FollowSuggestion.objects.bulk_create(
+            [
+                FollowSuggestion(user=user, candidate_id=candidate_id, score=1)
+                for candidate_id in missing.values_list("follower", flat=True)[: settings.FOLLOW_SUGGESTION_SIZE]
+            ],
+            ignore_conflicts=True,
+        )
+        # user のフォロワーにとって、target が1人分おすすめになる。ここで増やすのはすでにおすすめにある分だけで、
+        # 新しく入る分は次の作り直しで拾う
+        FollowSuggestion.objects.filter(user__in=_follower_ids(user), candidate=target).update(score=F("score") + 1)
+
+
+def record_unfollow(user, target):
+    """user が target のフォローを解除したときに、record_follow で増えた点数を戻す。"""
+    with transaction.atomic():
+        old_candidates = FriendShip.objects.filter(following=target).values("follower")
+        decrement = {"score": F("score") - 1}
+        FollowSuggestion.objects.filter(user=user, candidate__in=old_candidates, score__gt=0).update(**decrement)
+        FollowSuggestion.objects.filter(user__in=_follower_ids(user), candidate=target, score__gt=0).update(
+            **decrement
+        )
+        FollowSuggestion.objects.filter(candidate=target, score=0).delete()
+        FollowSuggestion.objects.filter(user=user, score=0).delete()
+        # フォロー中のユーザーがフォローしていれば、target 自身がおすすめに戻る
+        mutuals = FriendShip.objects.filter(following__in=_followee_ids(user), follower=target).count()
+        if mutuals:
+            FollowSuggestion.objects.get_or_create(user=user, candidate=target, defaults={"score": mutuals})
+
+
+def suggestions_for(user, limit=None):
+    """user へのおすすめのユーザーを点数の高い順に返す。各ユーザーの score にはそのおすすめの点数が入る。"""
+    suggestions = (
+        FollowSuggestion.objects.filter(user=user)
+        .select_related("candidate")
+        .order_by("-score", "candidate")[: limit or settings.FOLLOW_SUGGESTION_SIZE]
+    )
+    users = []
+    for suggestion in suggestions:
+        suggestion.candidate.score = suggestion.score
+        users.append(suggestion.candidate)
+    return users
@@ -0,0 +1,29 @@
+from accounts import deletion
+from accounts.models import AccountDeletion, FriendShip, User
+from jobs.queue import enqueue, register
+from tweets import timeline
+
+# 1つのジョブで消す塊の数。残りは同じジョブを積み直して続け、ほかのジョブを長く待たせない
+DELETION_CHUNKS_PER_JOB = 100
+
+
+@register("accounts.sync_timeline")
+def sync_timeline(owner_id, followee_id):
+    """
+    owner のタイムラインを、followee をフォローしているかどうかに合わせる。
+    フォローと解除のジョブが逆の順に実行されても、最後の状態に揃う。
+    """
+    users = User.objects.in_bulk([owner_id, followee_id])
+    if owner_id not in users or followee_id not in users:
+        return
+    if FriendShip.objects.filter(following_id=owner_id, follower_id=followee_id).exists():
+        timeline.backfill(users[owner_id], users[followee_id])
+    else:
+        timeline.trim(users[owner_id], users[followee_id])
+
+
+@register("accounts.delete_account")
+def delete_account(deletion_id):
+    job = AccountDeletion.objects.filter(pk=deletion_id, finished_at__isnull=True).first()
+    if job is not None and not deletion.run(job, max_chunks=DELETION_CHUNKS_PER_JOB):
+        enqueue(delete_account, deletion_id)
@@ -1,11 +1,25 @@
+from array import array
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY
 from django.contrib.messages import get_messages
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
-from accounts.models import FriendShip, User
-from tweets.models import Tweet
+from accounts import deletion
+from accounts.deletion import request_deletion
+from accounts.follows import follow
+from accounts.models import AccountDeletion, FollowSuggestion, FriendShip, User
+from accounts.suggestions import FollowGraph, suggestions_for
+from jobs.models import Job
+from tweets.likes import like_tweet
+from tweets.models import Like, TimelineEntry, Tweet
 
 
 class TestSignUpView(TestCase):
@@ -292,7 +306,8 @@ class TestUserProfileView(TestCase):
         )
         Tweet.objects.create(user=self.user01, content="test01")
         Tweet.objects.create(user=self.user02, content="test02")
-        FriendShip.objects.create(following=self.user01, follower=self.user02)
+        self.client.login(username="testuser01", password="password15432")
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
 
     def test_success_get(self):
         self.client.login(username="testuser01", password="password15432")
@@ -306,6 +321,75 @@ class TestUserProfileView(TestCase):
             response.context["following_numbers"], FriendShip.objects.filter(following__exact=self.user01).count()
         )
 
+    def test_success_get_with_bounded_queries(self):
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "testuser02"}))
+        self.assertEqual(response.context["followers_numbers"], 1)
+        self.assertEqual(response.context["following_numbers"], 0)
+        self.assertTrue(response.context["is_following"])
+
+        Tweet.objects.bulk_create([Tweet(user=self.user02, content=f"test{i:02}") for i in range(30)])
+        # 版数のためのツイートの最終更新日時が1クエリ増える
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "testuser02"}))
+        self.assertEqual(len(response.context["tweets"]), 20)
+        self.assertTrue(response.context["page_obj"].has_next())
+
+    def test_not_modified(self):
+        url = reverse("accounts:user_profile", kwargs={"username": "testuser02"})
+        # 最初の表示は setUp のフォローのメッセージを含むので、ETag を付けない
+        self.assertNotIn("ETag", self.client.get(url).headers)
+        etag = self.client.get(url).headers["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        tweet = Tweet.objects.create(user=self.user02, content="test03")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+
+        tweet.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser02"}), follow=True)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_not_modified_without_page_queries(self):
+        url = reverse("accounts:user_profile", kwargs={"username": "testuser02"})
+        self.client.get(url)
+        etag = self.client.get(url).headers["ETag"]
+        with self.assertNumQueries(4):
+            # セッション、閲覧者、プロフィールのユーザー、ツイートの最終更新日時だけを読み、ページのツイートは読まない
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_like_on_older_tweet_changes_etag(self):
+        url = reverse("accounts:user_profile", kwargs={"username": "testuser02"})
+        older = Tweet.objects.get(user=self.user02)
+        newer = Tweet.objects.create(user=self.user02, content="test03")
+        Tweet.objects.filter(pk=newer.pk).update(liked_count=5)
+        self.client.get(url)
+        etag = self.client.get(url).headers["ETag"]
+
+        # いいね数の最大値は変わらなくても、ほかのツイートのいいね数が変われば描き直す
+        user03 = User.objects.create_user(username="testuser03", email="testuser03@example.com", password="pw12345!")
+        like_tweet(user03, older)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_not_modified_since(self):
+        url = reverse("accounts:user_profile", kwargs={"username": "testuser02"})
+        self.client.get(url)
+        # 変わったばかりのページは、同じ秒のうちの変更と区別できないので Last-Modified を付けない
+        self.assertNotIn("Last-Modified", self.client.get(url).headers)
+
+        later = timezone.now() + timedelta(minutes=1)
+        with mock.patch.object(timezone, "now", return_value=later):
+            last_modified = self.client.get(url).headers["Last-Modified"]
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+
+            Tweet.objects.create(user=self.user02, content="test03")
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+
 
 class TestFollowView(TestCase):
     def setUp(self):
@@ -321,6 +405,23 @@ class TestFollowView(TestCase):
         response = self.client.post(reverse("accounts:follow", kwargs={"username": "TestUser02"}))
         self.assertRedirects(response, reverse("tweets:home"))
         self.assertTrue(FriendShip.objects.filter(following=self.user01, follower=self.user02).exists())
+        self.user01.refresh_from_db()
+        self.user02.refresh_from_db()
+        self.assertEqual(self.user01.following_count, 1)
+        self.assertEqual(self.user02.follower_count, 1)
+
+    @override_settings(DEFER_JOBS=True)
+    def test_timeline_jobs_follow_latest_state(self):
+        tweet = Tweet.objects.create(user=self.user02, content="テスト")
+        self.client.post(reverse("accounts:follow", kwargs={"username": "TestUser02"}))
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "TestUser02"}))
+        self.assertEqual(Job.objects.count(), 2)
+        call_command("runworker", "--once", stdout=StringIO())
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user01, tweet=tweet).exists())
+
+        self.client.post(reverse("accounts:follow", kwargs={"username": "TestUser02"}))
+        call_command("runworker", "--once", stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user01, tweet=tweet).exists())
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:follow", kwargs={"username": "NoneUser"}))
@@ -345,11 +446,16 @@ class TestUnfollowView(TestCase):
         )
         self.client.login(username="TestUser01", password="password304817")
         self.user01.followers.add(self.user02)
+        call_command("recount_friendships", stdout=StringIO())
 
     def test_success_post(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "TestUser02"}))
         self.assertRedirects(response, reverse("tweets:home"))
         self.assertFalse(FriendShip.objects.filter(following=self.user01, follower=self.user02).exists())
+        self.user01.refresh_from_db()
+        self.user02.refresh_from_db()
+        self.assertEqual(self.user01.following_count, 0)
+        self.assertEqual(self.user02.follower_count, 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "NoneUser"}))
@@ -364,6 +470,34 @@ class TestUnfollowView(TestCase):
         self.assertTrue(FriendShip.objects.filter(following=self.user01, follower=self.user02).exists())
 
 
+class TestAsyncFollowView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="TestUser01", password="password304817", email="testuser01@example.com"
+        )
+        self.user02 = User.objects.create_user(
+            username="TestUser02", password="password281027", email="testuser02@example.com"
+        )
+
+    async def test_success_post(self):
+        await sync_to_async(self.async_client.force_login)(self.user01)
+        response = await self.async_client.post(reverse("accounts:async_follow", kwargs={"username": "TestUser02"}))
+        self.assertRedirects(response, reverse("tweets:home"), fetch_redirect_response=False)
+        self.assertTrue(await FriendShip.objects.filter(following=self.user01, follower=self.user02).aexists())
+        user02 = await User.objects.aget(pk=self.user02.pk)
+        self.assertEqual(user02.follower_count, 1)
+
+        await self.async_client.post(reverse("accounts:async_unfollow", kwargs={"username": "TestUser02"}))
+        self.assertFalse(await FriendShip.objects.aexists())
+        user02 = await User.objects.aget(pk=self.user02.pk)
+        self.assertEqual(user02.follower_count, 0)
+
+    async def test_failure_post_with_self(self):
+        await sync_to_async(self.async_client.force_login)(self.user01)
+        await self.async_client.post(reverse("accounts:async_follow", kwargs={"username": "TestUser01"}))
+        self.assertFalse(await FriendShip.objects.aexists())
+
+
 class TestFollowingListView(TestCase):
     def setUp(self):
         self.user01 = User.objects.create_user(
@@ -383,6 +517,36 @@ class TestFollowingListView(TestCase):
             response.context["object_list"], ["<User: TestUser02>"], transform=repr, ordered=False
         )
 
+    def test_success_get_with_cursor(self):
+        for i in range(3, 25):
+            user = User.objects.create_user(username=f"TestUser{i:02}", email=f"testuser{i:02}@example.com")
+            FriendShip.objects.create(following=self.user01, follower=user)
+        url = reverse("accounts:following_list", kwargs={"username": "TestUser01"})
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        # フォローした時刻の新しい順に並ぶ
+        self.assertEqual(response.context["object_list"][0].username, "TestUser24")
+        self.assertEqual(len(response.context["object_list"]), 20)
+        response = self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(
+            [user.username for user in response.context["object_list"]], ["TestUser04", "TestUser03", "TestUser02"]
+        )
+
+    def test_success_get_with_is_following(self):
+        user03 = User.objects.create_user(username="TestUser03", email="testuser03@example.com")
+        FriendShip.objects.create(following=user03, follower=self.user01)
+        FriendShip.objects.create(following=user03, follower=self.user02)
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": "TestUser03"}))
+        self.assertEqual(
+            [(user.username, user.is_following) for user in response.context["object_list"]],
+            [("TestUser02", True), ("TestUser01", False)],
+        )
+
+    def test_failure_get_with_invalid_cursor(self):
+        url = reverse("accounts:following_list", kwargs={"username": "TestUser01"})
+        response = self.client.get(url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
 
 class TestFollowerListView(TestCase):
     def setUp(self):
@@ -403,6 +567,151 @@ class TestFollowerListView(TestCase):
             response.context["object_list"], ["<User: TestUser01>"], transform=repr, ordered=False
         )
 
+    def test_success_get_with_is_following(self):
+        user03 = User.objects.create_user(username="TestUser03", email="testuser03@example.com")
+        FriendShip.objects.create(following=user03, follower=self.user02)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "TestUser02"}))
+        self.assertEqual(
+            [(user.username, user.is_following) for user in response.context["object_list"]],
+            [("TestUser03", False), ("TestUser01", False)],
+        )
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "TestUser01"}))
+        self.assertEqual(list(response.context["object_list"]), [])
+
+
+class TestRecountFriendshipsCommand(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="TestUser01", password="password304817", email="testuser01@example.com"
+        )
+        self.user02 = User.objects.create_user(
+            username="TestUser02", password="password281027", email="testuser02@example.com", follower_count=3
+        )
+        FriendShip.objects.create(following=self.user01, follower=self.user02)
+
+    def test_success_repair(self):
+        call_command("recount_friendships", stdout=StringIO())
+        self.user01.refresh_from_db()
+        self.user02.refresh_from_db()
+        self.assertEqual(self.user01.following_count, 1)
+        self.assertEqual(self.user01.follower_count, 0)
+        self.assertEqual(self.user02.following_count, 0)
+        self.assertEqual(self.user02.follower_count, 1)
+
+
+class TestFollowSuggestions(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create_user(username=name, password="password304817", email=f"{name}@example.com")
+            for name in ["alice", "bob", "carol", "dave", "erin", "frank"]
+        }
+        for following, follower in [
+            ("alice", "bob"),
+            ("alice", "carol"),
+            ("bob", "dave"),
+            ("bob", "erin"),
+            ("carol", "dave"),
+            ("frank", "alice"),
+        ]:
+            FriendShip.objects.create(following=self.users[following], follower=self.users[follower])
+        self.client.login(username="alice", password="password304817")
+
+    def suggestions(self, name):
+        return [(user.username, user.score) for user in suggestions_for(self.users[name])]
+
+    def test_build(self):
+        call_command("build_follow_suggestions", stdout=StringIO())
+        self.assertEqual(self.suggestions("alice"), [("dave", 2), ("erin", 1)])
+        self.assertEqual(self.suggestions("frank"), [("bob", 1), ("carol", 1)])
+        self.assertEqual(self.suggestions("dave"), [])
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, "(フォロー中の2人がフォロー)")
+
+    def test_follow_and_unfollow_update_suggestions(self):
+        call_command("build_follow_suggestions", stdout=StringIO())
+        self.client.post(reverse("accounts:follow", kwargs={"username": "dave"}))
+        self.assertEqual(self.suggestions("alice"), [("erin", 1)])
+        self.assertEqual(self.suggestions("frank"), [("bob", 1), ("carol", 1)])
+
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "carol"}))
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "dave"}))
+        self.assertEqual(self.suggestions("alice"), [("dave", 1), ("erin", 1)])
+        self.assertEqual(self.suggestions("frank"), [("bob", 1)])
+
+        # その場での増減は、作り直した結果と一致する
+        incremental = {name: self.suggestions(name) for name in self.users}
+        call_command("build_follow_suggestions", stdout=StringIO())
+        self.assertEqual({name: self.suggestions(name) for name in self.users}, incremental)
+
+    def test_follow_graph(self):
+        graph = FollowGraph.from_edges(array("q", [1, 1, 2, 3]), array("q", [2, 3, 4, 4]))
+        self.assertEqual(list(graph.nodes), [1, 2, 3, 4])
+        self.assertEqual(list(graph.indptr), [0, 2, 3, 4, 4])
+        self.assertEqual(graph.suggest(0, 10), [(4, 2)])
+
+
+class TestAccountDeletion(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(username=name, password="password304817", email=f"{name}@example.com")
+            for name in ["alice", "bob", "carol"]
+        )
+        follow(self.alice, self.bob)
+        follow(self.carol, self.alice)
+        self.bob_tweet = Tweet.objects.create(user=self.bob, content="bob")
+        for i in range(3):
+            tweet = Tweet.objects.create(user=self.alice, content=f"alice {i}")
+            like_tweet(self.bob, tweet)
+        like_tweet(self.alice, self.bob_tweet)
+        FollowSuggestion.objects.create(user=self.bob, candidate=self.alice, score=1)
+        self.client.login(username="alice", password="password304817")
+
+    def assert_deleted(self):
+        self.assertFalse(User.objects.filter(pk=self.alice.pk).exists())
+        self.assertFalse(Tweet.objects.filter(user_id=self.alice.pk).exists())
+        self.assertEqual(Like.objects.count(), 0)
+        self.assertEqual(FriendShip.objects.count(), 0)
+        suggestions = FollowSuggestion.objects.values_list("user", "candidate")
+        self.assertEqual(list(suggestions), [(self.carol.pk, self.bob.pk)])
+        # 消したユーザーの分のカウンタが戻っている
+        self.assertEqual(User.objects.get(pk=self.bob.pk).follower_count, 0)
+        self.assertEqual(User.objects.get(pk=self.carol.pk).following_count, 0)
+        self.assertEqual(Tweet.objects.get(pk=self.bob_tweet.pk).liked_count, 0)
+
+    def test_success_post(self):
+        response = self.client.post(reverse("accounts:delete"))
+        self.assertRedirects(response, reverse(settings.LOGOUT_REDIRECT_URL), status_code=302)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertFalse(User.objects.get(pk=self.alice.pk).is_active)
+        self.assertFalse(self.client.login(username="alice", password="password304817"))
+        job = AccountDeletion.objects.get(user_id=self.alice.pk)
+        self.assertIsNone(job.finished_at)
+
+        call_command("delete_accounts", stdout=StringIO())
+        self.assert_deleted()
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_at)
+
+    @override_settings(DEFER_JOBS=True, DELETION_CHUNK_SIZE=1)
+    def test_deferred(self):
+        self.client.post(reverse("accounts:delete"))
+        self.assertTrue(User.objects.filter(pk=self.alice.pk).exists())
+        call_command("runworker", "--once", stdout=StringIO())
+        self.assert_deleted()
+        self.assertIsNotNone(AccountDeletion.objects.get(user_id=self.alice.pk).finished_at)
+
+    def test_resume(self):
+        job = request_deletion(self.alice)
+        self.assertFalse(deletion.run(job, chunk_size=1, max_chunks=3))
+        self.assertEqual(job.deleted_rows, 3)
+        self.assertEqual(Tweet.objects.get(pk=self.bob_tweet.pk).liked_count, 0)
+
+        # 保存した進み具合から続ける
+        job = AccountDeletion.objects.get(pk=job.pk)
+        self.assertTrue(deletion.run(job, chunk_size=1))
+        self.assert_deleted()
+
 
 """
 class TestUserProfileEditView(TestCase):
@@ -1,13 +1,22 @@
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, views
+from django.contrib.auth import authenticate, login, logout, views
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Exists, Max, OuterRef
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, DetailView, ListView, View
+from django.views.generic import CreateView, DetailView, ListView, TemplateView, View
 
+from accounts.deletion import request_deletion
+from accounts.follows import afollow, aunfollow, follow, unfollow
+from accounts.mixins import AsyncLoginRequiredMixin, ConditionalGetMixin
 from accounts.models import FriendShip, User
-from tweets.models import Like, Tweet
+from accounts.tasks import delete_account
+from jobs.queue import enqueue
+from tweets.likes import liked_tweet_ids, liked_tweets_changed_at
+from tweets.models import Tweet
+from tweets.pagination import InvalidCursor, KeysetPaginator
 
 from .forms import LoginForm, SignUpForm
 
@@ -38,31 +47,110 @@ class LogoutView(views.LogoutView):
     pass
 
 
-class UserProfileView(LoginRequiredMixin, DetailView):
+class AccountDeleteView(LoginRequiredMixin, TemplateView):
+    template_name = "accounts/delete.html"
+
+    def post(self, request, *args, **kwargs):
+        # その場ではログインできなくするだけにして、データはジョブか delete_accounts コマンドが少しずつ消す
+        deletion = request_deletion(request.user)
+        if settings.DEFER_JOBS:
+            enqueue(delete_account, deletion.pk)
+        logout(request)
+        messages.add_message(request, messages.SUCCESS, "退会しました。")
+        return redirect(settings.LOGOUT_REDIRECT_URL)
+
+
+class UserProfileView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = User
     context_object_name = "profile_user"
     template_name = "accounts/profile.html"
     slug_field = "username"
     slug_url_kwarg = "username"
+    paginate_by = 20
+
+    def get_object(self, queryset=None):
+        # 版数を作るときに読んだユーザーを、描画でもそのまま使う
+        if not hasattr(self, "object"):
+            self.object = super().get_object(queryset)
+        return self.object
+
+    def get_stamps(self):
+        """
+        ページに描く内容が変わるたびに進む日時。ページのツイートは読まずに求める。
+        ツイートの投稿といいね数の増減は Tweet.updated_at に、ツイートの削除とフォロー数の増減はユーザーの
+        User.updated_at に、閲覧者のフォローの状態は閲覧者の User.updated_at に、閲覧者のいいねは
+        liked_tweets_changed_at に表れる。
+        """
+        if not hasattr(self, "stamps"):
+            latest_tweet = Tweet.objects.filter(user=self.get_object()).aggregate(latest=Max("updated_at"))["latest"]
+            self.stamps = [
+                self.object.updated_at,
+                latest_tweet,
+                self.request.user.updated_at,
+                liked_tweets_changed_at(self.request.user),
+            ]
+        return self.stamps
+
+    def get_page(self):
+        if not hasattr(self, "page"):
+            paginator = KeysetPaginator(Tweet.objects.filter(user=self.get_object()), self.paginate_by)
+            try:
+                self.page = paginator.page(self.request.GET.get("cursor"))
+            except InvalidCursor:
+                raise Http404("不正なカーソルです。")
+            for tweet in self.page:
+                tweet.user = self.object
+            self.is_following = FriendShip.objects.filter(following=self.request.user, follower=self.object).exists()
+            self.liked_tweets = liked_tweet_ids(self.request.user, [tweet.id for tweet in self.page])
+        return self.page
+
+    def get_version(self):
+        return [self.get_object().pk, self.request.GET.get("cursor"), *self.get_stamps()]
+
+    def get_last_modified(self):
+        return max(filter(None, self.get_stamps()))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["tweets"] = Tweet.objects.select_related("user").filter(user=self.object).order_by("-created_at").all()
-        context["is_following"] = FriendShip.objects.filter(following=self.request.user, follower=self.object).exists()
-        context["following_numbers"] = FriendShip.objects.filter(following=self.object).count()
-        context["followers_numbers"] = FriendShip.objects.filter(follower=self.object).count()
-        context["liked_tweets"] = Like.objects.filter(user=self.request.user).values_list("tweet", flat=True)
+        context["page_obj"] = self.get_page()
+        context["tweets"] = context["page_obj"].object_list
+        context["is_following"] = self.is_following
+        context["following_numbers"] = self.object.following_count
+        context["followers_numbers"] = self.object.follower_count
+        context["liked_tweets"] = self.liked_tweets
         return context
 
 
 class FollowingListView(LoginRequiredMixin, ListView):
-    model = User
     context_object_name = "folloing_list"
     template_name = "accounts/following_list.html"
+    paginate_by = 20
+    # FriendShip のどちら側で絞り込み、どちら側のユーザーを並べるか
+    filter_field = "following"
+    related_field = "follower"
 
     def get_queryset(self):
         self.user = get_object_or_404(User, username=self.kwargs["username"])
-        return self.user.followers.all().order_by("-date_joined")
+        is_following = FriendShip.objects.filter(following=self.request.user, follower=OuterRef(self.related_field))
+        return (
+            FriendShip.objects.filter(**{self.filter_field: self.user})
+            .select_related(self.related_field)
+            .only("created_at", f"{self.related_field}__username")
+            .annotate(is_following=Exists(is_following))
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("不正なカーソルです。")
+        users = []
+        for friendship in page:
+            user = getattr(friendship, self.related_field)
+            user.is_following = friendship.is_following
+            users.append(user)
+        return (paginator, page, users, page.has_other_pages())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -70,19 +158,11 @@ class FollowingListView(LoginRequiredMixin, ListView):
         return context
 
 
-class FollowerListView(LoginRequiredMixin, ListView):
-    model = User
+class FollowerListView(FollowingListView):
     context_object_name = "follower_list"
     template_name = "accounts/follower_list.html"
-
-    def get_queryset(self):
-        self.user = get_object_or_404(User, username=self.kwargs["username"])
-        return self.user.followings.all().order_by("-date_joined")
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["target_user"] = self.user
-        return context
+    filter_field = "follower"
+    related_field = "following"
 
 
 class FollowView(LoginRequiredMixin, View):
@@ -93,11 +173,10 @@ class FollowView(LoginRequiredMixin, View):
             messages.add_message(self.request, messages.ERROR, "自分自身をフォローすることはできません")
             return redirect("tweets:home")
 
-        if self.request.user.followers.filter(username=user.username).exists():
+        if not follow(self.request.user, user):
             messages.add_message(self.request, messages.WARNING, "すでにフォローしています。")
             return redirect("tweets:home")
 
-        self.request.user.followers.add(user)
         messages.add_message(self.request, messages.SUCCESS, "フォローしました。")
         return redirect("tweets:home")
 
@@ -110,10 +189,47 @@ class UnFollowView(LoginRequiredMixin, View):
             messages.add_message(self.request, messages.ERROR, "自分自身をフォロー解除することはできません。")
             return redirect("tweets:home")
 
-        if not self.request.user.followers.filter(username=user.username).exists():
+        if not unfollow(self.request.user, user):
+            messages.add_message(self.request, messages.ERROR, "フォローしていません。")
+            return redirect("tweets:home")
+
+        messages.add_message(self.request, messages.SUCCESS, "フォローを解除しました。")
+        return redirect("tweets:home")
+
+
+class AsyncFollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, *args, **kwargs):
+        try:
+            user = await User.objects.aget(username=self.kwargs["username"])
+        except User.DoesNotExist:
+            raise Http404("ユーザーが見つかりません。")
+
+        if user == self.request.user:
+            messages.add_message(self.request, messages.ERROR, "自分自身をフォローすることはできません")
+            return redirect("tweets:home")
+
+        if not await afollow(self.request.user, user):
+            messages.add_message(self.request, messages.WARNING, "すでにフォローしています。")
+            return redirect("tweets:home")
+
+        messages.add_message(self.request, messages.SUCCESS, "フォローしました。")
+        return redirect("tweets:home")
+
+
+class AsyncUnFollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, *args, **kwargs):
+        try:
+            user = await User.objects.aget(username=self.kwargs["username"])
+        except User.DoesNotExist:
+            raise Http404("ユーザーが見つかりません。")
+
+        if user == self.request.user:
+            messages.add_message(self.request, messages.ERROR, "自分自身をフォロー解除することはできません。")
+            return redirect("tweets:home")
+
+        if not await aunfollow(self.request.user, user):
             messages.add_message(self.request, messages.ERROR, "フォローしていません。")
             return redirect("tweets:home")
 
-        self.request.user.followers.remove(user)
         messages.add_message(self.request, messages.SUCCESS, "フォローを解除しました。")
         return redirect("tweets:home")
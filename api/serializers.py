@@ -0,0 +1,32 @@
+def sparse(data, fields):
+    if not fields:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
+
+def serialize_user(user, fields=None):
+    data = {
+        "username": user.username,
+        "following_count": user.following_count,
+        "follower_count": user.follower_count,
+        "date_joined": user.date_joined.isoformat(),
+    }
+    return sparse(data, fields)
+
+
+def serialize_tweet(tweet, liked_tweets, fields=None):
+    data = {
+        "id": tweet.id,
+        "user": tweet.user.username,
+        "content": tweet.content,
+        "created_at": tweet.created_at.isoformat(),
+        "liked_count": tweet.liked_count,
+        "is_liked": tweet.id in liked_tweets,
+    }
+    return sparse(data, fields)
+
+
+def serialize_friendship(user, followed_at, fields=None):
+    data = serialize_user(user)
+    data["followed_at"] = followed_at.isoformat()
+    return sparse(data, fields)
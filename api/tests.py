@@ -0,0 +1,165 @@
+import json
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import FriendShip, User
+from tweets import trending
+from tweets.models import Like, Tweet
+
+
+class TestTweetListView(TestCase):
+    def setUp(self):
+        self.url = reverse("api:tweet_list")
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        Tweet.objects.bulk_create([Tweet(user=self.user01, content=f"テスト投稿{i:02}") for i in range(3)])
+
+    def test_success_get_with_cursor(self):
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["results"]), 2)
+        response = self.client.get(self.url, {"limit": 2, "cursor": data["next_cursor"]})
+        self.assertEqual([tweet["content"] for tweet in response.json()["results"]], ["テスト投稿00"])
+
+    def test_success_get_with_fields(self):
+        response = self.client.get(self.url, {"fields": "id,content"})
+        self.assertEqual(set(response.json()["results"][0]), {"id", "content"})
+
+    def test_success_get_not_modified(self):
+        response = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response.headers["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_get_without_login(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+
+class TestSearchView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        for content in ["東京タワー", "京都タワー"]:
+            self.client.post(reverse("tweets:create"), {"content": content})
+
+    def test_success_get(self):
+        response = self.client.get(reverse("api:search"), {"q": "東京", "fields": "content"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"results": [{"content": "東京タワー"}], "next_cursor": None})
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("api:search"), {"q": "東京", "cursor": "invalid"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestTrendingView(TestCase):
+    def setUp(self):
+        cache.clear()
+        trending.local.pending.clear()
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        self.client.post(reverse("tweets:create"), {"content": "#django"})
+        self.tweet01 = Tweet.objects.get()
+        self.client.post(reverse("api:like", kwargs={"pk": self.tweet01.pk}))
+
+    def test_success_get(self):
+        call_command("refresh_trending", stdout=StringIO())
+        response = self.client.get(reverse("api:trending"), {"fields": "id"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {"hashtags": [{"name": "django", "score": 1}], "tweets": [{"id": self.tweet01.pk, "score": 1}]},
+        )
+
+
+class TestUserTweetExportView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        Tweet.objects.bulk_create([Tweet(user=self.user01, content=f"テスト投稿{i:02}") for i in range(3)])
+
+    def test_success_get(self):
+        response = self.client.get(reverse("api:user_tweets_export", kwargs={"username": "testuser01"}))
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])["user"], "testuser01")
+
+
+class TestLikeView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+
+    def test_success_post(self):
+        response = self.client.post(reverse("api:like", kwargs={"pk": self.tweet01.pk}))
+        self.assertEqual(response.json()["liked_count"], 1)
+        response = self.client.get(reverse("api:tweet_detail", kwargs={"pk": self.tweet01.pk}))
+        self.assertTrue(response.json()["is_liked"])
+        response = self.client.post(reverse("api:unlike", kwargs={"pk": self.tweet01.pk}))
+        self.assertEqual(response.json()["liked_count"], 0)
+        self.assertFalse(Like.objects.exists())
+
+
+class TestFollowView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="TestUser01", password="password304817", email="testuser01@example.com"
+        )
+        self.user02 = User.objects.create_user(
+            username="TestUser02", password="password281027", email="testuser02@example.com"
+        )
+        self.client.login(username="TestUser01", password="password304817")
+
+    def test_success_post(self):
+        response = self.client.post(reverse("api:follow", kwargs={"username": "TestUser02"}))
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(FriendShip.objects.filter(following=self.user01, follower=self.user02).exists())
+
+        response = self.client.get(reverse("api:following_list", kwargs={"username": "TestUser01"}))
+        self.assertEqual([user["username"] for user in response.json()["results"]], ["TestUser02"])
+        response = self.client.get(reverse("api:follower_list", kwargs={"username": "TestUser02"}))
+        self.assertEqual([user["username"] for user in response.json()["results"]], ["TestUser01"])
+        response = self.client.get(reverse("api:user_profile", kwargs={"username": "TestUser02"}))
+        self.assertEqual(response.json()["follower_count"], 1)
+        self.assertTrue(response.json()["is_following"])
+
+        response = self.client.post(reverse("api:unfollow", kwargs={"username": "TestUser02"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(FriendShip.objects.exists())
+
+    def test_failure_post_with_self(self):
+        response = self.client.post(reverse("api:follow", kwargs={"username": "TestUser01"}))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FriendShip.objects.exists())
@@ -0,0 +1,21 @@
+from django.urls import path
+
+from . import views
+
+app_name = "api"
+urlpatterns = [
+    path("timeline/", views.TimelineView.as_view(), name="timeline"),
+    path("tweets/", views.TweetListView.as_view(), name="tweet_list"),
+    path("tweets/search/", views.SearchView.as_view(), name="search"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
+    path("tweets/<int:pk>/", views.TweetDetailView.as_view(), name="tweet_detail"),
+    path("tweets/<int:pk>/like/", views.LikeView.as_view(), name="like"),
+    path("tweets/<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("users/<str:username>/", views.UserProfileView.as_view(), name="user_profile"),
+    path("users/<str:username>/tweets/", views.UserTweetListView.as_view(), name="user_tweets"),
+    path("users/<str:username>/tweets/export/", views.UserTweetExportView.as_view(), name="user_tweets_export"),
+    path("users/<str:username>/following/", views.FollowingListView.as_view(), name="following_list"),
+    path("users/<str:username>/followers/", views.FollowerListView.as_view(), name="follower_list"),
+    path("users/<str:username>/follow/", views.FollowView.as_view(), name="follow"),
+    path("users/<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
+]
@@ -0,0 +1,219 @@
+import hashlib
+import json
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.views.generic import View
+
+from accounts.follows import follow, unfollow
+from accounts.models import FriendShip, User
+from tweets import trending
+from tweets.likes import liked_tweet_ids, set_like
+from tweets.models import Tweet
+from tweets.pagination import InvalidCursor, KeysetPaginator
+from tweets.search import search_tweets
+from tweets.timeline import HomeTimelinePaginator
+
+from .serializers import serialize_friendship, serialize_tweet, serialize_user, sparse
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+EXPORT_CHUNK_SIZE = 1000
+
+
+class ApiView(LoginRequiredMixin, View):
+    raise_exception = True
+
+    def get_fields(self):
+        fields = self.request.GET.get("fields")
+        return set(fields.split(",")) if fields else None
+
+    def get_limit(self):
+        try:
+            return min(max(int(self.request.GET.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            return DEFAULT_LIMIT
+
+    def paginate(self, queryset, field="created_at"):
+        return KeysetPaginator(queryset, self.get_limit(), field=field).page(self.request.GET.get("cursor"))
+
+    def error(self, message, status):
+        return JsonResponse({"detail": message}, status=status)
+
+    def render(self, data):
+        body = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        response = get_conditional_response(self.request, etag=etag) or HttpResponse(
+            body, content_type="application/json"
+        )
+        response.headers["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Cookie"])
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except InvalidCursor:
+            return self.error("不正なカーソルです。", 400)
+
+
+class TweetListMixin:
+    def render_tweets(self, queryset):
+        return self.render_page(self.paginate(queryset))
+
+    def render_page(self, page):
+        liked_tweets = liked_tweet_ids(self.request.user, [tweet.id for tweet in page])
+        fields = self.get_fields()
+        return self.render(
+            {
+                "results": [serialize_tweet(tweet, liked_tweets, fields) for tweet in page],
+                "next_cursor": page.next_cursor,
+                "previous_cursor": page.previous_cursor,
+            }
+        )
+
+
+class TimelineView(TweetListMixin, ApiView):
+    def get(self, request, *args, **kwargs):
+        paginator = HomeTimelinePaginator(request.user, self.get_limit())
+        return self.render_page(paginator.page(request.GET.get("cursor")))
+
+
+class TweetListView(TweetListMixin, ApiView):
+    def get(self, request, *args, **kwargs):
+        return self.render_tweets(Tweet.objects.select_related("user"))
+
+
+class SearchView(ApiView):
+    def get(self, request, *args, **kwargs):
+        page = search_tweets(request.GET.get("q", ""), request.GET.get("cursor"), self.get_limit())
+        liked_tweets = liked_tweet_ids(request.user, [tweet.id for tweet in page])
+        fields = self.get_fields()
+        return self.render(
+            {
+                "results": [serialize_tweet(tweet, liked_tweets, fields) for tweet in page],
+                "next_cursor": page.next_cursor,
+            }
+        )
+
+
+class TrendingView(ApiView):
+    def get(self, request, *args, **kwargs):
+        ranked = trending.top("tweets")
+        tweets = Tweet.objects.select_related("user").in_bulk([tweet_id for tweet_id, _ in ranked])
+        liked_tweets = liked_tweet_ids(request.user, tweets)
+        fields = self.get_fields()
+        return self.render(
+            {
+                "hashtags": [{"name": name, "score": score} for name, score in trending.top("hashtags")],
+                "tweets": [
+                    {**serialize_tweet(tweets[tweet_id], liked_tweets, fields), "score": score}
+                    for tweet_id, score in ranked
+                    if tweet_id in tweets
+                ],
+            }
+        )
+
+
+class TweetDetailView(ApiView):
+    def get(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet.objects.select_related("user"), pk=kwargs["pk"])
+        return self.render(serialize_tweet(tweet, liked_tweet_ids(request.user, [tweet.id]), self.get_fields()))
+
+
+class LikeView(ApiView):
+    liked = True
+
+    def post(self, request, *args, **kwargs):
+        try:
+            liked_count = set_like(request.user, kwargs["pk"], self.liked)
+        except Tweet.DoesNotExist:
+            return self.error("ツイートが見つかりません。", 404)
+        return JsonResponse({"tweet_id": kwargs["pk"], "liked_count": liked_count, "is_liked": self.liked})
+
+
+class UnlikeView(LikeView):
+    liked = False
+
+
+class UserProfileView(ApiView):
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=kwargs["username"])
+        data = serialize_user(user)
+        data["is_following"] = FriendShip.objects.filter(following=request.user, follower=user).exists()
+        return self.render(sparse(data, self.get_fields()))
+
+
+class UserTweetListView(TweetListMixin, ApiView):
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=kwargs["username"])
+        return self.render_tweets(Tweet.objects.select_related("user").filter(user=user))
+
+
+class UserTweetExportView(ApiView):
+    """ユーザーの全ツイートを1行1件の JSON (NDJSON) として少しずつ書き出す。"""
+
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=kwargs["username"])
+        fields = self.get_fields()
+        rows = (
+            Tweet.objects.filter(user=user)
+            .order_by("-created_at", "-id")
+            .values("id", "content", "created_at", "liked_count")
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+
+        def lines():
+            for row in rows:
+                row["user"] = user.username
+                yield json.dumps(sparse(row, fields), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+        return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+
+
+class FollowingListView(ApiView):
+    related_field = "follower"
+    filter_field = "following"
+
+    def get(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=kwargs["username"])
+        queryset = FriendShip.objects.filter(**{self.filter_field: user}).select_related(self.related_field)
+        page = self.paginate(queryset)
+        fields = self.get_fields()
+        return self.render(
+            {
+                "results": [
+                    serialize_friendship(getattr(friendship, self.related_field), friendship.created_at, fields)
+                    for friendship in page
+                ],
+                "next_cursor": page.next_cursor,
+                "previous_cursor": page.previous_cursor,
+            }
+        )
+
+
+class FollowerListView(FollowingListView):
+    related_field = "following"
+    filter_field = "follower"
+
+
+class FollowView(ApiView):
+    def post(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=kwargs["username"])
+        if user == request.user:
+            return self.error("自分自身をフォローすることはできません", 400)
+        created = follow(request.user, user)
+        return JsonResponse({"username": user.username, "is_following": True}, status=201 if created else 200)
+
+
+class UnFollowView(ApiView):
+    def post(self, request, *args, **kwargs):
+        user = get_object_or_404(User, username=kwargs["username"])
+        if user == request.user:
+            return self.error("自分自身をフォロー解除することはできません。", 400)
+        unfollow(request.user, user)
+        return JsonResponse({"username": user.username, "is_following": False})
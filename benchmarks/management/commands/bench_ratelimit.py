@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from accounts.models import User
+from mysite.ratelimit import RateLimitMiddleware, load_rules
+
+# レート制限が1リクエストに足してよい時間の平均
+OVERHEAD_BUDGET_MS = 0.2
+
+
+class Command(BaseCommand):
+    help = "レート制限のミドルウェアが1リクエストに足す時間を計測し、上限を超えたら失敗します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=10000)
+        parser.add_argument("--clients", type=int, default=100)
+
+    def handle(self, *args, **options):
+        url = reverse("tweets:like", args=[1])
+        match = resolve(url)
+        factory = RequestFactory()
+        requests = []
+        for i in range(options["requests"]):
+            client = i % options["clients"]
+            request = factory.post(url, REMOTE_ADDR=f"10.0.{client // 256}.{client % 256}")
+            request.resolver_match = match
+            # ユーザーはキャッシュのキーに pk を使うだけなので、保存していないインスタンスでよい
+            request.user = User(pk=client + 1) if client % 2 else AnonymousUser()
+            requests.append(request)
+
+        middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        # 計測中に制限に掛からない容量で、実際の設定と同じ判定をさせる。範囲の名前は前の計測のバケットと分ける
+        limit = (options["requests"], 60)
+        scope = f"bench_{time.time_ns()}"
+        middleware.rules = load_rules({scope: {"views": [match.view_name], "user": limit, "ip": limit}})
+        timings = []
+        for request in requests:
+            start = time.perf_counter()
+            response = middleware.process_view(request, match.func, match.args, match.kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+            if response is not None:
+                raise CommandError(f"計測中に制限されました: {response.status_code}")
+
+        timings.sort()
+        mean = statistics.fmean(timings)
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        self.stdout.write(f"rate limit: mean {mean:.4f}ms, p50 {timings[len(timings) // 2]:.4f}ms, p99 {p99:.4f}ms")
+        if mean > OVERHEAD_BUDGET_MS:
+            raise CommandError(f"1リクエストあたり {mean:.4f}ms で、上限の {OVERHEAD_BUDGET_MS}ms を超えました。")
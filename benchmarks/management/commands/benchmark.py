@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from benchmarks import runner
+from benchmarks.seed import clear_graph, seed_graph
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "合成データを投入して各URLのレイテンシ・クエリ数・メモリを計測し、JSONで出力します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--follows", type=int, default=20)
+        parser.add_argument("--tweets", type=int, default=20)
+        parser.add_argument("--likes", type=int, default=50)
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="結果を書き出すファイル。省略時は標準出力。")
+        parser.add_argument("--keep", action="store_true", help="計測後に合成データを削除しません。")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        clear_graph()
+        users = seed_graph(options["users"], options["follows"], options["tweets"], options["likes"], options["seed"])
+        try:
+            viewer, target = users[0], users[1]
+            tweet = Tweet.objects.filter(user=target).latest("created_at")
+            results = runner.run(viewer, target, tweet, options["iterations"])
+        finally:
+            if not options["keep"]:
+                clear_graph()
+
+        output = json.dumps(
+            {
+                "options": {
+                    key: options[key] for key in ("users", "follows", "tweets", "likes", "iterations", "seed")
+                },
+                "results": results,
+            },
+            indent=2,
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        over_budget = [name for name, result in results.items() if result["over_budget"]]
+        if over_budget:
+            raise CommandError(f"クエリ数が上限を超えました: {', '.join(over_budget)}")
@@ -0,0 +1,193 @@
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.constants import OnConflict
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import FriendShip, User
+from tweets.models import Like, Tweet
+
+
+class WeightedSampler:
+    """べき乗則の重みで 0..n-1 を引く。"""
+
+    def __init__(self, n, exponent, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank**exponent) for rank in range(1, n + 1)))
+        # 人気順位とインデックスを切り離すため、順位をシャッフルして割り当てる
+        self.population = list(range(n))
+        rng.shuffle(self.population)
+
+    def sample_distinct(self, k, exclude=None):
+        # 重複と exclude の分だけ少し多めに引く。人気の偏りが強いと k 件に届かないこともある
+        chosen = set(self.rng.choices(self.population, cum_weights=self.cumulative, k=k + k // 4 + 1))
+        chosen.discard(exclude)
+        return itertools.islice(chosen, k)
+
+
+class Command(BaseCommand):
+    help = "べき乗則に従うフォローグラフとツイート・いいねを一括挿入で大量に生成します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--follows", type=int, default=50, help="1ユーザーあたりの平均フォロー数")
+        parser.add_argument("--tweets", type=int, default=20, help="1ユーザーあたりの平均ツイート数")
+        parser.add_argument("--likes", type=int, default=50, help="1ユーザーあたりの平均いいね数")
+        parser.add_argument("--exponent", type=float, default=1.1, help="人気度のべき指数")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", default="gen_", help="生成するユーザー名の接頭辞")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1:
+            raise CommandError("--users には1以上を指定してください。")
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.rows = 0
+        self.started = time.perf_counter()
+
+        if connection.vendor == "sqlite" and not connection.in_atomic_block:
+            with connection.cursor() as cursor:
+                # 生成中だけページキャッシュを広げ、fsync を省く。クラッシュしたら生成し直せばよい。
+                cursor.execute("PRAGMA cache_size = -262144")
+                cursor.execute("PRAGMA synchronous = OFF")
+                cursor.execute("PRAGMA temp_store = MEMORY")
+
+        with transaction.atomic():
+            user_ids = self.create_users(options)
+            self.create_friendships(user_ids, options)
+            tweet_ids = self.create_tweets(user_ids, options)
+            self.create_likes(user_ids, tweet_ids, options)
+            self.update_counters(user_ids[0], tweet_ids[0] if tweet_ids else None)
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(
+            self.style.SUCCESS(f"{self.rows} rows in {elapsed:.1f}s ({self.rows / elapsed:,.0f} rows/s)")
+        )
+
+    def progress(self, label, count):
+        self.rows += count
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(f"{label}: {self.rows:,} rows, {self.rows / elapsed:,.0f} rows/s")
+
+    def stream(self, model, columns, rows, label):
+        """
+        rows (DB用に変換済みの値のタプル) を batch_size 件ずつ executemany で挿入する。
+        bulk_create(ignore_conflicts=True) と同じ INSERT 文を使うが、モデルインスタンスを作らない分だけ速い。
+        """
+        fields = [model._meta.get_field(column) for column in columns]
+        quote = connection.ops.quote_name
+        sql = "%s %s (%s) VALUES (%s)%s" % (
+            connection.ops.insert_statement(on_conflict=OnConflict.IGNORE),
+            quote(model._meta.db_table),
+            ", ".join(quote(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+            connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None),
+        )
+        with connection.cursor() as cursor:
+            for batch in iter(lambda: list(itertools.islice(rows, self.batch_size)), []):
+                cursor.executemany(sql, batch)
+                self.progress(label, len(batch))
+
+    def create_users(self, options):
+        prefix = options["prefix"]
+        last_pk = User.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        users = (
+            ("!", False, f"{prefix}{i}", "", "", f"{prefix}{i}@example.com", False, True, now, 0, 0, now)
+            for i in range(options["users"])
+        )
+        columns = [
+            "password",
+            "is_superuser",
+            "username",
+            "first_name",
+            "last_name",
+            "email",
+            "is_staff",
+            "is_active",
+            "date_joined",
+            "following_count",
+            "follower_count",
+            "updated_at",
+        ]
+        self.stream(User, columns, users, "users")
+        user_ids = list(User.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True))
+        if len(user_ids) < options["users"]:
+            # 既存のユーザー名と重なった行は挿入されずに飛ばされる。トランザクションごと取り消す
+            raise CommandError(
+                f"接頭辞 {prefix!r} のユーザーがすでにいます。--prefix に別の接頭辞を指定してください。"
+            )
+        return user_ids
+
+    def heavy_tailed(self, mean):
+        # 平均が mean になるパレート分布
+        return int(self.rng.paretovariate(2.0) * mean / 2)
+
+    def create_friendships(self, user_ids, options):
+        self.popularity = WeightedSampler(len(user_ids), options["exponent"], self.rng)
+
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        def friendships():
+            for index, user_id in enumerate(user_ids):
+                for target in self.popularity.sample_distinct(self.heavy_tailed(options["follows"]), exclude=index):
+                    yield user_id, user_ids[target], now
+
+        self.stream(FriendShip, ["following", "follower", "created_at"], friendships(), "friendships")
+
+    def create_tweets(self, user_ids, options):
+        now = timezone.now()
+        year = 365 * 24 * 60 * 60
+
+        adapt = connection.ops.adapt_datetimefield_value
+
+        def tweets():
+            for user_id in user_ids:
+                for i in range(self.heavy_tailed(options["tweets"])):
+                    created_at = adapt(now - timedelta(seconds=self.rng.randrange(year)))
+                    yield user_id, f"generated tweet {user_id}-{i}", created_at, 0, created_at
+
+        last_pk = Tweet.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        self.stream(Tweet, ["user", "content", "created_at", "liked_count", "updated_at"], tweets(), "tweets")
+        return list(Tweet.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True))
+
+    def create_likes(self, user_ids, tweet_ids, options):
+        if not tweet_ids:
+            return
+        tweet_popularity = WeightedSampler(len(tweet_ids), options["exponent"], self.rng)
+
+        def likes():
+            for user_id in user_ids:
+                for index in tweet_popularity.sample_distinct(self.heavy_tailed(options["likes"])):
+                    yield tweet_ids[index], user_id
+
+        self.stream(Like, ["tweet", "user"], likes(), "likes")
+
+    def update_counters(self, first_user_id, first_tweet_id):
+        def counts(model, field):
+            return (
+                model.objects.filter(**{field: OuterRef("pk")})
+                .order_by()
+                .values(field)
+                .annotate(c=Count("pk"))
+                .values("c")
+            )
+
+        now = timezone.now()
+        User.objects.filter(pk__gte=first_user_id).update(
+            following_count=Coalesce(Subquery(counts(FriendShip, "following")), 0),
+            follower_count=Coalesce(Subquery(counts(FriendShip, "follower")), 0),
+            updated_at=now,
+        )
+        if first_tweet_id is not None:
+            Tweet.objects.filter(pk__gte=first_tweet_id).update(
+                liked_count=Coalesce(Subquery(counts(Like, "tweet")), 0), updated_at=now
+            )
+        self.stdout.write("counters updated")
@@ -0,0 +1,78 @@
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# URL名ごとの1リクエストあたりのクエリ数の上限。ページサイズやデータ量に依存しない値でなければならない。
+QUERY_BUDGETS = {
+    "tweets:home": 5,
+    # 実体化されたエントリと fan-out されないフォロー先のツイートのキーを別々に読んでから、ツイートを読む
+    "tweets:following_timeline": 6,
+    "tweets:detail": 4,
+    "accounts:user_profile": 6,
+    "accounts:following_list": 4,
+    "accounts:follower_list": 4,
+    "tweets:like": 11,
+    "tweets:unlike": 8,
+}
+
+
+def build_scenarios(target, tweet):
+    """(URL名, メソッド, URL) の一覧を返す。"""
+    return [
+        ("tweets:home", "get", reverse("tweets:home")),
+        ("tweets:following_timeline", "get", reverse("tweets:following_timeline")),
+        ("tweets:detail", "get", reverse("tweets:detail", args=[tweet.pk])),
+        ("accounts:user_profile", "get", reverse("accounts:user_profile", args=[target.username])),
+        ("accounts:following_list", "get", reverse("accounts:following_list", args=[target.username])),
+        ("accounts:follower_list", "get", reverse("accounts:follower_list", args=[target.username])),
+        ("tweets:like", "post", reverse("tweets:like", args=[tweet.pk])),
+        ("tweets:unlike", "post", reverse("tweets:unlike", args=[tweet.pk])),
+    ]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_scenario(client, method, url, iterations):
+    latencies, queries, statuses = [], [], set()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(len(captured.captured_queries))
+        statuses.add(response.status_code)
+
+    # tracemalloc は遅いので、メモリは計時と別の1リクエストで測る
+    tracemalloc.start()
+    getattr(client, method)(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "queries": max(queries),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "status": sorted(statuses),
+    }
+
+
+def run(viewer, target, tweet, iterations=20):
+    """viewer としてログインし、各URLの計測結果を URL名 -> 結果 の辞書で返す。"""
+    client = Client()
+    client.force_login(viewer)
+    results = {}
+    for name, method, url in build_scenarios(target, tweet):
+        result = run_scenario(client, method, url, iterations)
+        result["budget"] = QUERY_BUDGETS[name]
+        result["over_budget"] = result["queries"] > QUERY_BUDGETS[name]
+        results[name] = result
+    return results
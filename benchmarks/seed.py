@@ -0,0 +1,60 @@
+import random
+from io import StringIO
+
+from django.core.management import call_command
+
+from accounts.models import FriendShip, User
+from tweets.models import Like, TimelineEntry, Tweet
+
+USERNAME_PREFIX = "bench_"
+
+
+def seed_graph(users=50, follows=10, tweets=20, likes=20, seed=0):
+    """ベンチマーク用の小さなソーシャルグラフを作り、作成したユーザーを返す。"""
+    rng = random.Random(seed)
+    User.objects.bulk_create(
+        [
+            User(username=f"{USERNAME_PREFIX}{i}", email=f"{USERNAME_PREFIX}{i}@example.com", password="!")
+            for i in range(users)
+        ]
+    )
+    created = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by("pk"))
+
+    FriendShip.objects.bulk_create(
+        [
+            FriendShip(following=user, follower=target)
+            for user in created
+            for target in rng.sample(created, min(follows + 1, users))
+            if target != user
+        ],
+        ignore_conflicts=True,
+    )
+    Tweet.objects.bulk_create(
+        [Tweet(user=user, content=f"bench tweet {i}") for user in created for i in range(tweets)]
+    )
+    tweet_ids = list(Tweet.objects.filter(user__in=created).values_list("pk", flat=True))
+    Like.objects.bulk_create(
+        [
+            Like(user=user, tweet_id=tweet_id)
+            for user in created
+            for tweet_id in rng.sample(tweet_ids, min(likes, len(tweet_ids)))
+        ],
+        ignore_conflicts=True,
+    )
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created_at=created_at)
+            for owner_id, tweet_id, created_at in Tweet.objects.filter(user__in=created).values_list(
+                "user__follower_friendships__following", "pk", "created_at"
+            )
+            if owner_id is not None
+        ],
+        ignore_conflicts=True,
+    )
+    call_command("recount_likes", stdout=StringIO())
+    call_command("recount_friendships", stdout=StringIO())
+    return created
+
+
+def clear_graph():
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
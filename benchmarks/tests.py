@@ -0,0 +1,60 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db.models import Count, F
+from django.test import TestCase
+
+from accounts.models import FriendShip, User
+from benchmarks import runner
+from benchmarks.seed import seed_graph
+from tweets.models import Like, Tweet
+
+
+class TestQueryBudgets(TestCase):
+    def setUp(self):
+        self.users = seed_graph(users=30, follows=25, tweets=5, likes=30)
+        self.tweet = Tweet.objects.filter(user=self.users[1]).latest("created_at")
+
+    def test_within_budget(self):
+        results = runner.run(self.users[0], self.users[1], self.tweet, iterations=2)
+        self.assertEqual(set(results), set(runner.QUERY_BUDGETS))
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertEqual(result["status"], [200])
+                self.assertLessEqual(result["queries"], result["budget"])
+
+
+class TestGenerateDataCommand(TestCase):
+    def test_generate(self):
+        call_command("generate_data", users=50, follows=5, tweets=3, likes=5, batch_size=20, stdout=StringIO())
+        users = User.objects.filter(username__startswith="gen_")
+        self.assertEqual(users.count(), 50)
+        self.assertTrue(FriendShip.objects.exists())
+        self.assertTrue(Like.objects.exists())
+        self.assertFalse(FriendShip.objects.filter(following=F("follower")).exists())
+        for user in users.annotate(n=Count("following_friendships")):
+            self.assertEqual(user.following_count, user.n)
+        for tweet in Tweet.objects.annotate(n=Count("likes")):
+            self.assertEqual(tweet.liked_count, tweet.n)
+
+    def test_reject_no_users(self):
+        with self.assertRaises(CommandError):
+            call_command("generate_data", users=0, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+    def test_reject_existing_prefix(self):
+        options = {"users": 10, "follows": 2, "tweets": 2, "likes": 2, "stdout": StringIO()}
+        call_command("generate_data", **options)
+        with self.assertRaisesMessage(CommandError, "'gen_'"):
+            call_command("generate_data", **options)
+        self.assertEqual(User.objects.count(), 10)
+
+        call_command("generate_data", prefix="gen2_", **options)
+        self.assertEqual(User.objects.count(), 20)
+
+
+class TestBenchRateLimitCommand(TestCase):
+    def test_within_budget(self):
+        out = StringIO()
+        call_command("bench_ratelimit", requests=500, clients=10, stdout=out)
+        self.assertIn("rate limit: mean", out.getvalue())
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "jobs"
+
+    def ready(self):
+        # ワーカーが名前からジョブを引けるよう、各アプリの tasks モジュールを読み込んで登録させる
+        autodiscover_modules("tasks")
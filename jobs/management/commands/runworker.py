@@ -0,0 +1,39 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.queue import work
+
+
+class Command(BaseCommand):
+    help = "後回しにしたジョブ (DEFER_JOBS) を取り出して実行し続けます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=1, help="ジョブを並べて実行するスレッドの数。")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--interval", type=float, default=1, help="ジョブがないときに待つ秒数。")
+        parser.add_argument("--once", action="store_true", help="積まれているジョブがなくなったら終了します。")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        batch_size = options["batch_size"] or settings.JOB_BATCH_SIZE
+        executor = ThreadPoolExecutor(options["concurrency"]) if options["concurrency"] > 1 else None
+        total = 0
+        try:
+            while True:
+                # 1回に取り出すのはスレッドごとに batch_size 件まで
+                processed = work(worker, batch_size * options["concurrency"], executor)
+                total += processed
+                if processed:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.stdout.write(f"{total}件のジョブを実行しました。")
@@ -0,0 +1,114 @@
+"""
+データベースをキューにした後回しの処理。
+
+リクエストの応答に要らない処理 (フォロワーへの fan-out や検索の索引など) は enqueue で Job として積み、
+runworker コマンドがまとめて取り出して実行する。Job の行は呼び出し元と同じトランザクションで書くので、
+呼び出し元が巻き戻ればジョブも積まれない。DEFER_JOBS が False のときは enqueue がその場で実行する。
+
+ジョブは何度実行されても、また順番が入れ替わっても同じ結果になるように書く。失敗したジョブは
+JOB_RETRY_BACKOFF_SECONDS から倍々に間隔を空けて JOB_MAX_ATTEMPTS 回まで実行し、取り出したワーカーが
+JOB_LEASE_SECONDS のうちに終えなかったジョブは落ちたものとみなしてほかのワーカーが取り出し直す。
+"""
+
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def register(name):
+    """関数を name のジョブとして登録するデコレータ。ジョブの引数は JSON にできる値に限る。"""
+
+    def decorator(func):
+        _registry[name] = func
+        func.job_name = name
+        return func
+
+    return decorator
+
+
+def enqueue(func, *args):
+    """register した func を args で実行するジョブを積み、その Job を返す。後回しにしないときは None。"""
+    if not settings.DEFER_JOBS:
+        func(*args)
+        return None
+    return Job.objects.create(name=func.job_name, args=list(args), max_attempts=settings.JOB_MAX_ATTEMPTS)
+
+
+def _claimable(now):
+    expired = now - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    return Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=expired)
+
+
+def claim(worker, limit):
+    """実行できるジョブを古い順に最大 limit 件取り出し、worker の名前で実行中にして返す。"""
+    now = timezone.now()
+    using = router.db_for_write(Job)
+    # 取り出しごとに違う印を付け、この呼び出しで取り出した行だけを読み直す
+    token = f"{worker}:{uuid.uuid4().hex}"
+    claimed = {"status": Job.RUNNING, "locked_by": token, "locked_at": now, "attempts": F("attempts") + 1}
+    candidates = Job.objects.using(using).filter(_claimable(now)).order_by("run_at", "pk")
+    if connections[using].features.has_select_for_update_skip_locked:
+        # ほかのワーカーが取り出し中の行は待たずに飛ばす
+        with transaction.atomic(using=using):
+            pks = list(candidates.select_for_update(skip_locked=True).values_list("pk", flat=True)[:limit])
+            Job.objects.using(using).filter(pk__in=pks).update(**claimed)
+    else:
+        # SQLite には行ロックがないので、候補を選ぶ副問い合わせと書き換えを1つの UPDATE にまとめる。
+        # データベース全体の書き込みロックで、ほかのワーカーと同じ行を取り出すことはない
+        Job.objects.using(using).filter(_claimable(now), pk__in=candidates.values("pk")[:limit]).update(**claimed)
+    return list(Job.objects.using(using).filter(locked_by=token).order_by("run_at", "pk"))
+
+
+def backoff(attempts):
+    """attempts 回目に失敗したジョブを、次に実行するまでの秒数。"""
+    return min(settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX_SECONDS)
+
+
+def execute(job):
+    """claim で取り出したジョブを実行する。成功したら True を返す。"""
+    # 期限切れでほかのワーカーに取り出し直されていたら、その結果を上書きしない
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    try:
+        if job.name not in _registry:
+            raise LookupError(f"登録されていないジョブです: {job.name}")
+        _registry[job.name](*job.args)
+    except Exception:
+        logger.warning("ジョブ %s (%s 回目) が失敗しました。", job.name, job.attempts, exc_info=True)
+        if job.attempts >= job.max_attempts:
+            retry = {"status": Job.FAILED}
+        else:
+            retry = {"status": Job.QUEUED, "run_at": timezone.now() + timedelta(seconds=backoff(job.attempts))}
+        mine.update(locked_by="", locked_at=None, last_error=traceback.format_exc(), **retry)
+        return False
+    mine.delete()
+    return True
+
+
+def _execute_in_thread(job):
+    try:
+        return execute(job)
+    finally:
+        close_old_connections()
+
+
+def work(worker, limit, executor=None):
+    """ジョブを最大 limit 件取り出して実行し、取り出した件数を返す。executor を渡すとそのスレッドで並べて実行する。"""
+    jobs = claim(worker, limit)
+    if executor is None:
+        for job in jobs:
+            execute(job)
+    else:
+        list(executor.map(_execute_in_thread, jobs))
+    return len(jobs)
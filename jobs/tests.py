@@ -0,0 +1,118 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim, enqueue, execute, register, work
+
+calls = []
+
+
+@register("jobs.tests.record")
+def record(value):
+    calls.append(value)
+
+
+@register("jobs.tests.flaky")
+def flaky(failures):
+    # failures 回目までは失敗する
+    calls.append(failures)
+    if len(calls) <= failures:
+        raise RuntimeError("flaky")
+
+
+@override_settings(DEFER_JOBS=True, JOB_MAX_ATTEMPTS=3, JOB_RETRY_BACKOFF_SECONDS=10)
+class TestJobQueue(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    @override_settings(DEFER_JOBS=False)
+    def test_enqueue_inline(self):
+        self.assertIsNone(enqueue(record, 1))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_work(self):
+        enqueue(record, 1)
+        enqueue(record, 2)
+        self.assertEqual(calls, [])
+        self.assertEqual(work("test", 10), 2)
+        self.assertEqual(calls, [1, 2])
+        # 成功したジョブは消える
+        self.assertFalse(Job.objects.exists())
+
+    def test_retry_with_backoff(self):
+        job = enqueue(flaky, 2)
+        with self.assertLogs("jobs.queue", "WARNING") as logs:
+            work("test", 10)
+        (log,) = logs.records
+        self.assertEqual(log.getMessage(), "ジョブ jobs.tests.flaky (1 回目) が失敗しました。")
+        self.assertIs(log.exc_info[0], RuntimeError)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("RuntimeError", job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        # 待ち時間が過ぎるまでは取り出さない
+        self.assertEqual(work("test", 10), 0)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs("jobs.queue", "WARNING") as logs:
+            work("test", 10)
+        self.assertEqual(
+            [log.getMessage() for log in logs.records], ["ジョブ jobs.tests.flaky (2 回目) が失敗しました。"]
+        )
+        job.refresh_from_db()
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=15))
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertNoLogs("jobs.queue", "WARNING"):
+            work("test", 10)
+        self.assertEqual(calls, [2, 2, 2])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_after_max_attempts(self):
+        job = enqueue(flaky, 10)
+        with self.assertLogs("jobs.queue", "WARNING") as logs:
+            for _ in range(3):
+                Job.objects.update(run_at=timezone.now())
+                work("test", 10)
+        self.assertEqual(
+            [log.getMessage() for log in logs.records],
+            [f"ジョブ jobs.tests.flaky ({attempt} 回目) が失敗しました。" for attempt in (1, 2, 3)],
+        )
+        self.assertTrue(all(log.exc_info[0] is RuntimeError for log in logs.records))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(work("test", 10), 0)
+
+    def test_claim(self):
+        for i in range(3):
+            enqueue(record, i)
+        first = claim("a", 2)
+        second = claim("b", 2)
+        self.assertEqual([job.args for job in first], [[0], [1]])
+        self.assertEqual([job.args for job in second], [[2]])
+        self.assertEqual(claim("c", 2), [])
+
+    @override_settings(JOB_LEASE_SECONDS=60)
+    def test_claim_expired_lease(self):
+        enqueue(record, 1)
+        (job,) = claim("a", 1)
+        Job.objects.update(locked_at=timezone.now() - timedelta(seconds=61))
+        (again,) = claim("b", 1)
+        self.assertEqual((again.pk, again.attempts), (job.pk, 2))
+        # 取り出し直されたジョブを、元のワーカーが上書きしない
+        execute(job)
+        self.assertTrue(Job.objects.filter(pk=job.pk, locked_by=again.locked_by).exists())
+
+    def test_runworker(self):
+        for i in range(5):
+            enqueue(record, i)
+        out = StringIO()
+        call_command("runworker", "--once", "--batch-size", "2", stdout=out)
+        self.assertEqual(calls, [0, 1, 2, 3, 4])
+        self.assertIn("5件", out.getvalue())
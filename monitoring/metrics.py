@@ -0,0 +1,81 @@
+"""
+リクエストごとの計測値を URL名単位のヒストグラムに集計する。
+集計はプロセス内のメモリに持つので、ワーカーごとの値になり再起動で消える。
+"""
+
+import bisect
+import re
+import threading
+from collections import Counter
+
+# ミリ秒のバケット境界。最後のバケットは境界より大きい値すべて
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+METRICS = {
+    "wall_ms": TIME_BUCKETS,
+    "sql_ms": TIME_BUCKETS,
+    "template_ms": TIME_BUCKETS,
+    "sql_count": QUERY_BUCKETS,
+}
+
+_lock = threading.Lock()
+_stats = {}
+
+_literal = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_placeholders = re.compile(r"\(%s(?:\s*,\s*%s)*\)")
+
+
+def fingerprint(sql):
+    """値と IN 句の要素数の違いを無視して、同じ形のクエリが同じ文字列になるように正規化する。"""
+    sql = _literal.sub("%s", sql)
+    return _placeholders.sub("(...)", sql)
+
+
+def _histogram(bounds):
+    return {"buckets": [0] * (len(bounds) + 1), "sum": 0.0, "max": 0.0}
+
+
+def record(name, measurements):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = {"count": 0, **{key: _histogram(bounds) for key, bounds in METRICS.items()}}
+        stats["count"] += 1
+        for key, bounds in METRICS.items():
+            value = measurements[key]
+            histogram = stats[key]
+            histogram["buckets"][bisect.bisect_left(bounds, value)] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+
+
+def snapshot():
+    """URL名 -> {count, 指標 -> {buckets: {上限: 件数}, mean, max}} の辞書を返す。"""
+    labels = {key: [f"le_{bound}" for bound in bounds] + ["inf"] for key, bounds in METRICS.items()}
+    with _lock:
+        return {
+            name: {
+                "count": stats["count"],
+                **{
+                    key: {
+                        "buckets": dict(zip(labels[key], stats[key]["buckets"])),
+                        "mean": round(stats[key]["sum"] / stats["count"], 3),
+                        "max": round(stats[key]["max"], 3),
+                    }
+                    for key in METRICS
+                },
+            }
+            for name, stats in sorted(_stats.items())
+        }
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def duplicates(queries):
+    """2回以上実行された (フィンガープリント, 回数) を回数の多い順に返す。"""
+    counts = Counter(fingerprint(sql) for sql, _ in queries)
+    return [(sql, count) for sql, count in counts.most_common() if count > 1]
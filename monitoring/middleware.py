@@ -0,0 +1,133 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+UNRESOLVED = "<unresolved>"
+
+# 計測中のリクエストの RequestMetrics。sync_to_async の実行先のスレッドにも引き継がれる
+_recorder = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = []
+        self.template_started = None
+        self.template_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - start) * 1000))
+
+    @property
+    def sql_ms(self):
+        return sum(duration for _, duration in self.queries)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install(sender, connection, **kwargs):
+    """
+    connection_created で、新しい接続に record_query を差し込む。
+    接続はスレッドごとなので、非同期のビューがクエリを流すスレッドの接続にも最初から入る。
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class InstrumentationMiddleware:
+    """
+    リクエストごとのSQL件数・SQL時間・テンプレート描画時間・全体時間を計測し、
+    Server-Timing ヘッダーに載せて URL名ごとのヒストグラムに集計する。
+    SLOW_REQUEST_THRESHOLD_MS を超えたリクエストは重複クエリとともにログに出す。
+    非同期のビューをスレッドに載せ替えずに通すよう、同期・非同期のどちらのリクエストも扱う。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request._metrics = recorder = RequestMetrics()
+        start = time.perf_counter()
+        token = _recorder.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        request._metrics = recorder = RequestMetrics()
+        start = time.perf_counter()
+        token = _recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.finish(request, response, recorder, start)
+
+    def finish(self, request, response, recorder, start):
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        name = match.view_name if match else UNRESOLVED
+        measurements = {
+            "wall_ms": wall_ms,
+            "sql_ms": recorder.sql_ms,
+            "template_ms": recorder.template_ms,
+            "sql_count": len(recorder.queries),
+        }
+        metrics.record(name, measurements)
+        response["Server-Timing"] = (
+            f'db;dur={recorder.sql_ms:.2f};desc="{len(recorder.queries)} queries", '
+            f"tpl;dur={recorder.template_ms:.2f}, total;dur={wall_ms:.2f}"
+        )
+        if wall_ms > settings.SLOW_REQUEST_THRESHOLD_MS:
+            self.log_slow_request(request, name, measurements, recorder.queries)
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponse はこのフックの後に描画されるので、描画の前後をコールバックで挟む
+        recorder = request._metrics
+        recorder.template_started = time.perf_counter()
+
+        def rendered(response):
+            recorder.template_ms += (time.perf_counter() - recorder.template_started) * 1000
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, name, measurements, queries):
+        lines = [f"  {count}x {sql}" for sql, count in metrics.duplicates(queries)]
+        logger.warning(
+            "Slow request %s %s (%s): %.1fms, %d queries in %.1fms, template %.1fms%s",
+            request.method,
+            request.path,
+            name,
+            measurements["wall_ms"],
+            measurements["sql_count"],
+            measurements["sql_ms"],
+            measurements["template_ms"],
+            "\nDuplicated queries:\n" + "\n".join(lines) if lines else "",
+        )
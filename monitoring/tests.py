@@ -0,0 +1,93 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+
+from accounts.models import User
+from tweets.models import Tweet
+
+from . import metrics
+from .middleware import InstrumentationMiddleware
+
+
+class TestInstrumentationMiddleware(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertRegex(response.headers["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, ')
+        stats = metrics.snapshot()["tweets:home"]
+        self.assertEqual(stats["count"], 1)
+        self.assertGreater(stats["sql_count"]["max"], 0)
+        self.assertGreater(stats["template_ms"]["max"], 0)
+
+    def test_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(InstrumentationMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(InstrumentationMiddleware(lambda request: HttpResponse())))
+
+    def test_asgi_middleware_not_adapted(self):
+        # MIDDLEWARE に同期専用のものがあると、ASGI ではそこから先の非同期のビューもスレッドで動く
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    async def test_async_view_queries(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user01)
+        response = await client.get(reverse("tweets:async_home"))
+        # 非同期のビューがスレッドで流したクエリも数える
+        self.assertRegex(response.headers["Server-Timing"], r'desc="[1-9]\d* queries"')
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_request_logs_duplicated_queries(self):
+        def get_response(request):
+            # N+1 のように、引数だけが違う同じクエリを流す
+            for pk in (self.user01.pk, self.user01.pk + 1, self.user01.pk + 2):
+                list(User.objects.filter(pk=pk))
+            return HttpResponse()
+
+        request = RequestFactory().get(reverse("tweets:home"))
+        request.resolver_match = resolve(request.path)
+        with self.assertLogs("monitoring.middleware", level="WARNING") as logs:
+            InstrumentationMiddleware(get_response)(request)
+        self.assertIn("tweets:home", logs.output[0])
+        self.assertIn("Duplicated queries:\n  3x SELECT", logs.output[0])
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            metrics.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a' LIMIT 21"),
+            metrics.fingerprint("SELECT * FROM t WHERE id IN (%s) AND name = 'b' LIMIT 20"),
+        )
+
+
+class TestRequestStatsView(TestCase):
+    def setUp(self):
+        self.url = reverse("monitoring:request_stats")
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+
+    def test_success_get_as_staff(self):
+        User.objects.filter(pk=self.user01.pk).update(is_staff=True)
+        self.client.get(reverse("tweets:home"))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("tweets:home", response.json()["urls"])
+
+    def test_failure_get_as_non_staff(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import views
+
+app_name = "monitoring"
+urlpatterns = [
+    path("requests/", views.RequestStatsView.as_view(), name="request_stats"),
+]
@@ -0,0 +1,17 @@
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import JsonResponse
+from django.views.generic import View
+
+from . import metrics
+
+
+class RequestStatsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            {"buckets": {key: list(bounds) for key, bounds in metrics.METRICS.items()}, "urls": metrics.snapshot()}
+        )
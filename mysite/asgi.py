@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# アプリの読み込みは Django の初期化の後に行う
+from tweets import live  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # ライブ更新のストリームは、接続中ずっとイベントループ上で待つため Django のビューを通さずに配信する
+    if scope["type"] == "http" and scope["path"] == live.EVENTS_PATH:
+        return await live.events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,134 @@
+"""
+書き込みのエンドポイントへのリクエスト数の制限。
+
+RATE_LIMITS の範囲ごとに、ログイン中のユーザーとクライアントの IP アドレスのそれぞれにトークンバケットを持つ。
+バケットは容量 capacity のトークンを period 秒で満杯に戻し、POST などの書き込みのたびに1つ取り出す。
+取り出せなければ 429 と Retry-After を返し、ビューには進ませない。
+
+バケットは「満杯になる時刻」をマイクロ秒の整数でキャッシュに1つだけ置き (GCRA)、1トークン取り出すたびに
+その時刻を cache.incr で1トークン分進める。多くのリクエストは incr 1回で判定が済み、同時に来ても数え漏れない。
+しばらく使われず満杯に戻っていたバケットだけは、時刻を今に合わせ直す。
+取り出すたびにキーの期限を満杯に戻る時刻の少し後に合わせるので、期限切れで消えたバケットは満杯とみなせる。
+
+キャッシュはプロセスをまたいで共有されている必要がある。本番では CACHE_URL で Redis を使うこと。
+既定の LocMemCache はプロセスごとに別のバケットを持ち、MAX_ENTRIES を超えると期限前のキーも捨てる。
+捨てられたバケットは満杯に戻るので、制限が緩くなる。
+"""
+
+import math
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class TokenBucket:
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        # トークン1つ分の時間と、満杯のバケツが空になるまでに進められる時間 (マイクロ秒)
+        self.interval = max(round(period * 1_000_000 / capacity), 1)
+        self.burst = self.interval * capacity
+
+    def take(self, key, now=None):
+        """key のバケットから1トークン取り出す。取り出せたら 0、足りなければ次に取り出せるまでの秒数を返す。"""
+        now = int((now if now is not None else time.time()) * 1_000_000)
+        try:
+            full_at = cache.incr(key, self.interval)
+        except ValueError:
+            # 初めて使うか、期限切れで消えたバケット
+            if cache.add(key, now + self.interval, self._ttl(now + self.interval, now)):
+                return 0
+            full_at = cache.incr(key, self.interval)
+        if full_at < now + self.interval:
+            # 満杯に戻っていた。ここだけは set なので、同時に来た取り出しを数え漏らすことがある
+            cache.set(key, now + self.interval, self._ttl(now + self.interval, now))
+            return 0
+        if full_at - now <= self.burst:
+            # 満杯に戻るより前に期限切れで消えないよう、取り出すたびに期限を満杯に戻る時刻に合わせる
+            cache.touch(key, self._ttl(full_at, now))
+            return 0
+        self.refund(key)
+        cache.touch(key, self._ttl(full_at - self.interval, now))
+        return (full_at - self.burst - now) / 1_000_000
+
+    @staticmethod
+    def _ttl(full_at, now):
+        """満杯に戻る時刻 full_at のバケットのキーの期限 (秒)。"""
+        return math.ceil((full_at - now) / 1_000_000) + 1
+
+    def refund(self, key):
+        """take で取り出した1トークンを戻す。"""
+        try:
+            cache.decr(key, self.interval)
+        except ValueError:
+            pass
+
+
+def load_rules(limits):
+    """RATE_LIMITS から {URL名: (範囲, [(種類, TokenBucket)])} を作る。"""
+    rules = {}
+    for scope, limit in limits.items():
+        buckets = [(kind, TokenBucket(*limit[kind])) for kind in ("user", "ip") if kind in limit]
+        for view_name in limit["views"]:
+            rules[view_name] = (scope, buckets)
+    return rules
+
+
+def client_id(request, kind):
+    if kind == "user":
+        return request.user.pk if request.user.is_authenticated else None
+    # リバースプロキシの後ろに置くときは、プロキシが REMOTE_ADDR を実際のクライアントに書き換える前提
+    return request.META.get("REMOTE_ADDR")
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """
+    URL名が RATE_LIMITS にある書き込みのリクエストを、ユーザーごとと IP アドレスごとのトークンバケットで制限する。
+    MiddlewareMixin で同期・非同期のどちらのリクエストも通す。
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.rules = load_rules(settings.RATE_LIMITS)
+        if iscoroutinefunction(self):
+            # 同期の process_view を渡すと、Django はすべてのリクエストでそれを sync_to_async で呼ぶ
+            self.process_view = self.aprocess_view
+
+    def match(self, request):
+        """request が制限の対象なら (範囲, [(種類, TokenBucket)]) を、そうでなければ None を返す。"""
+        if request.method in SAFE_METHODS:
+            return None
+        return self.rules.get(request.resolver_match.view_name)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        rule = self.match(request)
+        return self.limit(request, *rule) if rule else None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        rule = self.match(request)
+        # キャッシュと request.user は同期でしか読めないので、制限の対象のリクエストだけスレッドに渡す
+        return await sync_to_async(self.limit)(request, *rule) if rule else None
+
+    def limit(self, request, scope, buckets):
+        """バケットからトークンを取り出し、足りなければ 429 のレスポンスを返す。"""
+        taken = []
+        for kind, bucket in buckets:
+            identity = client_id(request, kind)
+            if identity is None:
+                continue
+            key = f"ratelimit:{scope}:{kind}:{identity}"
+            wait = bucket.take(key)
+            if wait:
+                # 先に取り出せたバケットのトークンは、拒否したリクエストの分なので戻す
+                for taken_key, taken_bucket in taken:
+                    taken_bucket.refund(taken_key)
+                response = HttpResponse("リクエストが多すぎます。しばらくしてからやり直してください。", status=429)
+                response["Retry-After"] = max(math.ceil(wait), 1)
+                return response
+            taken.append((key, bucket))
+        return None
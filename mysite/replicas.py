@@ -0,0 +1,81 @@
+"""
+読み取りレプリカへの振り分け。
+
+GET/HEAD リクエスト中の読み取りだけを DATABASE_REPLICAS に振り分け、それ以外は常に default を使う。
+書き込みをしたクライアントには REPLICA_PIN_SECONDS の間 Cookie を付け、レプリカの遅延があっても
+自分の書き込みが読めるように default へ固定する。
+"""
+
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# リクエストの外 (管理コマンドやシェル) では常に default を読む
+_use_primary = ContextVar("use_primary", default=True)
+_wrote = ContextVar("wrote", default=False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_primary.get() or not settings.DATABASE_REPLICAS:
+            return "default"
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        # 以降の読み取りは同じリクエスト内でも書き込んだ内容が見えるよう default に寄せる
+        _use_primary.set(True)
+        _wrote.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+class ReplicaPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        use_primary, wrote = self.start(request)
+        try:
+            return self.finish(self.get_response(request))
+        finally:
+            _use_primary.reset(use_primary)
+            _wrote.reset(wrote)
+
+    async def __acall__(self, request):
+        # sync_to_async で流したクエリの振り分け先 (ContextVar の変更) は、await した後のこのコンテキストに戻る
+        use_primary, wrote = self.start(request)
+        try:
+            return self.finish(await self.get_response(request))
+        finally:
+            _use_primary.reset(use_primary)
+            _wrote.reset(wrote)
+
+    def start(self, request):
+        """このリクエストの読み取り先を決め、元に戻すためのトークンを返す。"""
+        pinned = settings.REPLICA_PIN_COOKIE in request.COOKIES
+        return _use_primary.set(pinned or request.method not in ("GET", "HEAD")), _wrote.set(False)
+
+    def finish(self, response):
+        if _wrote.get():
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
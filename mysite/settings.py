@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,14 +40,21 @@ INSTALLED_APPS = [
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
     "welcome.apps.WelcomeConfig",
+    "api.apps.ApiConfig",
+    "benchmarks.apps.BenchmarksConfig",
+    "monitoring.apps.MonitoringConfig",
+    "jobs.apps.JobsConfig",
 ]
 
 MIDDLEWARE = [
+    "monitoring.middleware.InstrumentationMiddleware",
+    "mysite.replicas.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "mysite.ratelimit.RateLimitMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -83,6 +91,74 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# Set DATABASE_REPLICAS to a comma-separated list of SQLite files (e.g. replica1.sqlite3) kept in sync
+# with db.sqlite3. GET/HEAD reads are spread over them; tests mirror them onto the default test database.
+# A client that wrote is pinned to default for REPLICA_PIN_SECONDS to read its own writes.
+
+DATABASE_REPLICAS = []
+
+for i, name in enumerate(filter(None, os.environ.get("DATABASE_REPLICAS", "").split(",")), start=1):
+    DATABASES[f"replica{i}"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / name.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{i}")
+
+DATABASE_ROUTERS = ["mysite.replicas.ReplicaRouter"]
+
+REPLICA_PIN_COOKIE = "use_primary"
+REPLICA_PIN_SECONDS = 15
+
+# Set DATABASE_PROFILE=production to tune SQLite for concurrent writers:
+# WAL lets readers proceed during a write, and transactions start with BEGIN IMMEDIATE so writers wait
+# for the lock instead of failing with "database is locked". Tests run against a file so WAL applies to them.
+
+SQLITE_PRAGMAS = {}
+
+if os.environ.get("DATABASE_PROFILE") == "production":
+    DATABASES["default"].update(
+        {
+            "ENGINE": "mysite.sqlite",
+            "CONN_MAX_AGE": 600,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {"timeout": 20},
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+        }
+    )
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 20000,
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Set CACHE_URL (e.g. redis://127.0.0.1:6379) to share the cache between processes.
+
+if os.environ.get("CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["CACHE_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+LIKED_TWEETS_CACHE_TIMEOUT = 300
+LIKED_TWEETS_CACHE_MAX_SIZE = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -140,3 +216,123 @@ AUTH_USER_MODEL = "accounts.User"
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "welcome:top"
+
+# Home timeline fan-out
+# Tweets by users with more followers than the threshold are merged at read time instead of fanned out.
+
+TIMELINE_FANOUT_THRESHOLD = 10000
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+TIMELINE_BACKFILL_SIZE = 200
+
+# Request instrumentation
+# Requests slower than the threshold are logged with their duplicated queries.
+
+SLOW_REQUEST_THRESHOLD_MS = 500
+
+# Tweet search
+# Relevance ranking only looks at this many of the newest matches so common terms stay fast.
+
+TWEET_SEARCH_RANK_WINDOW = 5000
+
+# Trending hashtags and tweets
+# Events are counted per time bucket; refresh_trending sums the last TRENDING_WINDOW_BUCKETS buckets,
+# weighting a bucket n steps old by TRENDING_DECAY ** n. With the "memory" backend each process recounts
+# its own trends every TRENDING_FLUSH_SECONDS; the "cache" backend shares the counts between processes
+# and needs manage.py refresh_trending --interval running.
+
+TRENDING_BACKEND = "cache" if os.environ.get("CACHE_URL") else "memory"
+TRENDING_BUCKET_SECONDS = 300
+TRENDING_WINDOW_BUCKETS = 12
+TRENDING_DECAY = 0.8
+TRENDING_SIZE = 10
+TRENDING_FLUSH_SECONDS = 10
+
+# Write-behind likes
+# With LIKE_WRITE_BEHIND=1, LikeView only queues the like and answers with liked_count plus the pending delta.
+# The queue is written in batches of LIKE_BUFFER_BATCH_SIZE: the "memory" buffer by a thread in each process
+# every LIKE_BUFFER_FLUSH_SECONDS (single process only), the "cache" buffer by manage.py flush_likes.
+
+LIKE_WRITE_BEHIND = os.environ.get("LIKE_WRITE_BEHIND") == "1"
+LIKE_BUFFER_BACKEND = "cache" if os.environ.get("CACHE_URL") else "memory"
+LIKE_BUFFER_FLUSH_SECONDS = 1
+LIKE_BUFFER_BATCH_SIZE = 1000
+
+# Like state endpoint
+# Responses are remembered per user and Idempotency-Key so that retries return the first answer.
+
+LIKE_IDEMPOTENCY_TIMEOUT = 60 * 60 * 24
+
+# Who-to-follow suggestions
+# build_follow_suggestions stores this many "followed by people you follow" suggestions per user.
+
+FOLLOW_SUGGESTION_SIZE = 10
+
+# Live updates
+# Like counts and new-tweet notices are pushed over SSE from mysite/asgi.py, coalesced into one message
+# per LIVE_INTERVAL_SECONDS. Use the "cache" broker when running several ASGI workers.
+
+LIVE_BROKER = "cache" if os.environ.get("CACHE_URL") else "memory"
+LIVE_INTERVAL_SECONDS = 1
+LIVE_HEARTBEAT_SECONDS = 15
+
+# Chunked deletion
+# Tweets and withdrawn accounts are deleted dependents first, at most this many rows per DELETE statement.
+# Account deletions are queued by AccountDeleteView and carried out by manage.py delete_accounts.
+
+DELETION_CHUNK_SIZE = 1000
+
+# Background jobs
+# With DEFER_JOBS=1, work the response does not depend on (follower fan-out and search indexing of new tweets,
+# timeline backfill and trim after follow/unfollow, account deletion) is stored as a Job row and run by
+# manage.py runworker. Failed jobs are retried up to JOB_MAX_ATTEMPTS times, waiting JOB_RETRY_BACKOFF_SECONDS
+# doubled on every attempt; a job whose worker has not finished it within JOB_LEASE_SECONDS is run again.
+
+DEFER_JOBS = os.environ.get("DEFER_JOBS") == "1"
+JOB_BATCH_SIZE = 20
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF_SECONDS = 2
+JOB_RETRY_BACKOFF_MAX_SECONDS = 60 * 10
+JOB_LEASE_SECONDS = 60 * 5
+
+# Rate limiting
+# Token buckets for write requests (POST etc.), one per logged-in user and one per client IP for each scope.
+# "user" / "ip" are (capacity, period): a client may burst up to capacity requests, refilled over period seconds.
+# Requests over the limit get 429 with Retry-After before reaching the view.
+# The buckets live in the cache, so production needs CACHE_URL (Redis): LocMemCache keeps separate buckets per
+# process and culls keys past MAX_ENTRIES, which silently refills them.
+# The test runner turns rate limiting off (RATE_LIMITS = {}); tests of the limiter override it.
+
+RATE_LIMITS = {
+    "tweet": {
+        "views": ["tweets:create"],
+        "user": (30, 60 * 10),
+        "ip": (150, 60 * 10),
+    },
+    "like": {
+        "views": [
+            "tweets:like",
+            "tweets:unlike",
+            "tweets:like_state",
+            "tweets:async_like",
+            "tweets:async_unlike",
+            "api:like",
+            "api:unlike",
+        ],
+        "user": (120, 60),
+        "ip": (600, 60),
+    },
+    "follow": {
+        "views": [
+            "accounts:follow",
+            "accounts:unfollow",
+            "accounts:async_follow",
+            "accounts:async_unfollow",
+            "api:follow",
+            "api:unfollow",
+        ],
+        "user": (60, 60 * 10),
+        "ip": (300, 60 * 10),
+    },
+}
+
+TEST_RUNNER = "mysite.test_runner.TestRunner"
@@ -0,0 +1,19 @@
+"""
+本番プロファイル用の SQLite バックエンド (ENGINE = "mysite.sqlite")。
+
+接続ごとに SQLITE_PRAGMAS を適用する。journal_mode=WAL はデータベースファイルに記録されるが、
+それ以外の PRAGMA は接続ごとに設定し直す必要がある。
+"""
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite" or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,8 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        # BEGIN (DEFERRED) のトランザクションは読み取りの後で書き込みロックへの昇格に失敗すると
+        # busy_timeout を待たずに "database is locked" になる。最初から書き込みロックを取って待たせる。
+        self.cursor().execute("BEGIN IMMEDIATE")
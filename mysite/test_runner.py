@@ -0,0 +1,21 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    テストでは既定で書き込みのリクエスト数を制限しない (RATE_LIMITS = {})。
+    テストのクライアントはすべて同じ IP アドレスから送り、バケットはキャッシュに残るので、制限したままだと
+    テストの数や順番で 429 が返るようになる。制限を確かめるテストは override_settings で RATE_LIMITS を指定する。
+    遅いリクエストのログ (SLOW_REQUEST_THRESHOLD_MS) も、テスト用のデータベースの作成や並列のテストで
+    遅くなったリクエストが出力を汚すので出さない。ログを確かめるテストは override_settings でしきい値を下げる。
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(RATE_LIMITS={}, SLOW_REQUEST_THRESHOLD_MS=float("inf"))
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,157 @@
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from tweets.models import Tweet
+
+from .ratelimit import RateLimitMiddleware, TokenBucket
+from .replicas import ReplicaPinningMiddleware, ReplicaRouter
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class TestReplicaRouting(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def dispatch(self, request, write=False):
+        """ビューの代わりに、読み取り先 (書き込み前・後) を記録してレスポンスを返す。"""
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Tweet))
+            if write:
+                self.router.db_for_write(Tweet)
+            reads.append(self.router.db_for_read(User))
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return reads, response
+
+    def test_get_reads_from_replica(self):
+        reads, response = self.dispatch(self.factory.get("/"))
+        self.assertEqual(reads, ["replica1", "replica1"])
+        self.assertNotIn("use_primary", response.cookies)
+
+    def test_write_pins_to_primary(self):
+        reads, response = self.dispatch(self.factory.post("/"), write=True)
+        self.assertEqual(reads, ["default", "default"])
+        self.assertEqual(response.cookies["use_primary"]["max-age"], 15)
+
+    def test_write_during_get_reads_own_write(self):
+        reads, response = self.dispatch(self.factory.get("/"), write=True)
+        self.assertEqual(reads, ["replica1", "default"])
+        self.assertIn("use_primary", response.cookies)
+
+    def test_pinned_client_reads_from_primary(self):
+        request = self.factory.get("/")
+        request.COOKIES["use_primary"] = "1"
+        reads, _ = self.dispatch(request)
+        self.assertEqual(reads, ["default", "default"])
+
+    def test_outside_request_reads_from_primary(self):
+        self.assertEqual(self.router.db_for_read(Tweet), "default")
+
+    async def test_async_write_during_get_reads_own_write(self):
+        reads = []
+
+        def write():
+            reads.append(self.router.db_for_read(Tweet))
+            self.router.db_for_write(Tweet)
+
+        async def view(request):
+            # 非同期のビューは ORM を sync_to_async で呼ぶ
+            await sync_to_async(write)()
+            reads.append(self.router.db_for_read(User))
+            return HttpResponse()
+
+        response = await ReplicaPinningMiddleware(view)(self.factory.get("/"))
+        self.assertEqual(reads, ["replica1", "default"])
+        self.assertIn("use_primary", response.cookies)
+        self.assertEqual(self.router.db_for_read(Tweet), "default")
+
+
+class TestTokenBucket(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.bucket = TokenBucket(3, 3)
+
+    def test_take(self):
+        self.assertEqual([self.bucket.take("key", now=100) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.bucket.take("key", now=100), 1)
+        # 1秒で1トークン戻る
+        self.assertAlmostEqual(self.bucket.take("key", now=100.5), 0.5)
+        self.assertEqual(self.bucket.take("key", now=101), 0)
+        self.assertAlmostEqual(self.bucket.take("key", now=101), 1)
+
+    def test_refill_after_idle(self):
+        for _ in range(3):
+            self.bucket.take("key", now=100)
+        # 使われない間に満杯に戻り、それ以上はたまらない
+        self.assertEqual([self.bucket.take("key", now=200) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.bucket.take("key", now=200), 0)
+
+    def test_expires_when_full(self):
+        with mock.patch.object(cache, "touch", wraps=cache.touch) as touch:
+            for _ in range(3):
+                self.bucket.take("key", now=100)
+        # 取り出すたびに、キーの期限を満杯に戻る時刻 (2秒後、3秒後) の1秒後に合わせる
+        self.assertEqual(touch.call_args_list, [mock.call("key", 3), mock.call("key", 4)])
+
+
+@override_settings(RATE_LIMITS={"like": {"views": ["tweets:like", "tweets:unlike"], "user": (2, 60), "ip": (3, 60)}})
+class TestRateLimitMiddleware(TestCase):
+    def setUp(self):
+        cache.clear()
+        # 消さないと、ほかのテストが同じユーザーと IP アドレスのバケットを引き継ぐ
+        self.addCleanup(cache.clear)
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="password")
+            for i in range(2)
+        ]
+        self.tweet = Tweet.objects.create(user=self.users[0], content="テスト")
+        self.client.force_login(self.users[0])
+
+    def test_user_limit(self):
+        like, unlike = reverse("tweets:like", args=[self.tweet.pk]), reverse("tweets:unlike", args=[self.tweet.pk])
+        self.assertEqual(self.client.post(like).status_code, 200)
+        self.assertEqual(self.client.post(unlike).status_code, 200)
+        response = self.client.post(like)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        # 読み取りは制限しない
+        self.assertEqual(self.client.get(reverse("tweets:detail", args=[self.tweet.pk])).status_code, 200)
+
+    def test_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RateLimitMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        # 制限の対象でないリクエストを、スレッドに渡さずに通す
+        self.assertTrue(iscoroutinefunction(middleware.process_view))
+
+    @override_settings(RATE_LIMITS={"like": {"views": ["tweets:async_like"], "user": (1, 60)}})
+    async def test_async_view(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.users[0])
+        url = reverse("tweets:async_like", args=[self.tweet.pk])
+        self.assertEqual((await client.post(url)).status_code, 200)
+        self.assertEqual((await client.post(url)).status_code, 429)
+
+    def test_ip_limit(self):
+        like = reverse("tweets:like", args=[self.tweet.pk])
+        self.assertEqual(self.client.post(like).status_code, 200)
+        self.assertEqual(self.client.post(like).status_code, 200)
+        # 同じ IP アドレスの別のユーザーは、IP アドレスのバケットが尽きるまで
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.client.post(like).status_code, 200)
+        self.assertEqual(self.client.post(like).status_code, 429)
+        # 別の IP アドレスからなら、ユーザーのバケットが残っている
+        self.assertEqual(self.client.post(like, REMOTE_ADDR="10.0.0.1").status_code, 200)
@@ -20,5 +20,7 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("accounts/", include("accounts.urls")),
     path("tweets/", include("tweets.urls")),
+    path("api/v1/", include("api.urls")),
+    path("monitoring/", include("monitoring.urls")),
     path("", include("welcome.urls")),
 ]
@@ -10,34 +10,63 @@ const getCookie = (name) => {
 };
 const csrftoken = getCookie('csrftoken');
 
+const MAX_ATTEMPTS = 3;
 
-const likeAction = async (tweet) => {
+const newIdempotencyKey = () => {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+};
+
+// 応答を待たずに表示を切り替え、サーバーの応答が届いたら数を合わせる。
+// 連打したときは最後のクリックの応答だけを表示に反映する。
+const likeAction = async (button) => {
+    const count = document.querySelector(`[name="count_${button.dataset.tweetId}"]`);
+    const previous = {is_liked: button.dataset.liked === 'true', liked_count: Number(count.innerHTML)};
+    const liked = !previous.is_liked;
+    const sequence = String(Number(button.dataset.sequence || 0) + 1);
+    button.dataset.sequence = sequence;
+    button.dataset.pending = 'true';
+    changeStyle({is_liked: liked, liked_count: Math.max(previous.liked_count + (liked ? 1 : -1), 0)}, button);
 
-    const url = tweet.dataset.url;
     const data = {
         method: "POST",
         headers: {
             "Content-Type": "application/json",
             "X-CSRFToken": csrftoken,
+            // 再送しても同じ鍵なら、サーバーは書き込まずに最初の応答を返す
+            "Idempotency-Key": newIdempotencyKey(),
         },
+        body: JSON.stringify({liked: liked}),
+    };
+    for (let attempt = 0; attempt < MAX_ATTEMPTS; attempt++) {
+        try {
+            const response = await fetch(button.dataset.url, data);
+            if (response.ok) {
+                const tweet_data = await response.json();
+                if (button.dataset.sequence === sequence) {
+                    changeStyle(tweet_data, button);
+                    delete button.dataset.pending;
+                }
+                return;
+            }
+            if (response.status < 500) {
+                break;
+            }
+        } catch (error) {
+            // 通信エラーは再送する
+        }
     }
-    const response = await fetch(url, data);
-    const tweet_data = await response.json();
-    changeStyle(tweet_data, tweet);
-}
-
-const changeStyle = (tweet_data, selector) => {
-    const count = document.querySelector(`[name="count_${tweet_data.tweet_id}"]`)
-
-    if (tweet_data.is_liked) {
-        unlike_url = `/tweets/${tweet_data.tweet_id}/unlike/`
-        selector.setAttribute('data-url', unlike_url);
-        selector.innerHTML = "いいね解除";
-        count.innerHTML = tweet_data.liked_count;
-    } else {
-        like_url = `/tweets/${tweet_data.tweet_id}/like/`
-        selector.setAttribute('data-url', like_url);
-        selector.innerHTML = "いいね";
-        count.innerHTML = tweet_data.liked_count;
+    if (button.dataset.sequence === sequence) {
+        changeStyle(previous, button);
+        delete button.dataset.pending;
     }
-}
+};
+
+const changeStyle = (tweet_data, button) => {
+    const count = document.querySelector(`[name="count_${button.dataset.tweetId}"]`);
+    button.dataset.liked = tweet_data.is_liked ? 'true' : 'false';
+    button.innerHTML = tweet_data.is_liked ? "いいね解除" : "いいね";
+    count.innerHTML = tweet_data.liked_count;
+};
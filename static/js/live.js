@@ -0,0 +1,27 @@
+// いいね数の変化と新しいツイートの件数をサーバーから受け取り、ページを読み直さずに反映する。
+// ASGI で動かしていないときは接続が 404 で失敗し、EventSource はそのまま再接続しない。
+const LIVE_URL = '/tweets/live/';
+
+let newTweets = 0;
+
+const applyLiveUpdate = (update) => {
+    for (const [tweet_id, liked_count] of Object.entries(update.likes)) {
+        const count = document.querySelector(`[name="count_${tweet_id}"]`);
+        const button = document.querySelector(`#tweet_${tweet_id}`);
+        // 自分のクリックの応答待ちのあいだは、楽観的に描いた数を上書きしない
+        if (count && !(button && button.dataset.pending)) {
+            count.innerHTML = liked_count;
+        }
+    }
+    const notice = document.querySelector('#new-tweets');
+    if (notice && update.new_tweets) {
+        newTweets += update.new_tweets;
+        notice.innerHTML = `${newTweets}件の新しいツイート`;
+        notice.hidden = false;
+    }
+};
+
+if (window.EventSource) {
+    const source = new EventSource(LIVE_URL);
+    source.addEventListener('update', (event) => applyLiveUpdate(JSON.parse(event.data)));
+}
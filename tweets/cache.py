@@ -0,0 +1,12 @@
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+# テンプレートの {% cache %} で使うフラグメント名。いずれも tweet.id と tweet.created_at、
+# 投稿者の名前が変わったら作り直すよう投稿者の updated_at で区別する。
+TWEET_FRAGMENTS = ("home_tweet", "detail_tweet", "profile_tweet")
+
+
+def invalidate_tweet(tweet_id, created_at, author_updated_at):
+    cache.delete_many(
+        [make_template_fragment_key(name, [tweet_id, created_at, author_updated_at]) for name in TWEET_FRAGMENTS]
+    )
@@ -0,0 +1,91 @@
+"""
+ツイートやいいねを、依存する行ごと少しずつ消す。
+
+Model.delete() の CASCADE は、消す行とそれに依存する行を1回の DELETE にまとめる。いいねの多いツイートでは
+1文で大量の行を消すことになり、その間ずっと書き込みのロックを持つ。また、ユーザーを消すときはツイートを
+すべてインスタンスとして読み込み、ほかのユーザーのツイートのいいね数やフォロー数も直さない。
+ここでは依存する行を DELETION_CHUNK_SIZE 件ずつ主キーで指定して消し、最後に本体を消す。
+途中で止まっても、同じ関数をもう一度呼べば残りから続きを消せる。
+"""
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from tweets.cache import invalidate_tweet
+from tweets.models import Like, Mention, TimelineEntry, Tweet, TweetHashtag
+from tweets.search import unindex_tweet
+
+# ツイートに依存するテーブル。検索の索引は unindex_tweet で消す
+TWEET_DEPENDENTS = (Like, TimelineEntry, TweetHashtag, Mention)
+
+
+def delete_chunk(queryset, chunk_size=None):
+    """queryset の行を主キーの小さい方から最大 chunk_size 件消し、消した行数を返す。"""
+    pks = list(queryset.order_by("pk").values_list("pk", flat=True)[: chunk_size or settings.DELETION_CHUNK_SIZE])
+    if not pks:
+        return 0
+    count, _ = queryset.model._base_manager.filter(pk__in=pks).delete()
+    return count
+
+
+def delete_in_chunks(queryset, chunk_size=None):
+    """queryset の行を chunk_size 件ずつ、残りがなくなるまで消し、消した行数を返す。"""
+    deleted = 0
+    while count := delete_chunk(queryset, chunk_size):
+        deleted += count
+    return deleted
+
+
+def delete_tweets(tweets, chunk_size=None):
+    """
+    tweets (id と user と created_at を読んだ Tweet のリスト) を依存する行ごと消し、消した行数を返す。
+    消す前に読み込んだツイートをそのまま受け取り、ここでは読み直さない。
+    投稿者の User.updated_at を進め、プロフィールの版数を変える。
+    """
+    ids = [tweet.pk for tweet in tweets]
+    if not ids:
+        return 0
+    deleted = 0
+    for model in TWEET_DEPENDENTS:
+        deleted += delete_in_chunks(model.objects.filter(tweet_id__in=ids), chunk_size)
+    authors = get_user_model().objects.filter(pk__in={tweet.user_id for tweet in tweets})
+    # フラグメントは投稿者の updated_at でも区別しているので、進める前の値で消す
+    author_updated_at = dict(authors.values_list("pk", "updated_at"))
+    with transaction.atomic():
+        unindex_tweet(*ids)
+        count, _ = Tweet.objects.filter(pk__in=ids).delete()
+        authors.update(updated_at=timezone.now())
+    for tweet in tweets:
+        invalidate_tweet(tweet.pk, tweet.created_at, author_updated_at.get(tweet.user_id))
+    return deleted + count
+
+
+def delete_likes(queryset, chunk_size=None):
+    """
+    queryset のいいねを主キーの小さい方から最大 chunk_size 件消し、いいねされていたツイートのいいね数を減らす。
+    消した件数を返す。
+    """
+    with transaction.atomic():
+        # 同じいいねを2つの処理が消しても、いいね数を二重に減らさないよう行をロックして読む
+        likes = list(
+            queryset.select_for_update()
+            .order_by("pk")
+            .values_list("pk", "tweet_id")[: chunk_size or settings.DELETION_CHUNK_SIZE]
+        )
+        Like.objects.filter(pk__in=[pk for pk, _ in likes]).delete()
+        # 減らす量が同じツイートは1回の UPDATE にまとめる
+        tweets_by_delta = defaultdict(list)
+        for tweet_id, delta in Counter(tweet_id for _, tweet_id in likes).items():
+            tweets_by_delta[delta].append(tweet_id)
+        now = timezone.now()
+        for delta, pks in tweets_by_delta.items():
+            Tweet.objects.filter(pk__in=pks).update(
+                liked_count=Greatest(F("liked_count") - delta, Value(0)), updated_at=now
+            )
+    return len(likes)
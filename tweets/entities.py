@@ -0,0 +1,63 @@
+"""
+ツイート本文から #ハッシュタグ と @メンション を取り出し、Hashtag / TweetHashtag / Mention に書き込む。
+
+ハッシュタグは英数字や日本語の直後の # を含まない (C# や 今日は#晴れ はタグにしない)。
+名前は NFKC 正規化して小文字にそろえ、数字だけのものは除く。メンションは存在するユーザー名だけを記録する。
+"""
+
+import re
+import unicodedata
+
+from accounts.models import User
+from tweets.models import Hashtag, Mention, TweetHashtag
+
+_hashtag = re.compile(r"(?<![\w&])[#＃](\w+)")
+_mention = re.compile(r"(?<![\w@])[@＠]([\w.+-]+)")
+
+MAX_HASHTAG_LENGTH = Hashtag._meta.get_field("name").max_length
+
+
+def normalize_hashtag(name):
+    return unicodedata.normalize("NFKC", name).lower()
+
+
+def extract_hashtags(content):
+    names = {normalize_hashtag(name) for name in _hashtag.findall(content)}
+    return {name for name in names if not name.isdigit() and len(name) <= MAX_HASHTAG_LENGTH}
+
+
+def extract_mentions(content):
+    # 文末の句点などはユーザー名に含めない
+    return {username.rstrip(".") for username in _mention.findall(content)}
+
+
+def save_entities(tweets):
+    """tweets (content と created_at を読み込み済みのツイート) のハッシュタグとメンションをまとめて書き込む。"""
+    hashtags = {tweet.pk: extract_hashtags(tweet.content) for tweet in tweets}
+    mentions = {tweet.pk: extract_mentions(tweet.content) for tweet in tweets}
+
+    names = set().union(*hashtags.values())
+    if names:
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+        hashtag_ids = dict(Hashtag.objects.filter(name__in=names).values_list("name", "pk"))
+        TweetHashtag.objects.bulk_create(
+            [
+                TweetHashtag(hashtag_id=hashtag_ids[name], tweet_id=tweet.pk, created_at=tweet.created_at)
+                for tweet in tweets
+                for name in hashtags[tweet.pk]
+            ],
+            ignore_conflicts=True,
+        )
+
+    usernames = set().union(*mentions.values())
+    if usernames:
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list("username", "pk"))
+        Mention.objects.bulk_create(
+            [
+                Mention(user_id=user_ids[username], tweet_id=tweet.pk, created_at=tweet.created_at)
+                for tweet in tweets
+                for username in mentions[tweet.pk]
+                if username in user_ids
+            ],
+            ignore_conflicts=True,
+        )
@@ -0,0 +1,166 @@
+"""
+書き込みを後回しにするいいね (LIKE_WRITE_BEHIND) の意図を溜めておくバッファ。
+
+LikeView / UnlikeView は意図を積むだけで応答し、tweets.likes.flush_pending_likes がまとめて書き込む。
+バッファは、データベースにまだ書き込んでいない意図を3つの形で持つ。
+- 書き込む順の意図
+- ユーザーとツイートの組ごとの最新の状態 (いいね済みかの表示に使う)
+- ツイートごとのいいね数の増減 (応答のいいね数に使う)
+
+LIKE_BUFFER_BACKEND が "memory" ならプロセス内、"cache" ならキャッシュ上に置き、プロセス間で共有する。
+"""
+
+import itertools
+import threading
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+Intent = namedtuple("Intent", ["id", "user_id", "tweet_id", "liked", "delta"])
+
+
+def _delta(liked):
+    return 1 if liked else -1
+
+
+class MemoryBuffer:
+    """1プロセスで動かすときのバッファ。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.intents = deque()
+        self.latest = {}
+        self.deltas = Counter()
+        self.ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.intents)
+
+    def push(self, user_id, tweet_id, liked, stored):
+        """
+        stored (データベース上でいいね済みか) と積んである意図から見て状態が変わるときだけ積む。
+        積んだら True を返す。
+        """
+        with self.lock:
+            current = self.latest.get((user_id, tweet_id))
+            if (current.liked if current else stored) == liked:
+                return False
+            intent = Intent(next(self.ids), user_id, tweet_id, liked, _delta(liked))
+            self.intents.append(intent)
+            self.latest[user_id, tweet_id] = intent
+            self.deltas[tweet_id] += intent.delta
+            return True
+
+    def states(self, user_id, tweet_ids):
+        """tweet_ids のうち意図が積まれているものについて {ツイートID: いいね済みか} を返す。"""
+        with self.lock:
+            latest = {tweet_id: self.latest.get((user_id, tweet_id)) for tweet_id in tweet_ids}
+        return {tweet_id: intent.liked for tweet_id, intent in latest.items() if intent}
+
+    def delta(self, tweet_id):
+        with self.lock:
+            return self.deltas[tweet_id]
+
+    @contextmanager
+    def batch(self, limit):
+        """古い順に最大 limit 件の意図を渡し、ブロックを抜けたらバッファから取り除く。例外のときは残す。"""
+        with self.flush_lock:
+            with self.lock:
+                intents = list(itertools.islice(self.intents, limit))
+            yield intents
+            with self.lock:
+                for intent in intents:
+                    self.intents.popleft()
+                    self.deltas[intent.tweet_id] -= intent.delta
+                    if not self.deltas[intent.tweet_id]:
+                        del self.deltas[intent.tweet_id]
+                    if self.latest.get((intent.user_id, intent.tweet_id)) is intent:
+                        del self.latest[intent.user_id, intent.tweet_id]
+
+
+class CacheBuffer:
+    """
+    複数プロセスで共有するバッファ。意図はキャッシュ上に連番のスロットとして並べ、
+    tail (最後に割り当てた番号) と head (書き込み済みの番号) で範囲を表す。
+    """
+
+    def __init__(self, prefix="like_buffer"):
+        self.prefix = prefix
+        # 番号を割り当ててから書き込むまでの間に読んだ空きスロット
+        self.missing = None
+
+    def _key(self, *parts):
+        return ":".join(map(str, (self.prefix,) + parts))
+
+    def __len__(self):
+        return cache.get(self._key("tail"), 0) - cache.get(self._key("head"), 0)
+
+    def _incr(self, key, delta):
+        cache.add(key, 0, None)
+        return cache.incr(key, delta)
+
+    def push(self, user_id, tweet_id, liked, stored):
+        state_key = self._key("state", user_id, tweet_id)
+        current = cache.get(state_key)
+        if (current.liked if current else stored) == liked:
+            return False
+        intent = Intent(self._incr(self._key("tail"), 1), user_id, tweet_id, liked, _delta(liked))
+        self._incr(self._key("delta", tweet_id), intent.delta)
+        cache.set_many({self._key("intent", intent.id): intent, state_key: intent}, None)
+        return True
+
+    def states(self, user_id, tweet_ids):
+        keys = {self._key("state", user_id, tweet_id): tweet_id for tweet_id in tweet_ids}
+        return {keys[key]: intent.liked for key, intent in cache.get_many(keys).items()}
+
+    def delta(self, tweet_id):
+        return cache.get(self._key("delta", tweet_id), 0)
+
+    @contextmanager
+    def batch(self, limit):
+        lock_key = self._key("lock")
+        if not cache.add(lock_key, 1, timeout=60):
+            # ほかのプロセスが書き込み中
+            yield []
+            return
+        try:
+            head = cache.get(self._key("head"), 0)
+            tail = cache.get(self._key("tail"), 0)
+            ids = range(head + 1, min(tail, head + limit) + 1)
+            slots = cache.get_many([self._key("intent", i) for i in ids])
+            intents, last = [], head
+            for i in ids:
+                intent = slots.get(self._key("intent", i))
+                if intent is None and self.missing != i:
+                    # 書き込み途中かもしれないので待つ。次の回でも空なら、積む前に落ちたとみなして飛ばす
+                    self.missing = i
+                    break
+                if intent is not None:
+                    intents.append(intent)
+                last = i
+            yield intents
+
+            cache.delete_many([self._key("intent", i) for i in range(head + 1, last + 1)])
+            cache.set(self._key("head"), last, None)
+            deltas = Counter()
+            for intent in intents:
+                deltas[intent.tweet_id] += intent.delta
+            for tweet_id, delta in deltas.items():
+                if delta:
+                    self._incr(self._key("delta", tweet_id), -delta)
+            state_keys = {self._key("state", intent.user_id, intent.tweet_id): intent for intent in intents}
+            latest = cache.get_many(state_keys)
+            cache.delete_many([key for key, intent in state_keys.items() if latest.get(key) == intent])
+        finally:
+            cache.delete(lock_key)
+
+
+memory = MemoryBuffer()
+shared = CacheBuffer()
+
+
+def get_buffer():
+    return shared if settings.LIKE_BUFFER_BACKEND == "cache" else memory
@@ -0,0 +1,268 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, connections, router, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from tweets import like_buffer, live, trending
+from tweets.models import Like, Tweet
+
+logger = logging.getLogger(__name__)
+
+# いいね数が LIKED_TWEETS_CACHE_MAX_SIZE を超えるユーザーは集合をキャッシュせず、この印だけを置く
+TOO_MANY = "too_many"
+
+
+def _liked_tweets_key(user):
+    # 同じ pk が再利用されても古い集合を読まないよう、登録日時も鍵に含める
+    return f"liked_tweets:{user.pk}:{user.date_joined.timestamp()}"
+
+
+def _cached_liked_tweets(user):
+    liked = cache.get(_liked_tweets_key(user))
+    if liked is None:
+        max_size = settings.LIKED_TWEETS_CACHE_MAX_SIZE
+        liked = set(Like.objects.filter(user=user).values_list("tweet_id", flat=True)[: max_size + 1])
+        if len(liked) > max_size:
+            liked = TOO_MANY
+        cache.set(_liked_tweets_key(user), liked, settings.LIKED_TWEETS_CACHE_TIMEOUT)
+    return liked
+
+
+def _stored_liked_tweet_ids(user, tweet_ids):
+    liked = _cached_liked_tweets(user)
+    if liked != TOO_MANY:
+        return liked & tweet_ids
+    return set(Like.objects.filter(user=user, tweet_id__in=tweet_ids).values_list("tweet_id", flat=True))
+
+
+def liked_tweet_ids(user, tweet_ids):
+    """
+    tweet_ids のうち user がいいねしているものの集合を返す。
+    いいね数の少ないユーザーはキャッシュした集合から、多いユーザーは tweet_id__in の1クエリで引く。
+    LIKE_WRITE_BEHIND のときは、まだ書き込んでいない意図も反映する。
+    """
+    tweet_ids = set(tweet_ids)
+    if not tweet_ids or not user.is_authenticated:
+        return set()
+    liked = _stored_liked_tweet_ids(user, tweet_ids)
+    if settings.LIKE_WRITE_BEHIND:
+        for tweet_id, state in like_buffer.get_buffer().states(user.pk, tweet_ids).items():
+            if state:
+                liked.add(tweet_id)
+            else:
+                liked.discard(tweet_id)
+    return liked
+
+
+def _liked_tweets_changed_key(user):
+    return f"liked_tweets_changed:{user.pk}:{user.date_joined.timestamp()}"
+
+
+def liked_tweets_changed_at(user):
+    """
+    user のいいねの集合が最後に変わった日時。いいねの状態を描くページの版数に使う。
+    キャッシュから消えていたら今の日時を返し、版数を変える側に倒す。
+    """
+    if not user.is_authenticated:
+        return None
+    key = _liked_tweets_changed_key(user)
+    changed_at = cache.get(key)
+    if changed_at is None:
+        changed_at = timezone.now()
+        if not cache.add(key, changed_at, settings.LIKED_TWEETS_CACHE_TIMEOUT):
+            changed_at = cache.get(key, changed_at)
+    return changed_at
+
+
+def _touch_liked_tweets(user):
+    cache.set(_liked_tweets_changed_key(user), timezone.now(), settings.LIKED_TWEETS_CACHE_TIMEOUT)
+
+
+def invalidate_liked_tweets(user):
+    cache.delete(_liked_tweets_key(user))
+    _touch_liked_tweets(user)
+
+
+def _add_liked_count(tweet_id, delta):
+    """liked_count に delta を足し、足した後の値を返す。ツイートがなければ None。"""
+    connection = connections[router.db_for_write(Tweet)]
+    if connection.vendor in ("sqlite", "postgresql") and connection.features.can_return_columns_from_insert:
+        # UPDATE ... RETURNING で、更新と読み直しを1往復で済ませる
+        table = connection.ops.quote_name(Tweet._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET liked_count = CASE WHEN liked_count + %s < 0 THEN 0 ELSE liked_count + %s END, "
+                "updated_at = %s WHERE id = %s RETURNING liked_count",
+                [delta, delta, now, tweet_id],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+    updated = Tweet.objects.filter(pk=tweet_id).update(
+        liked_count=Greatest(F("liked_count") + delta, Value(0)), updated_at=timezone.now()
+    )
+    if not updated:
+        return None
+    return Tweet.objects.filter(pk=tweet_id).values_list("liked_count", flat=True).first()
+
+
+def set_like(user, tweet_id, liked):
+    """
+    user の tweet_id へのいいねを liked の状態にし、最新のいいね数を返す。すでにその状態なら何も書き込まない。
+    ツイートを先に読まず、ツイートがなければ書き込みを巻き戻して Tweet.DoesNotExist を送出する。
+    """
+    if settings.LIKE_WRITE_BEHIND:
+        return _buffer_like(user, Tweet.objects.only("liked_count").get(pk=tweet_id), liked)
+    with transaction.atomic():
+        if liked:
+            try:
+                with transaction.atomic():
+                    Like.objects.create(user=user, tweet_id=tweet_id)
+                changed = True
+            except IntegrityError:
+                changed = False
+        else:
+            changed = Like.objects.filter(user=user, tweet_id=tweet_id).delete()[0] > 0
+        if changed:
+            liked_count = _add_liked_count(tweet_id, 1 if liked else -1)
+        else:
+            liked_count = Tweet.objects.filter(pk=tweet_id).values_list("liked_count", flat=True).first()
+        if liked_count is None:
+            raise Tweet.DoesNotExist(f"Tweet {tweet_id} does not exist.")
+    if changed:
+        invalidate_liked_tweets(user)
+        live.publish_like(tweet_id, liked_count)
+        if liked:
+            trending.record("tweets", [tweet_id])
+    return liked_count
+
+
+def like_tweet(user, tweet):
+    """いいねを付け、最新のいいね数を返す。すでにいいね済みなら何も書き込まない。"""
+    return set_like(user, tweet.pk, True)
+
+
+def unlike_tweet(user, tweet):
+    """いいねを外し、最新のいいね数を返す。いいねしていなければ何も書き込まない。"""
+    return set_like(user, tweet.pk, False)
+
+
+# 非同期版。いいねの行とカウンタを1つのトランザクションで書くよう、同期版をスレッドで実行する。
+
+
+async def alike_tweet(user, tweet):
+    return await sync_to_async(like_tweet)(user, tweet)
+
+
+async def aunlike_tweet(user, tweet):
+    return await sync_to_async(unlike_tweet)(user, tweet)
+
+
+# 書き込みを後回しにするモード (LIKE_WRITE_BEHIND)。いいね/いいね解除の意図を tweets.like_buffer に積んで応答し、
+# flush_pending_likes がまとめて書き込む。
+
+
+def _buffer_like(user, tweet, liked):
+    """意図をバッファに積み、Tweet.liked_count にまだ書き込んでいない増減を足したいいね数を返す。"""
+    buffer = like_buffer.get_buffer()
+    stored = tweet.pk in _stored_liked_tweet_ids(user, {tweet.pk})
+    pushed = buffer.push(user.pk, tweet.pk, liked, stored)
+    if buffer is like_buffer.memory and settings.LIKE_BUFFER_FLUSH_SECONDS:
+        _start_flusher()
+    liked_count = max(tweet.liked_count + buffer.delta(tweet.pk), 0)
+    if pushed:
+        _touch_liked_tweets(user)
+        live.publish_like(tweet.pk, liked_count)
+        if liked:
+            trending.record("tweets", [tweet.pk])
+    return liked_count
+
+
+def flush_pending_likes(batch_size=None):
+    """バッファに積まれた意図を古い順に最大 batch_size 件まとめて書き込み、処理した件数を返す。"""
+    with like_buffer.get_buffer().batch(batch_size or settings.LIKE_BUFFER_BATCH_SIZE) as intents:
+        if intents:
+            _write_intents(intents)
+    return len(intents)
+
+
+def _write_intents(intents):
+    # 同じユーザーとツイートの組は最後の意図だけを書き込めばよい
+    final = {(intent.user_id, intent.tweet_id): intent.liked for intent in intents}
+    user_ids = {user_id for user_id, _ in final}
+    tweet_ids = {tweet_id for _, tweet_id in final}
+    with transaction.atomic():
+        # 積んだ後に消えたユーザーやツイートの分は書き込まない
+        users = list(get_user_model().objects.filter(pk__in=user_ids).only("date_joined"))
+        existing_users = {user.pk for user in users}
+        existing_tweets = set(Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", flat=True))
+        stored = {
+            (user_id, tweet_id): pk
+            for pk, user_id, tweet_id in Like.objects.filter(user_id__in=user_ids, tweet_id__in=tweet_ids).values_list(
+                "pk", "user_id", "tweet_id"
+            )
+        }
+        created = [
+            pair
+            for pair, liked in final.items()
+            if liked and pair not in stored and pair[0] in existing_users and pair[1] in existing_tweets
+        ]
+        deleted = [pair for pair, liked in final.items() if not liked and pair in stored]
+        Like.objects.bulk_create([Like(user_id=user_id, tweet_id=tweet_id) for user_id, tweet_id in created])
+        Like.objects.filter(pk__in=[stored[pair] for pair in deleted]).delete()
+
+        # いいね数は実際に増減した行から数え、増減の量が同じツイートは1回の UPDATE にまとめる
+        deltas = Counter(tweet_id for _, tweet_id in created)
+        deltas.subtract(tweet_id for _, tweet_id in deleted)
+        tweets_by_delta = defaultdict(list)
+        for tweet_id, delta in deltas.items():
+            if delta:
+                tweets_by_delta[delta].append(tweet_id)
+        now = timezone.now()
+        for delta, pks in tweets_by_delta.items():
+            Tweet.objects.filter(pk__in=pks).update(
+                liked_count=Greatest(F("liked_count") + delta, Value(0)), updated_at=now
+            )
+    for user in users:
+        invalidate_liked_tweets(user)
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _start_flusher():
+    """memory バッファを LIKE_BUFFER_FLUSH_SECONDS ごとに書き込むスレッドを、プロセスごとに1つだけ立てる。"""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name="like-flusher", daemon=True)
+            _flusher.start()
+            # 終了時に残っている意図も書き込む
+            atexit.register(_flush_all)
+
+
+def _flush_all():
+    while flush_pending_likes():
+        pass
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.LIKE_BUFFER_FLUSH_SECONDS)
+        try:
+            _flush_all()
+        except Exception:
+            logger.exception("いいねの書き込みに失敗しました。次の回にやり直します。")
+        finally:
+            close_old_connections()
@@ -0,0 +1,205 @@
+"""
+いいね数の変化と新しいツイートの件数を Server-Sent Events でブラウザへ送る。
+
+イベントは LIVE_INTERVAL_SECONDS ごとの区間に分けてブローカーに集め、区間の中では同じツイートのいいね数は
+最新の値だけを残す。接続ごとに、閉じた区間の分をまとめて1区間に1回送るので、人気のツイートにいいねが集中しても
+送る量は接続数 × 区間数で頭打ちになる。
+
+ブローカーは LIVE_BROKER で選ぶ。
+- "memory": プロセス内。ASGI サーバーを1プロセスで動かすとき用。
+- "cache": キャッシュ上で共有する。各プロセスはイベントを手元にため、タイマーで区間ごとのまとまりに足し込む。
+
+配信は Django のビューを通さない ASGI アプリ (events_app) で行い、mysite/asgi.py が EVENTS_PATH をここへ回す。
+Django 4.1 の StreamingHttpResponse は非同期イテレータを流せず、同期のまま待つとイベントループを止めてしまうため。
+"""
+
+import asyncio
+import json
+import threading
+import time
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+
+EVENTS_PATH = "/tweets/live/"
+
+# 遅れた接続がさかのぼって読める区間の数
+RETENTION_BUCKETS = 60
+
+
+def current_bucket(now=None):
+    return int((now if now is not None else time.time()) // settings.LIVE_INTERVAL_SECONDS)
+
+
+def _empty():
+    return {"likes": {}, "new_tweets": 0}
+
+
+def _merge(batch, other):
+    # 後の区間のいいね数で上書きし、新しいツイートの件数は足す
+    batch["likes"].update(other["likes"])
+    batch["new_tweets"] += other["new_tweets"]
+    return batch
+
+
+class MemoryBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def publish(self, likes=None, new_tweets=0):
+        bucket = current_bucket()
+        with self.lock:
+            _merge(self.buckets.setdefault(bucket, _empty()), {"likes": likes or {}, "new_tweets": new_tweets})
+            for old in [b for b in self.buckets if b <= bucket - RETENTION_BUCKETS]:
+                del self.buckets[old]
+
+    def collect(self, start, stop):
+        """区間 start から stop の手前までのイベントを1つにまとめて返す。"""
+        with self.lock:
+            batches = [self.buckets[b] for b in range(start, stop) if b in self.buckets]
+            batch = _empty()
+            for other in batches:
+                _merge(batch, other)
+        return batch
+
+
+class CacheBroker:
+    def __init__(self, prefix="live"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.pending = _empty()
+        self.timer = None
+
+    def _key(self, bucket):
+        return f"{self.prefix}:{bucket}"
+
+    def publish(self, likes=None, new_tweets=0):
+        with self.lock:
+            _merge(self.pending, {"likes": likes or {}, "new_tweets": new_tweets})
+            # キャッシュへの書き込みはイベントごとではなく、半区間に1回にまとめる
+            if self.timer is None:
+                self.timer = threading.Timer(settings.LIVE_INTERVAL_SECONDS / 2, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending, self.timer = self.pending, _empty(), None
+        if pending == _empty():
+            return
+        lock_key = f"{self.prefix}:lock"
+        if not cache.add(lock_key, 1, timeout=5):
+            # ほかのプロセスが書き込み中なら、次の回に回す
+            self.publish(**pending)
+            return
+        try:
+            key = self._key(current_bucket())
+            batch = cache.get(key) or _empty()
+            timeout = settings.LIVE_INTERVAL_SECONDS * RETENTION_BUCKETS
+            cache.set(key, _merge(batch, pending), timeout)
+        finally:
+            cache.delete(lock_key)
+
+    def collect(self, start, stop):
+        batches = cache.get_many([self._key(b) for b in range(start, stop)])
+        batch = _empty()
+        for b in range(start, stop):
+            if self._key(b) in batches:
+                _merge(batch, batches[self._key(b)])
+        return batch
+
+
+memory = MemoryBroker()
+shared = CacheBroker()
+
+
+def get_broker():
+    return shared if settings.LIVE_BROKER == "cache" else memory
+
+
+def publish_like(tweet_id, liked_count):
+    get_broker().publish(likes={tweet_id: liked_count})
+
+
+def publish_tweet():
+    get_broker().publish(new_tweets=1)
+
+
+def _user_from_scope(scope):
+    """Cookie のセッションからユーザーを引く。SessionMiddleware と AuthenticationMiddleware を通らないため。"""
+    cookies = {}
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookies.update(parse_cookie(value.decode("latin1")))
+    request = HttpRequest()
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    return get_user(request)
+
+
+def format_event(batch):
+    likes = {str(tweet_id): count for tweet_id, count in batch["likes"].items()}
+    data = json.dumps({"likes": likes, "new_tweets": batch["new_tweets"]}, separators=(",", ":"))
+    return f"event: update\ndata: {data}\n\n".encode()
+
+
+async def events_app(scope, receive, send):
+    user = await sync_to_async(_user_from_scope)(scope)
+    if not user.is_authenticated:
+        await send({"type": "http.response.start", "status": 403, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Forbidden"})
+        return
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    # 接続を切られたら配信をやめる
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    broker = get_broker()
+    interval = settings.LIVE_INTERVAL_SECONDS
+    # 次に読む区間。接続した区間の、接続より前のイベントも送るが、いいね数は最新の値なので害はない
+    start = current_bucket()
+    idle = 0.0
+    try:
+        await send(
+            {"type": "http.response.body", "body": f"retry: {int(interval * 2000)}\n\n".encode(), "more_body": True}
+        )
+        while not disconnected.done():
+            await asyncio.wait([disconnected], timeout=interval)
+            bucket = current_bucket()
+            if bucket <= start:
+                continue
+            batch = await sync_to_async(broker.collect, thread_sensitive=False)(
+                max(start, bucket - RETENTION_BUCKETS), bucket
+            )
+            start = bucket
+            if batch["likes"] or batch["new_tweets"]:
+                await send({"type": "http.response.body", "body": format_event(batch), "more_body": True})
+                idle = 0.0
+            else:
+                idle += interval
+                if idle >= settings.LIVE_HEARTBEAT_SECONDS:
+                    # プロキシに切られないよう、コメント行を送る
+                    await send({"type": "http.response.body", "body": b": ping\n\n", "more_body": True})
+                    idle = 0.0
+    finally:
+        disconnected.cancel()
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
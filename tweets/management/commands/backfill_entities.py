@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets.entities import save_entities
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "既存のツイートからハッシュタグとメンションを取り出して索引表に書き込みます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        tweets = Tweet.objects.only("content", "created_at").order_by("pk")
+        last_pk, processed = 0, 0
+        while True:
+            batch = list(tweets.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            with transaction.atomic():
+                save_entities(batch)
+            processed += len(batch)
+            self.stdout.write(f"{processed} tweets")
+        self.stdout.write(self.style.SUCCESS(f"{processed}件のツイートを処理しました。"))
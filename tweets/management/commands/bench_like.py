@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from accounts.models import User
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "いいねエンドポイントを同時実行で叩き、同期ビュー(WSGI)と非同期ビュー(ASGI)のスループットを比較します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=16)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # ロック待ちなどで失敗したリクエストはエラー件数として集計するので、スタックトレースは出さない
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        users = [
+            User.objects.create_user(username=f"bench_like_{i}", email=f"bench_like_{i}@example.com")
+            for i in range(options["concurrency"])
+        ]
+        tweet = Tweet.objects.create(user=users[0], content="bench_like")
+        try:
+            # 書き込みの速さを測るので、同じ IP アドレスから大量に送ってもレート制限に掛からないようにする
+            with override_settings(RATE_LIMITS={}):
+                self.report("WSGI", self.run_wsgi(users, tweet, options["requests"]))
+                self.report("ASGI", asyncio.run(self.run_asgi(users, tweet, options["requests"])))
+        finally:
+            tweet.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def urls(self, tweet, prefix):
+        return [reverse(f"tweets:{prefix}like", args=[tweet.pk]), reverse(f"tweets:{prefix}unlike", args=[tweet.pk])]
+
+    def run_wsgi(self, users, tweet, total):
+        urls = self.urls(tweet, "")
+
+        def worker(user, n):
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            timings = []
+            for i in range(n):
+                start = time.perf_counter()
+                status = client.post(urls[i % 2]).status_code
+                timings.append((time.perf_counter() - start, status))
+            close_old_connections()
+            return timings
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            results = executor.map(worker, users, self.split(total, len(users)))
+            timings = [timing for result in results for timing in result]
+        return time.perf_counter() - start, timings
+
+    async def run_asgi(self, users, tweet, total):
+        urls = self.urls(tweet, "async_")
+
+        async def worker(user, n):
+            client = AsyncClient(raise_request_exception=False)
+            await sync_to_async(client.force_login)(user)
+            timings = []
+            for i in range(n):
+                start = time.perf_counter()
+                status = (await client.post(urls[i % 2])).status_code
+                timings.append((time.perf_counter() - start, status))
+            return timings
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[worker(user, n) for user, n in zip(users, self.split(total, len(users)))])
+        return time.perf_counter() - start, [timing for result in results for timing in result]
+
+    def split(self, total, parts):
+        return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+    def report(self, name, result):
+        elapsed, timings = result
+        latencies = sorted(latency * 1000 for latency, _ in timings)
+        errors = sum(1 for _, status in timings if status != 200)
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+        self.stdout.write(
+            f"{name}: {len(timings) / elapsed:.1f} req/s, "
+            f"p50 {statistics.median(latencies):.2f}ms, p99 {p99:.2f}ms, errors {errors}"
+        )
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets.likes import flush_pending_likes
+
+
+class Command(BaseCommand):
+    help = "書き込みを後回しにしたいいね (LIKE_WRITE_BEHIND) をまとめてデータベースに書き込みます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--interval", type=float, default=0, help="指定した秒数ごとに書き込み続けます。")
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while flushed := flush_pending_likes(options["batch_size"]):
+                total += flushed
+            if total or not options["interval"]:
+                self.stdout.write(f"{total}件のいいねを書き込みました。")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
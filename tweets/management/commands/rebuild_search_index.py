@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+
+from tweets.models import Tweet
+from tweets.search import get_index
+
+
+class Command(BaseCommand):
+    help = "全ツイートから全文検索のインデックスを作り直します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        using = router.db_for_write(Tweet)
+        index = get_index(using)
+        tweets = Tweet.objects.using(using).only("content").order_by("pk")
+        total = tweets.count()
+        with transaction.atomic(using=using):
+            index.clear()
+            for i, tweet in enumerate(tweets.iterator(chunk_size=options["batch_size"]), start=1):
+                index.add(tweet)
+                if i % options["batch_size"] == 0 or i == total:
+                    self.stdout.write(f"{i}/{total} tweets")
+        self.stdout.write(self.style.SUCCESS("検索インデックスを再構築しました。"))
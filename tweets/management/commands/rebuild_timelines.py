@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import FriendShip, User
+from tweets import timeline
+
+
+class Command(BaseCommand):
+    help = "既存のフォロー関係からホームタイムラインを再構築します。"
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk")
+        total = users.count()
+        for i, user in enumerate(users.iterator(), start=1):
+            timeline.backfill(user, user)
+            for followee in User.objects.filter(
+                pk__in=FriendShip.objects.filter(following=user).values("follower")
+            ).iterator():
+                timeline.backfill(user, followee)
+            if i % 100 == 0 or i == total:
+                self.stdout.write(f"{i}/{total} users")
+        self.stdout.write(self.style.SUCCESS("タイムラインを再構築しました。"))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from tweets.models import Like, Tweet
+
+
+class Command(BaseCommand):
+    help = "Like数から Tweet.liked_count を再計算し、ずれているツイートを一括で修正します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="修正せずにずれている件数だけを表示します。")
+
+    def handle(self, *args, **options):
+        counts = (
+            Like.objects.filter(tweet=OuterRef("pk")).order_by().values("tweet").annotate(c=Count("pk")).values("c")
+        )
+        drifted = Tweet.objects.annotate(actual=Coalesce(Subquery(counts), 0)).exclude(liked_count=F("actual"))
+
+        last_pk, repaired = 0, 0
+        while True:
+            pks = list(
+                Tweet.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            now = timezone.now()
+            batch = [
+                Tweet(pk=pk, liked_count=actual, updated_at=now)
+                for pk, actual in drifted.filter(pk__in=pks).values_list("pk", "actual")
+            ]
+            if batch and not options["dry_run"]:
+                with transaction.atomic():
+                    Tweet.objects.bulk_update(batch, ["liked_count", "updated_at"])
+            repaired += len(batch)
+
+        verb = "件のずれを検出しました" if options["dry_run"] else "件のツイートを修正しました"
+        self.stdout.write(self.style.SUCCESS(f"{repaired}{verb}。"))
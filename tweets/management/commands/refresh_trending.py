@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweets import trending
+
+
+class Command(BaseCommand):
+    help = "直近のバケットからトレンドの上位を計算し直してキャッシュに置きます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, default=0, help="指定した秒数ごとに計算し直し続けます。")
+
+    def handle(self, *args, **options):
+        while True:
+            result = trending.refresh()
+            summary = ", ".join(f"{kind} {len(top)}件" for kind, top in result.items())
+            self.stdout.write(f"トレンドを更新しました ({summary})")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
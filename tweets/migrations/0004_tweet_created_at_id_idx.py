@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0003_remove_like_like_unique_alter_like_tweet_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["-created_at", "-id"], name="tweet_created_at_id_idx"),
+        ),
+    ]
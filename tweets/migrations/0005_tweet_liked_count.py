@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_liked_count(apps, schema_editor):
+    Like = apps.get_model("tweets", "Like")
+    Tweet = apps.get_model("tweets", "Tweet")
+    counts = Like.objects.filter(tweet=OuterRef("pk")).order_by().values("tweet").annotate(c=Count("pk")).values("c")
+    Tweet.objects.update(liked_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0004_tweet_created_at_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tweet",
+            name="liked_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_liked_count, migrations.RunPython.noop),
+    ]
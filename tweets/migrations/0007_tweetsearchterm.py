@@ -0,0 +1,44 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    # 検索語はアプリ側で n-gram に分割してから入れる。1文字の前方一致検索のために prefix 索引も作る
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("CREATE VIRTUAL TABLE tweets_tweet_fts USING fts5(terms, prefix='1')")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS tweets_tweet_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0006_timelineentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TweetSearchTerm",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("term", models.CharField(max_length=2)),
+                ("count", models.PositiveSmallIntegerField()),
+                (
+                    "tweet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="search_terms", to="tweets.tweet"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="tweetsearchterm",
+            constraint=models.UniqueConstraint(fields=("term", "tweet"), name="unique_search_term"),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
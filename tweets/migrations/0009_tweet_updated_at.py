@@ -0,0 +1,22 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0008_hashtag_mention"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tweet",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["user", "-updated_at"], name="tweet_user_updated_idx"),
+        ),
+    ]
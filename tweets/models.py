@@ -6,10 +6,16 @@ class Tweet(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField(max_length=150)
     created_at = models.DateTimeField(auto_now_add=True)
+    liked_count = models.PositiveIntegerField(default=0)
+    # いいね数が変わるたびに進める。queryset.update() では自動で進まないので、いいね数と一緒に書き込む
+    updated_at = models.DateTimeField(auto_now=True)
 
-    @property
-    def liked_count(self):
-        return self.likes.count()
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="tweet_created_at_id_idx"),
+            models.Index(fields=["user", "-updated_at"], name="tweet_user_updated_idx"),
+            models.Index(fields=["user", "-created_at", "-id"], name="tweet_user_created_idx"),
+        ]
 
     def __str__(self):
         return self.content
@@ -21,3 +27,52 @@ class Like(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["tweet", "user"], name="unique_like")]
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry")]
+        indexes = [models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx")]
+
+
+class TweetSearchTerm(models.Model):
+    """全文検索の転置インデックス。FTS5 を使えないデータベースでだけ使う (tweets.search を参照)。"""
+
+    term = models.CharField(max_length=2)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="search_terms")
+    count = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["term", "tweet"], name="unique_search_term")]
+
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class TweetHashtag(models.Model):
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="tweet_hashtags")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="tweet_hashtags")
+    # ハッシュタグのタイムラインを Tweet と結合せずにこの表だけで並べるため、投稿時刻を複製して持つ
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["hashtag", "tweet"], name="unique_tweet_hashtag")]
+        indexes = [models.Index(fields=["hashtag", "-created_at", "-tweet"], name="tweet_hashtag_created_idx")]
+
+
+class Mention(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="mentions")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="mentions")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "tweet"], name="unique_mention")]
+        indexes = [models.Index(fields=["user", "-created_at", "-tweet"], name="mention_user_created_idx")]
@@ -0,0 +1,112 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, value, pk):
+    raw = f"{direction}|{value.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, value, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if direction not in ("next", "prev") or value is None:
+        raise InvalidCursor(cursor)
+    return direction, value, pk
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    (field, pk) の降順でキーセットページネーションを行う。
+    OFFSETを使わないため、深いページでも先頭ページと同じコストで取得できる。
+    """
+
+    def __init__(self, queryset, per_page, field="created_at", pk_field="pk"):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+        self.pk_field = pk_field
+
+    def _after(self, value, pk):
+        return Q(**{f"{self.field}__lt": value}) | Q(**{self.field: value, f"{self.pk_field}__lt": pk})
+
+    def _before(self, value, pk):
+        return Q(**{f"{self.field}__gt": value}) | Q(**{self.field: value, f"{self.pk_field}__gt": pk})
+
+    def _key(self, obj):
+        return getattr(obj, self.field), getattr(obj, self.pk_field)
+
+    def _query(self, cursor):
+        """(1件多めに取るクエリセット, カーソルの向き) を返す。"""
+        if not cursor:
+            return self.queryset.order_by(f"-{self.field}", f"-{self.pk_field}")[: self.per_page + 1], None
+        direction, value, pk = decode_cursor(cursor)
+        if direction == "next":
+            queryset = self.queryset.order_by(f"-{self.field}", f"-{self.pk_field}").filter(self._after(value, pk))
+        else:
+            queryset = self.queryset.order_by(self.field, self.pk_field).filter(self._before(value, pk))
+        return queryset[: self.per_page + 1], direction
+
+    def keys(self, cursor=None):
+        """
+        (1件多めに読んだ行の (field, pk) のリスト, カーソルの向き) を返す。
+        ほかの表の行と合流させてからページを作るときに、行そのものを読む前に使う。
+        """
+        queryset, direction = self._query(cursor)
+        return list(queryset.values_list(self.field, self.pk_field)), direction
+
+    def build(self, rows, direction):
+        """keys と同じ順に1件多めに並べた rows をページにする。"""
+        overflow = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if direction == "prev":
+            rows = rows[::-1]
+            has_more, has_before = True, overflow
+        else:
+            has_more, has_before = overflow, direction == "next"
+
+        next_cursor = encode_cursor("next", *self._key(rows[-1])) if rows and has_more else None
+        previous_cursor = encode_cursor("prev", *self._key(rows[0])) if rows and has_before else None
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+    def page(self, cursor=None):
+        queryset, direction = self._query(cursor)
+        return self.build(list(queryset), direction)
+
+    async def apage(self, cursor=None):
+        queryset, direction = self._query(cursor)
+        return self.build([obj async for obj in queryset], direction)
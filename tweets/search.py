@@ -0,0 +1,206 @@
+"""
+ツイート本文の全文検索。
+
+日本語は単語を空白で区切らないので、本文を語 (\\w の連続) ごとに文字 bigram へ分割して索引する。
+1文字の検索語は、その文字で始まる bigram と語末の1文字への前方一致で探す。
+SQLite では FTS5 の仮想テーブル tweets_tweet_fts を、それ以外のデータベースでは TweetSearchTerm の転置インデックスを使う。
+結果は関連度の高い順に並べ、(スコア, id) のカーソルで次のページをたどる。
+"""
+
+import base64
+import binascii
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+
+from .models import Tweet, TweetSearchTerm
+from .pagination import CursorPage, InvalidCursor
+
+FTS_TABLE = "tweets_tweet_fts"
+
+_words = re.compile(r"\w+")
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def ngrams(word, n=2):
+    if len(word) <= n:
+        return [word]
+    return [word[i : i + n] for i in range(len(word) - n + 1)]
+
+
+def tokenize(text):
+    """索引する語の一覧。語の最後の1文字も入れておき、1文字の検索を前方一致で拾えるようにする。"""
+    tokens = []
+    for word in _words.findall(normalize(text)):
+        tokens += ngrams(word)
+        if len(word) > 1:
+            tokens.append(word[-1])
+    return tokens
+
+
+def encode_cursor(score, pk, floor):
+    raw = f"{score!r}|{pk}|{floor}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, pk, floor = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return float(score), int(pk), int(floor)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+class Fts5Index:
+    def __init__(self, using):
+        self.connection = connections[using]
+
+    def add(self, tweet):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, terms) VALUES (%s, %s)",
+                [tweet.pk, " ".join(tokenize(tweet.content))],
+            )
+
+    def remove(self, *tweet_ids):
+        placeholders = ", ".join(["%s"] * len(tweet_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", list(tweet_ids))
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def match_expression(self, words):
+        # 語の bigram を並べたフレーズは、索引側で隣り合った bigram にだけ一致する。1文字の語は前方一致にする。
+        return " AND ".join(f'"{word}"*' if len(word) == 1 else '"%s"' % " ".join(ngrams(word)) for word in words)
+
+    def floor(self, words, window):
+        """新しい順に window 件目の一致のID。一致が window 件に満たなければ 0。"""
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC LIMIT 1 OFFSET %s",
+                [self.match_expression(words), window - 1],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def search(self, words, floor, after, limit):
+        """ID が floor 以上の一致から [(スコア, ツイートID)] をスコアの高い順に最大 limit 件返す。"""
+        sql = (
+            f"SELECT -bm25({FTS_TABLE}) AS score, rowid FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid >= %s"
+        )
+        params = [self.match_expression(words), floor]
+        if after:
+            sql += " AND (score < %s OR (score = %s AND rowid < %s))"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY score DESC, rowid DESC LIMIT %s"
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return cursor.fetchall()
+
+
+class InvertedIndex:
+    """
+    語ごとに (bigram, ツイート, 出現回数) を持つ転置インデックス。
+    bigram がすべて含まれていても隣り合っているとは限らないので、候補は本文と突き合わせて確かめる。
+    """
+
+    def __init__(self, using):
+        self.using = using
+
+    def add(self, tweet):
+        terms = [
+            TweetSearchTerm(term=term, tweet=tweet, count=count)
+            for term, count in Counter(tokenize(tweet.content)).items()
+        ]
+        TweetSearchTerm.objects.using(self.using).bulk_create(terms, ignore_conflicts=True)
+
+    def remove(self, *tweet_ids):
+        TweetSearchTerm.objects.using(self.using).filter(tweet_id__in=tweet_ids).delete()
+
+    def clear(self):
+        TweetSearchTerm.objects.using(self.using).all().delete()
+
+    def candidates(self, words):
+        terms = {gram for word in words if len(word) > 1 for gram in ngrams(word)}
+        prefixes = {word for word in words if len(word) == 1}
+        condition = Q(term__in=terms) if terms else Q()
+        for prefix in prefixes:
+            condition |= Q(term__startswith=prefix)
+        queryset = (
+            TweetSearchTerm.objects.using(self.using).filter(condition).values("tweet").annotate(score=Sum("count"))
+        )
+        if terms:
+            queryset = queryset.annotate(matched=Count("term", filter=Q(term__in=terms))).filter(matched=len(terms))
+        for prefix in prefixes:
+            terms_with_prefix = TweetSearchTerm.objects.filter(tweet=OuterRef("tweet"), term__startswith=prefix)
+            queryset = queryset.filter(Exists(terms_with_prefix))
+        return queryset.order_by("-score", "-tweet")
+
+    def floor(self, words, window):
+        ids = self.candidates(words).order_by("-tweet").values_list("tweet", flat=True)
+        return next(iter(ids[window - 1 : window]), 0)
+
+    def search(self, words, floor, after, limit):
+        queryset = self.candidates(words).filter(tweet__gte=floor)
+        hits = []
+        while len(hits) < limit:
+            page = queryset
+            if after:
+                page = page.filter(Q(score__lt=after[0]) | Q(score=after[0], tweet__lt=after[1]))
+            rows = [(row["score"], row["tweet"]) for row in page[:limit]]
+            contents = dict(
+                Tweet.objects.using(self.using).filter(pk__in=[pk for _, pk in rows]).values_list("pk", "content")
+            )
+            hits += [(score, pk) for score, pk in rows if pk in contents and self.contains(contents[pk], words)]
+            if len(rows) < limit:
+                break
+            after = rows[-1]
+        return hits[:limit]
+
+    def contains(self, content, words):
+        content = normalize(content)
+        return all(word in content for word in words)
+
+
+def get_index(using):
+    return Fts5Index(using) if connections[using].vendor == "sqlite" else InvertedIndex(using)
+
+
+def index_tweet(tweet):
+    get_index(router.db_for_write(Tweet)).add(tweet)
+
+
+def unindex_tweet(*tweet_ids):
+    if tweet_ids:
+        get_index(router.db_for_write(Tweet)).remove(*tweet_ids)
+
+
+def search_tweets(query, cursor=None, per_page=20):
+    """
+    query の語をすべて含むツイートを関連度順に返す。
+    一致が多い語でも一定の時間で返せるよう、順位付けは新しい方から TWEET_SEARCH_RANK_WINDOW 件の一致に限る。
+    その範囲はカーソルに持たせ、ページをたどる間に新しいツイートが増えても変わらないようにする。
+    """
+    after = decode_cursor(cursor) if cursor else None
+    words = _words.findall(normalize(query))
+    if not words:
+        return CursorPage([], None, None)
+    index = get_index(router.db_for_read(Tweet))
+    floor = after[2] if after else index.floor(words, settings.TWEET_SEARCH_RANK_WINDOW)
+    hits = index.search(words, floor, after, per_page + 1)
+    tweets = Tweet.objects.select_related("user").in_bulk([pk for _, pk in hits[:per_page]])
+    # 索引より先に消えたツイートは飛ばす
+    object_list = [tweets[pk] for _, pk in hits[:per_page] if pk in tweets]
+    next_cursor = encode_cursor(*hits[per_page - 1], floor) if len(hits) > per_page else None
+    return CursorPage(object_list, next_cursor, None)
@@ -0,0 +1,22 @@
+from django.db import transaction
+
+from jobs.queue import register
+from tweets.entities import save_entities
+from tweets.models import Tweet
+from tweets.search import index_tweet, unindex_tweet
+from tweets.timeline import fan_out_to_followers
+
+
+@register("tweets.process_tweet")
+def process_tweet(tweet_id):
+    """新しいツイートをフォロワーのタイムラインに書き込み、検索の索引とハッシュタグ・メンションに加える。"""
+    tweet = Tweet.objects.select_related("user").filter(pk=tweet_id).first()
+    if tweet is None:
+        # 実行する前に消された
+        return
+    fan_out_to_followers(tweet)
+    with transaction.atomic():
+        # 再試行で二重に索引しないよう、いったん取り除いてから入れる
+        unindex_tweet(tweet.pk)
+        index_tweet(tweet)
+    save_entities([tweet])
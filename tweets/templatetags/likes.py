@@ -0,0 +1,9 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def is_liked(tweet, liked_tweets):
+    """{% if tweet|is_liked:liked_tweets %} の形で、ビューが用意したいいね済み集合を引く。"""
+    return tweet.id in liked_tweets
@@ -1,8 +1,28 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
-from .models import Like, Tweet
+from accounts.models import FriendShip
+
+from . import like_buffer, live, trending
+from .entities import extract_hashtags, extract_mentions
+from .likes import flush_pending_likes, liked_tweet_ids
+from .models import Hashtag, Like, Mention, TimelineEntry, Tweet, TweetHashtag, TweetSearchTerm
+from .search import InvertedIndex, index_tweet, search_tweets
+from .timeline import fan_out_tweet
+from .trending import CountMinSketch
 
 User = get_user_model()
 
@@ -25,6 +45,112 @@ class TestHomeView(TestCase):
 
         self.assertQuerysetEqual(response.context["tweets"], Tweet.objects.all(), ordered=False)
 
+    def test_success_get_after_author_renamed(self):
+        self.client.get(self.url)
+        self.user.username = "renamed01"
+        self.user.save()
+        # キャッシュしたツイートの断片にも新しい名前が出る
+        response = self.client.get(self.url)
+        self.assertContains(response, "[投稿者] renamed01", count=2)
+        self.assertNotContains(response, "testuser01")
+
+    def test_success_get_with_cursor(self):
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"テスト投稿{i:02}") for i in range(3, 26)])
+        response = self.client.get(self.url)
+        first_page = response.context["tweets"]
+        self.assertEqual(len(first_page), 20)
+        self.assertFalse(response.context["page_obj"].has_previous())
+
+        response = self.client.get(self.url, {"cursor": response.context["page_obj"].next_cursor})
+        second_page = response.context["tweets"]
+        self.assertEqual(len(second_page), 5)
+        self.assertFalse(response.context["page_obj"].has_next())
+        self.assertFalse(set(first_page) & set(second_page))
+
+        response = self.client.get(self.url, {"cursor": response.context["page_obj"].previous_cursor})
+        self.assertEqual(response.context["tweets"], first_page)
+
+    def test_success_get_json(self):
+        response = self.client.get(self.url, {"format": "json"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([tweet["content"] for tweet in data["tweets"]], ["テスト投稿02", "テスト投稿01"])
+        self.assertIsNone(data["next_cursor"])
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestFollowingTimelineView(TestCase):
+    def setUp(self):
+        self.url = reverse("tweets:following_timeline")
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.user02 = User.objects.create_user(
+            username="testuser02",
+            email="testuser02@example.com",
+            password="password130974",
+        )
+        self.user03 = User.objects.create_user(
+            username="testuser03",
+            email="testuser03@example.com",
+            password="password582013",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        self.tweet02 = Tweet.objects.create(user=self.user02, content="テスト投稿02")
+        self.tweet03 = Tweet.objects.create(user=self.user03, content="テスト投稿03")
+
+    def test_success_get_after_follow(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["tweets"]), [self.tweet02])
+
+    def test_success_fan_out_on_create(self):
+        self.user02.followers.add(self.user01)
+        self.client.post(reverse("tweets:create"), {"content": "テスト投稿01"})
+        tweet01 = Tweet.objects.get(content="テスト投稿01")
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user01, tweet=tweet01).exists())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user02, tweet=tweet01).exists())
+
+    def test_success_trim_after_unfollow(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "testuser02"}))
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context["tweets"]), [])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user01).exists())
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=0)
+    def test_success_get_with_celebrity(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser03"}))
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user01).exists())
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context["tweets"]), [self.tweet03])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=5)
+    def test_success_merge_pages_with_celebrity(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser02"}))
+        self.client.post(reverse("accounts:follow", kwargs={"username": "testuser03"}))
+        # フォロー時に取り込んだ tweet03 のエントリは、testuser03 が閾値を超えた後も重ねて表示しない
+        User.objects.filter(pk=self.user03.pk).update(follower_count=10)
+        for i in range(15):
+            fan_out_tweet(Tweet.objects.create(user=self.user02, content=f"fan-out {i}"))
+            fan_out_tweet(Tweet.objects.create(user=User.objects.get(pk=self.user03.pk), content=f"celebrity {i}"))
+        expected = list(Tweet.objects.order_by("-created_at", "-id"))
+
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context["tweets"]), expected[:20])
+        next_cursor = response.context["page_obj"].next_cursor
+        response = self.client.get(self.url, {"cursor": next_cursor})
+        self.assertEqual(list(response.context["tweets"]), expected[20:])
+        self.assertFalse(response.context["page_obj"].has_next())
+        response = self.client.get(self.url, {"cursor": response.context["page_obj"].previous_cursor})
+        self.assertEqual(list(response.context["tweets"]), expected[:20])
+
 
 class TestTweetCreateView(TestCase):
     def setUp(self):
@@ -46,6 +172,21 @@ class TestTweetCreateView(TestCase):
         response = self.client.post(self.url, data)
         self.assertRedirects(response, reverse("tweets:home"), status_code=302, target_status_code=200)
 
+    @override_settings(DEFER_JOBS=True)
+    def test_success_post_defers_fan_out(self):
+        follower = User.objects.create_user(username="follower", email="follower@example.com", password="password")
+        FriendShip.objects.create(following=follower, follower=self.user)
+        self.client.post(self.url, {"content": "ジョブのテスト #後回し"})
+        tweet = Tweet.objects.get()
+        # 投稿者のタイムラインにはすぐに載る
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=follower, tweet=tweet).exists())
+
+        call_command("runworker", "--once", stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(owner=follower, tweet=tweet).exists())
+        self.assertEqual([tweet.pk for tweet in search_tweets("ジョブ")], [tweet.pk])
+        self.assertTrue(TweetHashtag.objects.filter(tweet=tweet, hashtag__name="後回し").exists())
+
     def test_failure_post_with_empty_content(self):
         data = {"content": ""}
         response = self.client.post(self.url, data)
@@ -79,6 +220,24 @@ class TestTweetDetailView(TestCase):
         context = response.context
         self.assertEqual(context["tweet"], self.test_tweet)
 
+    def test_not_modified(self):
+        url = reverse("tweets:detail", kwargs={"pk": self.test_tweet.pk})
+        # 初回の描画で CSRF の Cookie が発行され、ETag はその後で安定する
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertIn("private", response.headers["Cache-Control"])
+        self.assertIn("Cookie", response.headers["Vary"])
+        etag = response.headers["ETag"]
+        with self.assertNumQueries(3):
+            # セッション、ユーザー、ツイートだけを読み、描画はしない
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.test_tweet.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
 
 class TestTweetDeleteView(TestCase):
     def setUp(self):
@@ -101,6 +260,31 @@ class TestTweetDeleteView(TestCase):
         self.assertRedirects(response, reverse("tweets:home"), status_code=302)
         self.assertFalse(Tweet.objects.filter(content="testtweet1").exists())
 
+    def test_success_post_invalidates_fragment(self):
+        self.client.get(reverse("tweets:home"))
+        key = make_template_fragment_key(
+            "home_tweet", [self.tweet01.id, self.tweet01.created_at, self.tweet01.user.updated_at]
+        )
+        self.assertIsNotNone(cache.get(key))
+        self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet01.pk}))
+        self.assertIsNone(cache.get(key))
+
+    def test_success_post_deletes_dependents(self):
+        for i in range(5):
+            user = User.objects.create_user(username=f"liker{i}", email=f"liker{i}@example.com", password="password")
+            Like.objects.create(user=user, tweet=self.tweet01)
+        Like.objects.create(user=self.user01, tweet=self.tweet02)
+        TimelineEntry.objects.create(owner=self.user02, tweet=self.tweet01, created_at=self.tweet01.created_at)
+        index_tweet(self.tweet01)
+        index_tweet(self.tweet02)
+        with self.settings(DELETION_CHUNK_SIZE=2):
+            self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet01.pk}))
+        self.assertFalse(Tweet.objects.filter(pk=self.tweet01.pk).exists())
+        self.assertFalse(Like.objects.filter(tweet_id=self.tweet01.pk).exists())
+        self.assertFalse(TimelineEntry.objects.filter(tweet_id=self.tweet01.pk).exists())
+        self.assertEqual(Like.objects.filter(tweet=self.tweet02).count(), 1)
+        self.assertEqual([tweet.pk for tweet in search_tweets("テスト投稿")], [self.tweet02.pk])
+
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:delete", kwargs={"pk": 1000}))
         self.assertEquals(response.status_code, 404)
@@ -112,6 +296,187 @@ class TestTweetDeleteView(TestCase):
         self.assertEquals(Tweet.objects.count(), 2)
 
 
+class TestSearchView(TestCase):
+    def setUp(self):
+        self.url = reverse("tweets:search")
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        for content in ["東京タワーに行った", "京都タワーも良い", "ＴＯＫＹＯ tower"]:
+            self.client.post(reverse("tweets:create"), {"content": content})
+
+    def search(self, query):
+        response = self.client.get(self.url, {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [tweet.content for tweet in response.context["tweets"]]
+
+    def test_success_get(self):
+        response = self.client.get(self.url, {"q": "タワー"})
+        self.assertTemplateUsed(response, "tweets/search.html")
+        self.assertEqual(
+            {tweet.content for tweet in response.context["tweets"]}, {"東京タワーに行った", "京都タワーも良い"}
+        )
+        self.assertEqual(self.search("東京"), ["東京タワーに行った"])
+        self.assertEqual(self.search("東京都"), [])
+        self.assertEqual(self.search("都 良い"), ["京都タワーも良い"])
+        self.assertEqual(self.search("た"), ["東京タワーに行った"])
+        # 全角・大文字も正規化して一致させる
+        self.assertEqual(self.search("tokyo"), ["ＴＯＫＹＯ tower"])
+        self.assertEqual(self.search(""), [])
+
+    def test_success_get_with_cursor(self):
+        self.client.post(reverse("tweets:create"), {"content": "タワー タワー タワー"})
+        page = search_tweets("タワー", per_page=2)
+        # 出現回数の多いツイートほど上に来る
+        self.assertEqual(page.object_list[0].content, "タワー タワー タワー")
+        self.assertEqual(len(page), 2)
+        page = search_tweets("タワー", page.next_cursor, per_page=2)
+        self.assertEqual(len(page), 1)
+        self.assertFalse(page.has_next())
+
+    @override_settings(TWEET_SEARCH_RANK_WINDOW=1)
+    def test_success_get_ranks_newest_matches_only(self):
+        self.assertEqual(self.search("タワー"), ["京都タワーも良い"])
+
+    def test_success_post_delete_removes_from_index(self):
+        tweet = Tweet.objects.get(content="東京タワーに行った")
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertEqual(self.search("東京"), [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM tweets_tweet_fts WHERE rowid = %s", [tweet.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"q": "タワー", "cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestEntities(TestCase):
+    def test_extract_hashtags(self):
+        self.assertEqual(extract_hashtags("#Django と ＃ＰＹＴＨＯＮ、#日本語"), {"django", "python", "日本語"})
+        self.assertEqual(extract_hashtags("C# や 今日は#晴れ、#123 &#39;"), set())
+
+    def test_extract_mentions(self):
+        mentions = extract_mentions("@testuser01 さん、mail@example.com ＠testuser02.")
+        self.assertEqual(mentions, {"testuser01", "testuser02"})
+
+
+class TestHashtagTimelineView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.user02 = User.objects.create_user(
+            username="testuser02",
+            email="testuser02@example.com",
+            password="password130974",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        for content in ["#Django 入門 @testuser02", "#django と #python", "タグなし @nobody"]:
+            self.client.post(reverse("tweets:create"), {"content": content})
+
+    def test_success_get(self):
+        self.assertEqual(Hashtag.objects.count(), 2)
+        response = self.client.get(reverse("tweets:hashtag", kwargs={"name": "DJANGO"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tweets/entity_timeline.html")
+        self.assertEqual(response.context["title"], "#django")
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweets"]], ["#django と #python", "#Django 入門 @testuser02"]
+        )
+
+    def test_success_get_with_cursor(self):
+        tweets = [Tweet.objects.create(user=self.user01, content=f"#python {i}") for i in range(20)]
+        call_command("backfill_entities", batch_size=7, stdout=StringIO())
+        url = reverse("tweets:hashtag", kwargs={"name": "python"})
+        response = self.client.get(url, {"format": "json"})
+        self.assertEqual(response.json()["tweets"][0]["id"], tweets[-1].id)
+        response = self.client.get(url, {"cursor": response.json()["next_cursor"]})
+        self.assertEqual([tweet.content for tweet in response.context["tweets"]], ["#django と #python"])
+
+    def test_success_get_mentions(self):
+        self.assertEqual(Mention.objects.count(), 1)
+        response = self.client.get(reverse("tweets:mentions", kwargs={"username": "testuser02"}))
+        self.assertEqual([tweet.content for tweet in response.context["tweets"]], ["#Django 入門 @testuser02"])
+
+    def test_failure_get_with_not_exist_hashtag(self):
+        response = self.client.get(reverse("tweets:hashtag", kwargs={"name": "flask"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_post_delete_removes_entities(self):
+        tweet = Tweet.objects.get(content="#Django 入門 @testuser02")
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertFalse(Mention.objects.exists())
+        self.assertEqual(TweetHashtag.objects.count(), 2)
+
+
+class TestTrending(TestCase):
+    def setUp(self):
+        cache.clear()
+        trending.local.pending.clear()
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+
+    def test_count_min_sketch(self):
+        sketch, other = CountMinSketch(width=8), CountMinSketch(width=8)
+        for i in range(20):
+            sketch.add(i)
+        other.add(3, 5)
+        sketch.merge(other)
+        self.assertGreaterEqual(sketch.estimate(3), 6)
+        self.assertEqual(CountMinSketch().estimate("unknown"), 0)
+
+    def test_refresh(self):
+        for content in ["#django", "#django #python", "#python", "#django"]:
+            self.client.post(reverse("tweets:create"), {"content": content})
+        tweet = Tweet.objects.first()
+        self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk}))
+
+        # "memory" では refresh_trending を動かさなくても、画面を出すプロセスが計算する
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual([name for name, _ in response.context["trending_hashtags"]], ["django", "python"])
+        self.assertEqual(trending.top("tweets"), [(tweet.pk, 1)])
+
+    def test_top_refreshes_stale_result(self):
+        trending.record("hashtags", ["django"])
+        self.assertEqual(trending.top("hashtags"), [("django", 1)])
+        trending.record("hashtags", ["python"] * 2)
+        self.assertEqual(trending.top("hashtags"), [("django", 1)])
+
+        later = time.time() + settings.TRENDING_FLUSH_SECONDS
+        with mock.patch("tweets.trending.time.time", return_value=later):
+            self.assertEqual(trending.top("hashtags"), [("python", 2), ("django", 1)])
+
+    @override_settings(TRENDING_BACKEND="cache", TRENDING_FLUSH_SECONDS=0)
+    def test_cache_backend_flushes_quiet_process(self):
+        trending.record("hashtags", ["django"])
+        trending.local.timer.join()
+        # 次の出来事が来なくても、タイマーがキャッシュに足し込んでいる
+        self.assertEqual(trending.local.pending, {})
+        call_command("refresh_trending", stdout=StringIO())
+        with mock.patch("tweets.trending.refresh") as refresh:
+            self.assertEqual(trending.top("hashtags"), [("django", 1)])
+        refresh.assert_not_called()
+
+    def test_refresh_with_decay(self):
+        now = time.time()
+        bucket_seconds = settings.TRENDING_BUCKET_SECONDS
+        trending.record("hashtags", ["old"] * 3, now=now - 2 * bucket_seconds)
+        trending.record("hashtags", ["new"] * 2, now=now)
+        trending.record("hashtags", ["expired"] * 5, now=now - settings.TRENDING_WINDOW_BUCKETS * bucket_seconds)
+        # 2バケット前の3回は 3 * 0.8 ** 2 = 1.92 回分になり、今の2回より下がる
+        self.assertEqual(trending.refresh(now=now)["hashtags"], [("new", 2), ("old", 1.92)])
+
+
 class TestLikeView(TestCase):
     def setUp(self):
         self.user01 = User.objects.create_user(
@@ -126,6 +491,16 @@ class TestLikeView(TestCase):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet01.pk}))
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.filter(user=self.user01, tweet=self.tweet01).exists())
+        self.assertEqual(response.json()["liked_count"], 1)
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 1)
+
+    def test_success_post_updates_liked_tweets(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertNotIn(self.tweet01.id, response.context["liked_tweets"])
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet01.pk}))
+        response = self.client.get(reverse("tweets:home"))
+        self.assertIn(self.tweet01.id, response.context["liked_tweets"])
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": 3}))
@@ -133,10 +508,11 @@ class TestLikeView(TestCase):
         self.assertEqual(Like.objects.count(), 0)
 
     def test_failure_post_with_liked_tweet(self):
-        Like.objects.create(tweet=self.tweet01, user=self.user01)
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet01.pk}))
         response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet01.pk}))
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.filter(user=self.user01, tweet=self.tweet01).count(), 1)
+        self.assertEqual(response.json()["liked_count"], 1)
 
 
 class TestUnlikeView(TestCase):
@@ -147,13 +523,14 @@ class TestUnlikeView(TestCase):
             password="password15432",
         )
         self.client.login(username="testuser01", password="password15432")
-        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01", liked_count=1)
         Like.objects.create(user=self.user01, tweet=self.tweet01)
 
     def test_success_post(self):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet01.pk}))
         self.assertEqual(response.status_code, 200)
         self.assertFalse(Like.objects.filter(user=self.user01, tweet=self.tweet01).exists())
+        self.assertEqual(response.json()["liked_count"], 0)
 
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": 3}))
@@ -161,7 +538,381 @@ class TestUnlikeView(TestCase):
         self.assertEqual(Like.objects.count(), 1)
 
     def test_failure_post_with_unliked_tweet(self):
-        Like.objects.all().delete()
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet01.pk}))
         response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet01.pk}))
         self.assertEqual(response.status_code, 200)
         self.assertFalse(Like.objects.filter(user=self.user01, tweet=self.tweet01).count(), 0)
+        self.assertEqual(response.json()["liked_count"], 0)
+
+
+class TestLikeStateView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+        self.url = reverse("tweets:like_state", kwargs={"pk": self.tweet01.pk})
+
+    def post(self, liked, key=None, url=None):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        return self.client.post(url or self.url, {"liked": liked}, content_type="application/json", **headers)
+
+    def test_success_post(self):
+        response = self.post(True)
+        self.assertEqual(response.json(), {"liked_count": 1, "tweet_id": self.tweet01.pk, "is_liked": True})
+        self.assertTrue(Like.objects.filter(user=self.user01, tweet=self.tweet01).exists())
+        response = self.post(False)
+        self.assertEqual(response.json()["liked_count"], 0)
+        self.assertFalse(Like.objects.exists())
+
+    def test_double_click_does_not_write(self):
+        self.post(True)
+        with self.assertNumQueries(9):
+            # セッション、ユーザー、失敗する INSERT とセーブポイント、いいね数の読み直しだけで、UPDATE はない
+            response = self.post(True)
+        self.assertEqual(response.json()["liked_count"], 1)
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 1)
+
+    def test_retry_with_same_idempotency_key(self):
+        self.assertEqual(self.post(True, key="key01").json()["liked_count"], 1)
+        self.post(False)
+        with self.assertNumQueries(2):
+            response = self.post(True, key="key01")
+        self.assertEqual(response.json()["liked_count"], 1)
+        self.assertFalse(Like.objects.exists())
+
+    def test_failure_post_with_not_exist_tweet(self):
+        response = self.post(True, url=reverse("tweets:like_state", kwargs={"pk": 100}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Like.objects.count(), 0)
+
+    def test_failure_post_without_state(self):
+        response = self.client.post(self.url, {"liked": "yes"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post(self.url).status_code, 400)
+
+
+@override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_BACKEND="memory", LIKE_BUFFER_FLUSH_SECONDS=0)
+class TestLikeWriteBehind(TestCase):
+    def setUp(self):
+        cache.clear()
+        like_buffer.memory = like_buffer.MemoryBuffer()
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.client.login(username="testuser01", password="password15432")
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+
+    def like(self, name="like"):
+        return self.client.post(reverse(f"tweets:{name}", kwargs={"pk": self.tweet01.pk})).json()["liked_count"]
+
+    def test_like_is_written_on_flush(self):
+        self.assertEqual(self.like(), 1)
+        self.assertEqual(self.like(), 1)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(liked_tweet_ids(self.user01, [self.tweet01.id]), {self.tweet01.id})
+
+        self.assertEqual(flush_pending_likes(), 1)
+        self.assertTrue(Like.objects.filter(user=self.user01, tweet=self.tweet01).exists())
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 1)
+        self.assertEqual(self.like(), 1)
+        self.assertEqual(len(like_buffer.memory), 0)
+
+    def test_like_and_unlike_before_flush(self):
+        self.assertEqual(self.like(), 1)
+        self.assertEqual(self.like("unlike"), 0)
+        self.assertEqual(liked_tweet_ids(self.user01, [self.tweet01.id]), set())
+        with self.assertNumQueries(5):
+            # セーブポイントの2つと、ユーザー、ツイート、既存のいいねを読む3つだけで、書き込みはない
+            self.assertEqual(flush_pending_likes(), 2)
+        self.assertFalse(Like.objects.exists())
+
+    def test_flush_in_batches(self):
+        users = [
+            User.objects.create_user(username=f"testuser1{i}", email=f"testuser1{i}@example.com") for i in range(5)
+        ]
+        client = Client()
+        for user in users:
+            client.force_login(user)
+            client.post(reverse("tweets:like", kwargs={"pk": self.tweet01.pk}))
+        Like.objects.create(user=self.user01, tweet=self.tweet01)
+        Tweet.objects.filter(pk=self.tweet01.pk).update(liked_count=1)
+        self.like("unlike")
+        self.assertEqual(self.like("like") - 1, 5)
+
+        flushed = []
+        while count := flush_pending_likes(batch_size=2):
+            flushed.append(count)
+        self.assertEqual(flushed, [2, 2, 2, 1])
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 6)
+        self.assertEqual(Like.objects.filter(tweet=self.tweet01).count(), 6)
+
+    @override_settings(LIKE_BUFFER_BACKEND="cache")
+    def test_cache_buffer(self):
+        self.assertEqual(self.like(), 1)
+        other = User.objects.create_user(username="testuser02", email="testuser02@example.com")
+        self.assertEqual(liked_tweet_ids(other, [self.tweet01.id]), set())
+        self.assertEqual(len(like_buffer.shared), 1)
+
+        out = StringIO()
+        call_command("flush_likes", stdout=out)
+        self.assertIn("1件", out.getvalue())
+        self.assertEqual(Like.objects.filter(user=self.user01, tweet=self.tweet01).count(), 1)
+        self.assertEqual(like_buffer.shared.delta(self.tweet01.pk), 0)
+        self.assertEqual(self.like("unlike"), 0)
+        flush_pending_likes()
+        self.assertFalse(Like.objects.exists())
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 0)
+
+
+class TestLiveUpdates(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "memory", live.MemoryBroker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+
+    def test_broker_coalesces_updates(self):
+        for liked_count in [1, 2, 3]:
+            live.publish_like(self.tweet01.pk, liked_count)
+        live.publish_like(self.tweet01.pk + 1, 1)
+        live.publish_tweet()
+        bucket = live.current_bucket()
+        self.assertEqual(
+            live.memory.collect(bucket - 1, bucket + 1),
+            {"likes": {self.tweet01.pk: 3, self.tweet01.pk + 1: 1}, "new_tweets": 1},
+        )
+
+    @override_settings(LIVE_BROKER="cache")
+    def test_cache_broker(self):
+        cache.clear()
+        patcher = mock.patch.object(live, "shared", live.CacheBroker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        live.publish_like(self.tweet01.pk, 1)
+        live.publish_like(self.tweet01.pk, 2)
+        bucket = live.current_bucket()
+        self.assertEqual(live.shared.collect(bucket - 1, bucket + 1), {"likes": {}, "new_tweets": 0})
+        live.shared.flush()
+        self.assertEqual(live.shared.collect(bucket - 1, bucket + 2), {"likes": {self.tweet01.pk: 2}, "new_tweets": 0})
+
+    def test_like_and_create_publish(self):
+        self.client.login(username="testuser01", password="password15432")
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet01.pk}))
+        self.client.post(reverse("tweets:create"), {"content": "テスト投稿02"})
+        bucket = live.current_bucket()
+        self.assertEqual(live.memory.collect(bucket - 1, bucket + 1), {"likes": {self.tweet01.pk: 1}, "new_tweets": 1})
+
+    @override_settings(LIVE_INTERVAL_SECONDS=0.05)
+    async def test_stream(self):
+        await sync_to_async(self.client.force_login)(self.user01)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        scope = {"type": "http", "method": "GET", "path": live.EVENTS_PATH, "headers": [(b"cookie", cookie.encode())]}
+        communicator = ApplicationCommunicator(live.events_app, scope)
+        await communicator.send_input({"type": "http.request"})
+        self.assertEqual((await communicator.receive_output(1))["status"], 200)
+        self.assertTrue((await communicator.receive_output(1))["body"].startswith(b"retry: "))
+
+        for liked_count in [1, 2]:
+            live.publish_like(self.tweet01.pk, liked_count)
+        message = await communicator.receive_output(1)
+        self.assertEqual(
+            message["body"], b'event: update\ndata: {"likes":{"%d":2},"new_tweets":0}\n\n' % self.tweet01.pk
+        )
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(1)
+
+    async def test_stream_without_login(self):
+        communicator = ApplicationCommunicator(live.events_app, {"type": "http", "path": live.EVENTS_PATH})
+        await communicator.send_input({"type": "http.request"})
+        self.assertEqual((await communicator.receive_output(1))["status"], 403)
+
+
+class TestLikeViewConcurrency(TransactionTestCase):
+    threads = 16
+    requests_per_thread = 10
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("インメモリDBはテーブル単位でロックする。DATABASE_PROFILE=production で実行する")
+        self.users = [
+            User.objects.create_user(username=f"testuser{i:02}", email=f"testuser{i:02}@example.com")
+            for i in range(self.threads)
+        ]
+        self.tweet01 = Tweet.objects.create(user=self.users[0], content="テスト投稿01")
+
+    def test_no_lock_errors(self):
+        urls = [reverse(name, kwargs={"pk": self.tweet01.pk}) for name in ("tweets:like", "tweets:unlike")]
+
+        def worker(user):
+            client = Client()
+            client.force_login(user)
+            try:
+                return [client.post(urls[i % 2]).status_code for i in range(self.requests_per_thread + 1)]
+            finally:
+                # CONN_MAX_AGE があると close_old_connections は閉じないので、スレッドの接続を確実に閉じる。
+                # 開いたままだとテスト用のデータベースを消した後に -wal と -shm が残る
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            statuses = [status for result in executor.map(worker, self.users) for status in result]
+
+        self.assertEqual(statuses, [200] * len(statuses))
+        # 各スレッドは like で終わるので、全員分のいいねが残る
+        self.assertEqual(Like.objects.filter(tweet=self.tweet01).count(), self.threads)
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, self.threads)
+
+
+class TestAsyncHomeView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        Tweet.objects.create(user=self.user01, content="テスト投稿01")
+
+    async def test_success_get(self):
+        await sync_to_async(self.async_client.force_login)(self.user01)
+        response = await self.async_client.get(reverse("tweets:async_home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tweet.content for tweet in response.context["tweets"]], ["テスト投稿01"])
+
+    async def test_failure_get_without_login(self):
+        response = await self.async_client.get(reverse("tweets:async_home"))
+        self.assertEqual(response.status_code, 302)
+
+
+class TestAsyncLikeView(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01")
+
+    async def test_success_post(self):
+        await sync_to_async(self.async_client.force_login)(self.user01)
+        response = await self.async_client.post(reverse("tweets:async_like", kwargs={"pk": self.tweet01.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["liked_count"], 1)
+        response = await self.async_client.post(reverse("tweets:async_like", kwargs={"pk": self.tweet01.pk}))
+        self.assertEqual(response.json()["liked_count"], 1)
+        self.assertEqual(await Like.objects.acount(), 1)
+
+        response = await self.async_client.post(reverse("tweets:async_unlike", kwargs={"pk": self.tweet01.pk}))
+        self.assertEqual(response.json()["liked_count"], 0)
+        self.assertEqual(await Like.objects.acount(), 0)
+
+    async def test_failure_post_with_not_exist_tweet(self):
+        await sync_to_async(self.async_client.force_login)(self.user01)
+        response = await self.async_client.post(reverse("tweets:async_like", kwargs={"pk": 1000}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestInvertedIndex(TestCase):
+    def setUp(self):
+        self.index = InvertedIndex("default")
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.tweets = Tweet.objects.bulk_create(
+            [Tweet(user=self.user01, content=content) for content in ["東京タワー", "京都タワー タワー", "東京 京都"]]
+        )
+        for tweet in self.tweets:
+            self.index.add(tweet)
+
+    def search(self, query, after=None, limit=10):
+        return [pk for _, pk in self.index.search(query.split(), 0, after, limit)]
+
+    def test_search(self):
+        self.assertEqual(self.search("タワー"), [self.tweets[1].pk, self.tweets[0].pk])
+        self.assertEqual(self.search("東京"), [self.tweets[2].pk, self.tweets[0].pk])
+        # bigram はそろっていても隣り合っていない「東京都」は本文との突き合わせで落とす
+        self.assertEqual(self.search("東京都"), [])
+        self.assertEqual(set(self.search("都")), {self.tweets[1].pk, self.tweets[2].pk})
+
+    def test_search_with_after(self):
+        first = self.index.search(["タワー"], 0, None, 1)
+        self.assertEqual(self.search("タワー", after=first[-1], limit=1), [self.tweets[0].pk])
+
+    def test_floor(self):
+        self.assertEqual(self.index.floor(["タワー"], 1), self.tweets[1].pk)
+        self.assertEqual(self.index.floor(["タワー"], 3), 0)
+
+    def test_remove(self):
+        self.index.remove(self.tweets[0].pk)
+        self.assertFalse(TweetSearchTerm.objects.filter(tweet=self.tweets[0]).exists())
+        self.assertEqual(self.search("タワー"), [self.tweets[1].pk])
+
+
+class TestLikedTweetIds(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.tweets = Tweet.objects.bulk_create(
+            [Tweet(user=self.user01, content=f"テスト投稿{i:02}") for i in range(3)]
+        )
+        Like.objects.create(user=self.user01, tweet=self.tweets[0])
+        Like.objects.create(user=self.user01, tweet=self.tweets[1])
+
+    def test_success_bounded_by_tweet_ids(self):
+        liked = liked_tweet_ids(self.user01, [self.tweets[1].id, self.tweets[2].id])
+        self.assertEqual(liked, {self.tweets[1].id})
+        with self.assertNumQueries(0):
+            liked_tweet_ids(self.user01, [self.tweets[0].id])
+
+    @override_settings(LIKED_TWEETS_CACHE_MAX_SIZE=1)
+    def test_success_heavy_liker(self):
+        liked_tweet_ids(self.user01, [self.tweets[0].id])
+        with self.assertNumQueries(1):
+            liked = liked_tweet_ids(self.user01, [self.tweets[1].id, self.tweets[2].id])
+        self.assertEqual(liked, {self.tweets[1].id})
+
+
+class TestRecountLikesCommand(TestCase):
+    def setUp(self):
+        self.user01 = User.objects.create_user(
+            username="testuser01",
+            email="testuser01@example.com",
+            password="password15432",
+        )
+        self.tweet01 = Tweet.objects.create(user=self.user01, content="テスト投稿01", liked_count=5)
+        self.tweet02 = Tweet.objects.create(user=self.user01, content="テスト投稿02")
+        Like.objects.create(user=self.user01, tweet=self.tweet02)
+
+    def test_success_repair(self):
+        out = StringIO()
+        call_command("recount_likes", stdout=out)
+        self.assertIn("2件", out.getvalue())
+        self.tweet01.refresh_from_db()
+        self.tweet02.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 0)
+        self.assertEqual(self.tweet02.liked_count, 1)
+
+    def test_success_dry_run(self):
+        call_command("recount_likes", "--dry-run", stdout=StringIO())
+        self.tweet01.refresh_from_db()
+        self.assertEqual(self.tweet01.liked_count, 5)
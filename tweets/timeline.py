@@ -0,0 +1,103 @@
+"""
+フォロー中ユーザーのツイートだけを並べるホームタイムラインの実体化。
+
+ツイート作成時に投稿者のフォロワーへ TimelineEntry を一括で書き込み(fan-out-on-write)、
+フォロワー数が TIMELINE_FANOUT_THRESHOLD を超える投稿者のツイートだけは読み込み時に合流させる
+(HomeTimelinePaginator)。
+FriendShip(following=A, follower=B) は「A が B をフォローしている」ことを表す。
+"""
+
+from django.conf import settings
+
+from accounts.models import FriendShip, User
+from tweets.models import TimelineEntry, Tweet
+from tweets.pagination import KeysetPaginator
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def follower_ids(user):
+    return FriendShip.objects.filter(follower=user).values_list("following", flat=True)
+
+
+def is_celebrity(user):
+    return user.follower_count > settings.TIMELINE_FANOUT_THRESHOLD
+
+
+def fan_out_tweet(tweet):
+    """ツイートを投稿者自身とフォロワー全員のタイムラインに書き込む。"""
+    add_to_own_timeline(tweet)
+    fan_out_to_followers(tweet)
+
+
+def add_to_own_timeline(tweet):
+    TimelineEntry.objects.get_or_create(owner_id=tweet.user_id, tweet=tweet, defaults={"created_at": tweet.created_at})
+
+
+def fan_out_to_followers(tweet):
+    if is_celebrity(tweet.user):
+        return
+    batch_size = settings.TIMELINE_FANOUT_BATCH_SIZE
+    for owner_ids in _chunks(follower_ids(tweet.user).iterator(chunk_size=batch_size), batch_size):
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=owner_id, tweet=tweet, created_at=tweet.created_at) for owner_id in owner_ids],
+            ignore_conflicts=True,
+        )
+
+
+def backfill(owner, followee):
+    """フォロー直後に、フォローした相手の最近のツイートをタイムラインに取り込む。"""
+    if owner != followee and is_celebrity(followee):
+        return
+    tweets = Tweet.objects.filter(user=followee).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner=owner, tweet_id=tweet_id, created_at=created_at)
+            for tweet_id, created_at in tweets.values_list("id", "created_at")
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def trim(owner, followee):
+    """フォロー解除時に、解除した相手のツイートをタイムラインから取り除く。"""
+    TimelineEntry.objects.filter(owner=owner, tweet__user=followee).delete()
+
+
+def celebrity_ids(user):
+    """user がフォローしている、fan-out されないユーザーの pk のクエリセット。"""
+    return User.objects.filter(
+        pk__in=FriendShip.objects.filter(following=user).values("follower"),
+        follower_count__gt=settings.TIMELINE_FANOUT_THRESHOLD,
+    ).values("pk")
+
+
+class HomeTimelinePaginator:
+    """
+    ホームタイムラインを (created_at, ツイートの id) の降順でキーセットページネーションする。
+    実体化されたエントリは (owner, created_at, tweet) の索引から、fan-out されないフォロー先のツイートは
+    (user, created_at, id) の索引から、カーソルの先の1ページ分だけキーを読み、合流させてからツイートを読む。
+    """
+
+    def __init__(self, user, per_page):
+        self.per_page = per_page
+        self.entries = KeysetPaginator(TimelineEntry.objects.filter(owner=user), per_page, pk_field="tweet_id")
+        self.celebrity_tweets = KeysetPaginator(Tweet.objects.filter(user__in=celebrity_ids(user)), per_page)
+
+    def page(self, cursor=None):
+        entry_keys, direction = self.entries.keys(cursor)
+        tweet_keys, _ = self.celebrity_tweets.keys(cursor)
+        # 閾値を超える前に書き込まれたエントリとは同じキーで重なるので、集合にしてから並べる
+        keys = sorted(set(entry_keys) | set(tweet_keys), reverse=direction != "prev")[: self.per_page + 1]
+        tweets = Tweet.objects.select_related("user").in_bulk([pk for _, pk in keys])
+        # キーを読んだ後に消えたツイートは飛ばす
+        return self.celebrity_tweets.build([tweets[pk] for _, pk in keys if pk in tweets], direction)
@@ -0,0 +1,193 @@
+"""
+トレンド (よく使われているハッシュタグ、よくいいねされているツイート) の集計。
+
+リクエストのたびに Like や TweetHashtag を GROUP BY しないよう、出来事を時間バケットごとの
+Count-Min Sketch に数える。各プロセスはまず手元のスケッチに数え、キャッシュ上の同じバケットのスケッチへ
+足し込む。スケッチからは項目を列挙できないので、プロセス内で多く数えた項目を候補としてスケッチと一緒に置く。
+
+refresh が直近 TRENDING_WINDOW_BUCKETS 個のバケットを古いものほど TRENDING_DECAY 倍ずつ割り引いて合計し、
+上位 TRENDING_SIZE 件を計算した時刻とともにキャッシュに置く。どこで計算するかは TRENDING_BACKEND で選ぶ。
+- "memory": プロセス内。キャッシュもプロセスごとなので、top が古くなった結果をその場で計算し直す。
+- "cache": キャッシュ上で共有する。各プロセスはタイマーで TRENDING_FLUSH_SECONDS ごとに足し込み、
+  refresh_trending コマンドが計算し直す。top はコマンドが止まっているときだけその場で計算し直す。
+"""
+
+import heapq
+import logging
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("hashtags", "tweets")
+
+SKETCH_WIDTH = 1024
+SKETCH_DEPTH = 4
+
+# 共有する候補は表示件数より多めに持ち、バケットをまたいだ合計で順位が入れ替わっても拾えるようにする
+CANDIDATES_PER_SIZE = 5
+
+
+class CountMinSketch:
+    """項目ごとの回数を、多めに見積もることはあっても少なく見積もることはない固定サイズの表で数える。"""
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, rows=None):
+        self.width = width
+        self.depth = depth
+        self.rows = rows or [array("Q", bytes(8 * width)) for _ in range(depth)]
+
+    def _columns(self, item):
+        # 組み込みの hash() はプロセスごとに値が変わるので、プロセス間で共有できる crc32 を使う
+        key = str(item).encode()
+        return [zlib.crc32(key, seed) % self.width for seed in range(self.depth)]
+
+    def add(self, item, count=1):
+        for row, column in zip(self.rows, self._columns(item)):
+            row[column] += count
+
+    def estimate(self, item):
+        return min(row[column] for row, column in zip(self.rows, self._columns(item)))
+
+    def merge(self, other):
+        for row, other_row in zip(self.rows, other.rows):
+            for column, count in enumerate(other_row):
+                if count:
+                    row[column] += count
+
+
+def current_bucket(now=None):
+    return int((now if now is not None else time.time()) // settings.TRENDING_BUCKET_SECONDS)
+
+
+def _sketch_key(kind, bucket):
+    return f"trending:sketch:{kind}:{bucket}"
+
+
+def _candidates_key(kind, bucket):
+    return f"trending:candidates:{kind}:{bucket}"
+
+
+def _top_key(kind):
+    return f"trending:top:{kind}"
+
+
+class LocalCounter:
+    """プロセス内の、まだ共有していない回数。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.timer = None
+
+    def add(self, kind, items, bucket):
+        with self.lock:
+            sketch, candidates = self.pending.setdefault((kind, bucket), (CountMinSketch(), Counter()))
+            for item in items:
+                sketch.add(item)
+                candidates[item] += 1
+            self._schedule()
+
+    def _schedule(self):
+        # "memory" では refresh が足し込むので、共有するときだけ、次の出来事が来ないプロセスの分もタイマーで送る
+        if settings.TRENDING_BACKEND == "cache" and self.timer is None:
+            self.timer = threading.Timer(settings.TRENDING_FLUSH_SECONDS, self._flush_later)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_later(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("トレンドの回数をキャッシュに足し込めませんでした。次の回にやり直します。")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending, self.timer = self.pending, {}, None
+        for (kind, bucket), (sketch, candidates) in pending.items():
+            if not _merge_into_cache(kind, bucket, sketch, candidates):
+                # ほかのプロセスが書き込み中なら、次のフラッシュに回す
+                with self.lock:
+                    local_sketch, local_candidates = self.pending.setdefault(
+                        (kind, bucket), (CountMinSketch(), Counter())
+                    )
+                    local_sketch.merge(sketch)
+                    local_candidates.update(candidates)
+                    self._schedule()
+
+
+def _merge_into_cache(kind, bucket, sketch, candidates):
+    lock_key = f"trending:lock:{kind}:{bucket}"
+    if not cache.add(lock_key, 1, timeout=5):
+        return False
+    try:
+        timeout = settings.TRENDING_BUCKET_SECONDS * (settings.TRENDING_WINDOW_BUCKETS + 1)
+        shared = cache.get_many([_sketch_key(kind, bucket), _candidates_key(kind, bucket)])
+        rows = shared.get(_sketch_key(kind, bucket))
+        if rows is not None:
+            sketch.merge(CountMinSketch(rows=rows))
+        merged = Counter(shared.get(_candidates_key(kind, bucket), {}))
+        merged.update(candidates)
+        limit = settings.TRENDING_SIZE * CANDIDATES_PER_SIZE
+        cache.set_many(
+            {
+                _sketch_key(kind, bucket): sketch.rows,
+                _candidates_key(kind, bucket): dict(merged.most_common(limit)),
+            },
+            timeout,
+        )
+        return True
+    finally:
+        cache.delete(lock_key)
+
+
+local = LocalCounter()
+
+
+def record(kind, items, now=None):
+    """kind の items がそれぞれ1回ずつ起きたことを数える。"""
+    if items:
+        local.add(kind, list(items), current_bucket(now))
+
+
+def refresh(now=None):
+    """直近のバケットを減衰させて合計し、種類ごとの上位を [(項目, スコア)] としてキャッシュに置く。"""
+    local.flush()
+    refreshed_at = now if now is not None else time.time()
+    newest = current_bucket(refreshed_at)
+    buckets = range(newest, newest - settings.TRENDING_WINDOW_BUCKETS, -1)
+    result = {}
+    for kind in KINDS:
+        shared = cache.get_many([_sketch_key(kind, b) for b in buckets] + [_candidates_key(kind, b) for b in buckets])
+        items = set()
+        for bucket in buckets:
+            items.update(shared.get(_candidates_key(kind, bucket), {}))
+        weighted = [
+            (settings.TRENDING_DECAY ** (newest - bucket), CountMinSketch(rows=shared[_sketch_key(kind, bucket)]))
+            for bucket in buckets
+            if _sketch_key(kind, bucket) in shared
+        ]
+        scores = ((sum(weight * sketch.estimate(item) for weight, sketch in weighted), item) for item in items)
+        top = [(item, round(score, 3)) for score, item in heapq.nlargest(settings.TRENDING_SIZE, scores)]
+        cache.set(
+            _top_key(kind), (refreshed_at, top), settings.TRENDING_BUCKET_SECONDS * settings.TRENDING_WINDOW_BUCKETS
+        )
+        result[kind] = top
+    return result
+
+
+def top(kind):
+    """計算済みの上位を返す。まだ計算されていないか古ければ、このプロセスで計算し直す。"""
+    refreshed_at, ranked = cache.get(_top_key(kind), (None, []))
+    # 共有するときは refresh_trending が計算し直すので、バケット1つ分より古いときだけ肩代わりする
+    max_age = (
+        settings.TRENDING_FLUSH_SECONDS if settings.TRENDING_BACKEND == "memory" else settings.TRENDING_BUCKET_SECONDS
+    )
+    if refreshed_at is None or time.time() - refreshed_at >= max_age:
+        ranked = refresh()[kind]
+    return ranked
@@ -5,9 +5,17 @@ from . import views
 app_name = "tweets"
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
+    path("async/home/", views.AsyncHomeView.as_view(), name="async_home"),
+    path("following/", views.FollowingTimelineView.as_view(), name="following_timeline"),
+    path("search/", views.SearchView.as_view(), name="search"),
+    path("hashtags/<str:name>/", views.HashtagTimelineView.as_view(), name="hashtag"),
+    path("mentions/<str:username>/", views.MentionTimelineView.as_view(), name="mentions"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("<int:pk>/like/state/", views.LikeStateView.as_view(), name="like_state"),
+    path("<int:pk>/like/async/", views.AsyncLikeView.as_view(), name="async_like"),
+    path("<int:pk>/unlike/async/", views.AsyncUnlikeView.as_view(), name="async_unlike"),
 ]
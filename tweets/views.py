@@ -1,22 +1,160 @@
+import hashlib
+import json
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, DeleteView, DetailView, ListView, View
+from django.views.generic import CreateView, DeleteView, DetailView, ListView, TemplateView, View
+
+from accounts.mixins import AsyncLoginRequiredMixin, ConditionalGetMixin
+from accounts.models import User
+from accounts.suggestions import suggestions_for
+from jobs.queue import enqueue
+from tweets import live, trending
+from tweets.deletion import delete_tweets
+from tweets.entities import extract_hashtags, normalize_hashtag
+from tweets.likes import alike_tweet, aunlike_tweet, liked_tweet_ids, liked_tweets_changed_at, set_like
+from tweets.models import Hashtag, Mention, Tweet, TweetHashtag
+from tweets.pagination import InvalidCursor, KeysetPaginator
+from tweets.search import search_tweets
+from tweets.tasks import process_tweet
+from tweets.timeline import HomeTimelinePaginator, add_to_own_timeline
 
-from tweets.models import Like, Tweet
+
+def timeline_json(page, liked_tweets):
+    return {
+        "tweets": [
+            {
+                "id": tweet.id,
+                "user": tweet.user.username,
+                "content": tweet.content,
+                "created_at": tweet.created_at.isoformat(),
+                "liked_count": tweet.liked_count,
+                "is_liked": tweet.id in liked_tweets,
+            }
+            for tweet in page
+        ],
+        "next_cursor": page.next_cursor,
+        "previous_cursor": page.previous_cursor,
+    }
 
 
 class HomeView(LoginRequiredMixin, ListView):
     model = Tweet
     context_object_name = "tweets"
     template_name = "tweets/home.html"
-    ordering = "-created_at"
-    queryset = Tweet.objects.prefetch_related("likes").select_related("user").all()
+    paginate_by = 20
+    queryset = Tweet.objects.select_related("user").all()
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return KeysetPaginator(queryset, per_page)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("不正なカーソルです。")
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["liked_tweets"] = liked_tweet_ids(self.request.user, [tweet.id for tweet in context["tweets"]])
+        context["trending_hashtags"] = trending.top("hashtags")
+        # テンプレートが表示するときにだけ読むよう、呼び出せる形で渡す
+        context["suggested_users"] = partial(suggestions_for, self.request.user)
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get("format") != "json":
+            return super().render_to_response(context, **response_kwargs)
+        return JsonResponse(timeline_json(context["page_obj"], context["liked_tweets"]))
+
+
+class AsyncHomeView(AsyncLoginRequiredMixin, View):
+    paginate_by = 20
+
+    async def get(self, request, *args, **kwargs):
+        paginator = KeysetPaginator(Tweet.objects.select_related("user").all(), self.paginate_by)
+        try:
+            page = await paginator.apage(request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("不正なカーソルです。")
+        liked_tweets = await sync_to_async(liked_tweet_ids)(request.user, [tweet.id for tweet in page])
+        if request.GET.get("format") == "json":
+            return JsonResponse(timeline_json(page, liked_tweets))
+        context = {
+            "tweets": page.object_list,
+            "page_obj": page,
+            "is_paginated": page.has_other_pages(),
+            "liked_tweets": liked_tweets,
+        }
+        # コンテキストプロセッサがセッションやメッセージを読むため、描画は同期スレッドで行う
+        return await sync_to_async(render)(request, "tweets/home.html", context)
+
+
+class FollowingTimelineView(HomeView):
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return HomeTimelinePaginator(self.request.user, per_page)
+
+
+class EntityTimelineView(HomeView):
+    """TweetHashtag や Mention のように (created_at, tweet) を持つ表の索引を使ってツイートを並べる。"""
+
+    template_name = "tweets/entity_timeline.html"
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset.select_related("tweet__user"), page_size, pk_field="tweet_id")
+        try:
+            page = paginator.page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("不正なカーソルです。")
+        page.object_list = [row.tweet for row in page]
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class HashtagTimelineView(EntityTimelineView):
+    def get_queryset(self):
+        self.hashtag = get_object_or_404(Hashtag, name=normalize_hashtag(self.kwargs["name"]))
+        return TweetHashtag.objects.filter(hashtag=self.hashtag)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = f"#{self.hashtag.name}"
+        return context
+
+
+class MentionTimelineView(EntityTimelineView):
+    def get_queryset(self):
+        self.user = get_object_or_404(User, username=self.kwargs["username"])
+        return Mention.objects.filter(user=self.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_tweets"] = Like.objects.filter(user=self.request.user).values_list("tweet", flat=True)
+        context["title"] = f"@{self.user.username}"
+        return context
+
+
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = "tweets/search.html"
+    paginate_by = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "")
+        try:
+            page = search_tweets(query, self.request.GET.get("cursor"), self.paginate_by)
+        except InvalidCursor:
+            raise Http404("不正なカーソルです。")
+        context["query"] = query
+        context["tweets"] = page.object_list
+        context["page_obj"] = page
+        context["liked_tweets"] = liked_tweet_ids(self.request.user, [tweet.id for tweet in page])
         return context
 
 
@@ -28,19 +166,43 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        # 投稿者のタイムラインにはすぐに載せ、フォロワーへの fan-out と索引はジョブに任せる
+        add_to_own_timeline(self.object)
+        enqueue(process_tweet, self.object.pk)
+        trending.record("hashtags", extract_hashtags(self.object.content))
+        live.publish_tweet()
+        return response
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
-    model = Tweet
+class TweetDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
+    queryset = Tweet.objects.select_related("user")
     context_object_name = "tweet"
     template_name = "tweets/detail.html"
 
+    def get_object(self, queryset=None):
+        # 版数を作るときに読んだツイートを、描画でもそのまま使う
+        if not hasattr(self, "object"):
+            self.object = super().get_object(queryset)
+        return self.object
+
+    def get_version(self):
+        # 本文は編集できないので、変わりうるのはいいね数と投稿者の名前、閲覧者のいいね状態だけ
+        tweet = self.get_object()
+        return [
+            tweet.pk,
+            tweet.liked_count,
+            tweet.user.updated_at,
+            bool(liked_tweet_ids(self.request.user, [tweet.pk])),
+        ]
+
+    def get_last_modified(self):
+        tweet = self.get_object()
+        return max(tweet.updated_at, tweet.user.updated_at, liked_tweets_changed_at(self.request.user))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_tweets"] = (
-            Like.objects.select_related("user").filter(user=self.request.user).values_list("tweet", flat=True)
-        )
+        context["liked_tweets"] = liked_tweet_ids(self.request.user, [self.object.id])
         return context
 
 
@@ -50,29 +212,84 @@ class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     template_name = "tweets/delete.html"
     success_url = reverse_lazy("tweets:home")
 
+    def get_object(self, queryset=None):
+        # test_func で読んだツイートを、確認画面と削除でもそのまま使う
+        if not hasattr(self, "object"):
+            self.object = super().get_object(queryset)
+        return self.object
+
     def test_func(self):
-        tweet = self.get_object()
-        return self.request.user == tweet.user
+        return self.request.user.pk == self.get_object().user_id
+
+    def form_valid(self, form):
+        delete_tweets([self.object])
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class LikeView(LoginRequiredMixin, View):
+    liked = True
+
+    def set_like(self, liked):
+        try:
+            liked_count = set_like(self.request.user, self.kwargs["pk"], liked)
+        except Tweet.DoesNotExist:
+            raise Http404("ツイートが見つかりません。")
+        return {"liked_count": liked_count, "tweet_id": self.kwargs["pk"], "is_liked": liked}
+
+    def post(self, request, *args, **kwargs):
+        return JsonResponse(self.set_like(self.liked))
+
+
+class UnlikeView(LikeView):
+    liked = False
+
+
+class LikeStateView(LikeView):
+    """
+    いいねを本文の {"liked": true/false} の状態にする。結果は状態で決まるので、二重クリックや再送では書き込みが起きない。
+    Idempotency-Key ヘッダーが同じ再送には、書き込みを試さずに最初の応答をそのまま返す。
+    """
+
     def post(self, request, *args, **kwargs):
-        tweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        Like.objects.get_or_create(user=self.request.user, tweet=tweet)
+        try:
+            liked = json.loads(request.body or b"{}").get("liked")
+        except (ValueError, AttributeError):
+            liked = None
+        if not isinstance(liked, bool):
+            return JsonResponse({"detail": "liked に true か false を指定してください。"}, status=400)
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return JsonResponse(self.set_like(liked))
+        cache_key = "like_idempotency:%s:%s" % (request.user.pk, hashlib.sha256(key.encode()).hexdigest())
+        context = cache.get(cache_key)
+        if context is None:
+            context = self.set_like(liked)
+            cache.set(cache_key, context, settings.LIKE_IDEMPOTENCY_TIMEOUT)
+        return JsonResponse(context)
+
+
+class AsyncLikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
+        try:
+            tweet = await Tweet.objects.aget(pk=kwargs["pk"])
+        except Tweet.DoesNotExist:
+            raise Http404("ツイートが見つかりません。")
         context = {
-            "liked_count": tweet.liked_count,
+            "liked_count": await alike_tweet(request.user, tweet),
             "tweet_id": tweet.id,
             "is_liked": True,
         }
         return JsonResponse(context)
 
 
-class UnlikeView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
-        tweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        Like.objects.filter(user=self.request.user, tweet=tweet).delete()
+class AsyncUnlikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
+        try:
+            tweet = await Tweet.objects.aget(pk=kwargs["pk"])
+        except Tweet.DoesNotExist:
+            raise Http404("ツイートが見つかりません。")
         context = {
-            "liked_count": tweet.liked_count,
+            "liked_count": await aunlike_tweet(request.user, tweet),
             "tweet_id": tweet.id,
             "is_liked": False,
         }